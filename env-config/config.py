@@ -109,6 +109,58 @@ WTF_CSRF_METHODS = ['DELETE', 'POST', 'PUT', 'PATCH']
 # "NONE", "SUMMARY", or "FULL"
 SECURITYGROUP_INSTANCE_DETAIL = 'FULL'
 
+# Number of threads CloudAux based watchers use to fan out their list and get calls, keyed by technology.
+# Technologies that are not listed here are slurped serially.
+# SLURP_CONCURRENCY = {'vpc': 8, 's3': 16}
+
+# Number of seconds to cache the regions that each account has enabled (opted in to).
+# Watchers skip the regions that an account has not enabled.
+# REGION_CATALOG_TTL = 3600
+
+# AWS calls are rate limited per account, service, and region with token buckets that are shared by all
+# of the workers through Redis (the Celery broker, unless this is set). Set this to '' to keep the buckets per process.
+# AWS_RATE_LIMIT_REDIS_URL = 'redis://localhost/0'
+# Calls per second. The rate is halved when AWS throttles a call, and slowly increased as calls succeed:
+# AWS_RATE_LIMIT_INITIAL_RATE = 20
+# AWS_RATE_LIMIT_MIN_RATE = 0.5
+# AWS_RATE_LIMIT_MAX_RATE = 100
+
+# Number of seconds the heavy EC2 describe calls (instances and tags) are shared between the Security Group,
+# EC2 Instance, and Elastic IP watchers for. Kept in Redis (the Celery broker, unless the URL is set). 0 disables this.
+# EC2_DESCRIBE_CACHE_TTL = 300
+# EC2_DESCRIBE_CACHE_REDIS_URL = 'redis://localhost/0'
+
+# The summary of the environment that the auditors use (accounts, S3 buckets, IAM IDs, VPCs, and CIDRs) can be shared
+# by the workers as a snapshot, in Redis ('redis', the Celery broker unless the URL is set) or in files ('file').
+# By default, each process builds its own. Sections that changed are rebuilt at most every REFRESH_INTERVAL seconds.
+# OBJECT_STORE_SNAPSHOT = 'redis'
+# OBJECT_STORE_SNAPSHOT_REDIS_URL = 'redis://localhost/0'
+# Required for 'file'. It must be owned by this user and not be writable by anyone else (it's created with 0700):
+# OBJECT_STORE_SNAPSHOT_PATH = '/var/lib/security_monkey/object_store'
+# OBJECT_STORE_REFRESH_INTERVAL = 60
+
+# Watchers that fingerprint their list output (like Lambda) only fetch the items whose fingerprint changed.
+# Every item is still fully fetched at least this often (seconds). 0 always fetches every item.
+# LIST_FINGERPRINT_MAX_AGE = 86400
+
+# Exceptions stored during a Celery task are coalesced and written in bulk once this many have been collected,
+# and at the end of the task.
+# EXCEPTION_BUFFER_SIZE = 100
+
+# Set to 'deduplicated' to store each distinct item revision config once, instead of in every revision. Run
+# `monkey compact_revision_configs` to convert the existing revisions (and to store the older ones as deltas).
+# REVISION_CONFIG_STORAGE = 'inline'
+# REVISION_CONFIG_KEYFRAME_INTERVAL = 10
+
+# Retention policies for the item revisions, applied daily by the scheduler (and by `monkey apply_retention`).
+# Keep only the newest N revisions of each item:
+# RETENTION_KEEP_REVISIONS = 100
+# Keep only the last revision of each day for the revisions older than this many days:
+# RETENTION_DAILY_AFTER_DAYS = 30
+# Delete the items that were deleted more than this many days ago:
+# RETENTION_INACTIVE_ITEM_DAYS = 365
+# RETENTION_CHUNK_SIZE = 5000
+
 # To alert on IAM Roles/Users/Groups and Managed Policies with Write capabilities
 # on sensitive services, enumerate the services here:
 # DEFAULT_SENSITIVE = ['cloudhsm', 'cloudtrail', 'acm', 'config', 'kms', 'lambda', 'organizations', 'rds', 'route53', 'shield']
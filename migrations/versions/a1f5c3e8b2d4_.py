@@ -0,0 +1,24 @@
+"""Adding the list output fingerprint to the item table
+
+Revision ID: a1f5c3e8b2d4
+Revises: 15e39d43395f
+Create Date: 2020-10-05 10:12:43.218516
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a1f5c3e8b2d4'
+down_revision = '15e39d43395f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('item', sa.Column('list_fingerprint', sa.String(length=64), nullable=True))
+    op.add_column('item', sa.Column('list_fingerprint_date', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('item', 'list_fingerprint_date')
+    op.drop_column('item', 'list_fingerprint')
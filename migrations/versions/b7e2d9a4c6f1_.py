@@ -0,0 +1,24 @@
+"""Adding the hash version to the item table
+
+Revision ID: b7e2d9a4c6f1
+Revises: a1f5c3e8b2d4
+Create Date: 2020-10-12 16:48:09.502731
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d9a4c6f1'
+down_revision = 'a1f5c3e8b2d4'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # The existing hashes were made with DeepHash (version 1), which is what NULL means. They are upgraded as the
+    # items are next watched.
+    op.add_column('item', sa.Column('hash_version', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('item', 'hash_version')
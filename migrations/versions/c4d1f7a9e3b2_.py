@@ -0,0 +1,24 @@
+"""Adding the occurrence count and last seen time to the exceptions table
+
+Revision ID: c4d1f7a9e3b2
+Revises: b7e2d9a4c6f1
+Create Date: 2020-10-14 11:03:27.640192
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c4d1f7a9e3b2'
+down_revision = 'b7e2d9a4c6f1'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('exceptions', sa.Column('occurrences', sa.Integer(), nullable=False, server_default='1'))
+    op.add_column('exceptions', sa.Column('last_seen', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('exceptions', 'last_seen')
+    op.drop_column('exceptions', 'occurrences')
@@ -0,0 +1,109 @@
+"""Adding the deduplicated item revision config table, and the delta columns to the item revision table
+
+Revision ID: d8a2b6c4f1e9
+Revises: c4d1f7a9e3b2
+Create Date: 2020-10-16 09:27:51.837214
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd8a2b6c4f1e9'
+down_revision = 'c4d1f7a9e3b2'
+
+from copy import deepcopy
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+itemrevision = sa.table('itemrevision',
+                        sa.column('id', sa.Integer),
+                        sa.column('item_id', sa.Integer),
+                        sa.column('config', postgresql.JSON),
+                        sa.column('config_delta', postgresql.JSON),
+                        sa.column('delta_base_id', sa.Integer))
+
+
+def upgrade():
+    op.create_table('itemrevisionconfig',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('hash', sa.String(length=64), nullable=False),
+    sa.Column('config', postgresql.JSON(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('hash')
+    )
+    op.add_column('itemrevision', sa.Column('config_id', sa.Integer(), nullable=True))
+    op.add_column('itemrevision', sa.Column('config_delta', postgresql.JSON(), nullable=True))
+    op.add_column('itemrevision', sa.Column('delta_base_id', sa.Integer(), nullable=True))
+    op.add_column('itemrevision', sa.Column('delta_depth', sa.Integer(), nullable=True))
+    op.create_foreign_key(None, 'itemrevision', 'itemrevisionconfig', ['config_id'], ['id'])
+    op.create_index(op.f('ix_itemrevision_config_id'), 'itemrevision', ['config_id'], unique=False)
+    op.create_index(op.f('ix_itemrevision_delta_base_id'), 'itemrevision', ['delta_base_id'], unique=False)
+
+
+def _apply_delta(document, delta):
+    """Applies the JSON Patch operations of a delta (as security_monkey.common.json_delta.apply_delta does)."""
+    for operation in delta:
+        tokens = [token.replace('~1', '/').replace('~0', '~') for token in operation['path'].split('/')[1:]]
+        value = deepcopy(operation.get('value'))
+        if not tokens:
+            document = value
+            continue
+
+        parent = document
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+
+        key = int(tokens[-1]) if isinstance(parent, list) else tokens[-1]
+        if operation['op'] == 'remove':
+            del parent[key]
+        else:
+            parent[key] = value
+
+    return document
+
+
+def _materialize_deltas(bind, batch_size=100):
+    """Stores the configs of the revisions that are deltas inline, a batch of items at a time."""
+    item_ids = [item_id for item_id, in bind.execute(
+        sa.select([itemrevision.c.item_id]).where(itemrevision.c.delta_base_id != None).distinct())]  # noqa
+
+    for start in range(0, len(item_ids), batch_size):
+        # The deltas are against earlier revisions of the same item:
+        revisions = {row.id: row for row in bind.execute(
+            sa.select([itemrevision.c.id, itemrevision.c.config, itemrevision.c.config_delta,
+                       itemrevision.c.delta_base_id])
+            .where(itemrevision.c.item_id.in_(item_ids[start:start + batch_size])))}
+
+        configs = {}
+        for revision in revisions.values():
+            # Walk back to a keyframe (or an already rebuilt revision), and then apply the deltas from there:
+            chain = []
+            while revision.delta_base_id is not None and revision.id not in configs:
+                chain.append(revision)
+                revision = revisions[revision.delta_base_id]
+
+            config = configs.get(revision.id, revision.config)
+            for revision in reversed(chain):
+                config = _apply_delta(deepcopy(config), revision.config_delta)
+                configs[revision.id] = config
+
+        if configs:
+            bind.execute(itemrevision.update().where(itemrevision.c.id == sa.bindparam('b_id'))
+                         .values(config=sa.bindparam('b_config')),
+                         [{'b_id': revision_id, 'b_config': config} for revision_id, config in configs.items()])
+
+
+def downgrade():
+    # The deduplicated configs are moved back inline, and then the configs of the deltas are rebuilt from them:
+    op.execute("UPDATE itemrevision SET config = itemrevisionconfig.config FROM itemrevisionconfig "
+               "WHERE itemrevision.config_id = itemrevisionconfig.id")
+    _materialize_deltas(op.get_bind())
+    op.drop_index(op.f('ix_itemrevision_delta_base_id'), table_name='itemrevision')
+    op.drop_index(op.f('ix_itemrevision_config_id'), table_name='itemrevision')
+    op.drop_constraint('itemrevision_config_id_fkey', 'itemrevision', type_='foreignkey')
+    op.drop_column('itemrevision', 'delta_depth')
+    op.drop_column('itemrevision', 'delta_base_id')
+    op.drop_column('itemrevision', 'config_delta')
+    op.drop_column('itemrevision', 'config_id')
+    op.drop_table('itemrevisionconfig')
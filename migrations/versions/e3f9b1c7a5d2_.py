@@ -0,0 +1,44 @@
+"""Adding the stored issue score, unjustified score, and issue count columns to the item table
+
+Revision ID: e3f9b1c7a5d2
+Revises: d8a2b6c4f1e9
+Create Date: 2020-10-18 14:05:12.402931
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e3f9b1c7a5d2'
+down_revision = 'd8a2b6c4f1e9'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('item', sa.Column('score', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('item', sa.Column('unjustified_score', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('item', sa.Column('issue_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Fill in the totals of the existing items:
+    op.execute("UPDATE item SET score = totals.score, unjustified_score = totals.unjustified_score, "
+               "issue_count = totals.issue_count "
+               "FROM (SELECT itemaudit.item_id AS item_id, COALESCE(SUM(itemaudit.score), 0) AS score, "
+               "COALESCE(SUM(CASE WHEN itemaudit.justified = false THEN itemaudit.score ELSE 0 END), 0) "
+               "AS unjustified_score, COUNT(itemaudit.id) AS issue_count "
+               "FROM itemaudit JOIN auditorsettings ON auditorsettings.id = itemaudit.auditor_setting_id "
+               "WHERE itemaudit.fixed = false AND auditorsettings.disabled = false "
+               "GROUP BY itemaudit.item_id) AS totals "
+               "WHERE item.id = totals.item_id")
+
+    op.create_index(op.f('ix_item_score'), 'item', ['score'], unique=False)
+    op.create_index(op.f('ix_item_unjustified_score'), 'item', ['unjustified_score'], unique=False)
+    op.create_index(op.f('ix_item_issue_count'), 'item', ['issue_count'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_item_issue_count'), table_name='item')
+    op.drop_index(op.f('ix_item_unjustified_score'), table_name='item')
+    op.drop_index(op.f('ix_item_score'), table_name='item')
+    op.drop_column('item', 'issue_count')
+    op.drop_column('item', 'unjustified_score')
+    op.drop_column('item', 'score')
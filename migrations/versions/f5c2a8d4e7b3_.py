@@ -0,0 +1,38 @@
+"""Adding the first seen, last seen, and latest active columns to the item table
+
+Revision ID: f5c2a8d4e7b3
+Revises: e3f9b1c7a5d2
+Create Date: 2020-10-19 10:42:37.118204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f5c2a8d4e7b3'
+down_revision = 'e3f9b1c7a5d2'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('item', sa.Column('first_seen', sa.DateTime(), nullable=True))
+    op.add_column('item', sa.Column('last_seen', sa.DateTime(), nullable=True))
+    op.add_column('item', sa.Column('latest_active', sa.Boolean(), nullable=True))
+
+    # Fill them in from the revisions of the existing items:
+    op.execute("UPDATE item SET first_seen = revisions.first_seen "
+               "FROM (SELECT item_id, MIN(date_created) AS first_seen FROM itemrevision GROUP BY item_id) "
+               "AS revisions WHERE item.id = revisions.item_id")
+    op.execute("UPDATE item SET last_seen = itemrevision.date_created, latest_active = itemrevision.active "
+               "FROM itemrevision WHERE itemrevision.id = item.latest_revision_id")
+
+    op.create_index(op.f('ix_item_last_seen'), 'item', ['last_seen'], unique=False)
+    op.create_index(op.f('ix_item_latest_active'), 'item', ['latest_active'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_item_latest_active'), table_name='item')
+    op.drop_index(op.f('ix_item_last_seen'), table_name='item')
+    op.drop_column('item', 'latest_active')
+    op.drop_column('item', 'last_seen')
+    op.drop_column('item', 'first_seen')
@@ -28,6 +28,7 @@ import psycopg2
 import traceback
 
 from security_monkey.exceptions import AccountNameExists
+from security_monkey.object_store import mark_stale
 
 account_registry = {}
 
@@ -105,6 +106,7 @@ class AccountManager(object, metaclass=AccountManagerType):
 
         db.session.add(account)
         db.session.commit()
+        mark_stale('accounts')
         db.session.refresh(account)
         account = self._load(account)
         db.session.expunge(account)
@@ -148,6 +150,7 @@ class AccountManager(object, metaclass=AccountManagerType):
 
         db.session.add(account)
         db.session.commit()
+        mark_stale('accounts')
         db.session.refresh(account)
         account = self._load(account)
         db.session.expunge(account)
@@ -177,6 +180,7 @@ class AccountManager(object, metaclass=AccountManagerType):
 
         db.session.add(account)
         db.session.commit()
+        mark_stale('accounts')
         db.session.refresh(account)
         account = self._load(account)
         return account
@@ -355,6 +359,7 @@ def delete_account_by_id(account_id):
         cur.execute('DELETE from account WHERE id = %s;', [account_id])
 
         conn.commit()
+        mark_stale()
     except Exception as e:
         app.logger.warn(traceback.format_exc())
     finally:
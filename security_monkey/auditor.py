@@ -20,30 +20,30 @@
 .. moduleauthor:: Patrick Kelley <pkelley@netflix.com>
 
 """
-from six import string_types, text_type
+from six import string_types
 
 from security_monkey import app, datastore, db
-from security_monkey.watcher import ChangeItem, ensure_item_has_latest_revision_id
+from security_monkey.watcher import ChangeItem
 from security_monkey.common.jinja import get_jinja_env
-from security_monkey.datastore import User, AuditorSettings, Item, ItemAudit, Technology, Account, ItemAuditScore, AccountPatternAuditScore
+from security_monkey.datastore import User, AuditorSettings, Item, ItemAudit, Technology, ItemAuditScore, AccountPatternAuditScore, \
+    update_item_scores
 from security_monkey.common.utils import send_email
 from security_monkey.account_manager import get_account_by_name
 from security_monkey.alerters.custom_alerter import report_auditor_changes
-from security_monkey.datastore import Account, Item, Technology, NetworkWhitelistEntry
-from policyuniverse.arn import ARN
+from security_monkey.object_store import AccountDirectory, CIDRIndex, load_object_store
 from sqlalchemy import and_
+from security_monkey.common.hashing import hash_config
+from policyuniverse.arn import ARN
+from policyuniverse.statement import Statement
 from collections import defaultdict
 from threading import Lock
 import json
-import netaddr
-import ipaddr
 import re
 import pkg_resources
 
 
 auditor_registry = defaultdict(list)
 
-
 class Categories:
     """ Define common issue categories to maintain consistency. """
     # Resource Policies:
@@ -143,13 +143,21 @@ class AuditorType(type):
                     auditor_registry[cls.index].append(cls)
 
 
-def add(to, key, value):
-    if not key:
-        return
-    if key in to:
-        to[key].add(value)
-    else:
-        to[key] = set([value])
+class CachedStatement(Statement):
+    """
+    A policy statement that works out who it allows, and its action summary, only once. The results are shared by
+    the check methods, and must not be modified.
+    """
+
+    def whos_allowed(self):
+        if not hasattr(self, '_whos_allowed'):
+            self._whos_allowed = super(CachedStatement, self).whos_allowed()
+        return self._whos_allowed
+
+    def action_summary(self):
+        if not hasattr(self, '_action_summary'):
+            self._action_summary = super(CachedStatement, self).action_summary()
+        return self._action_summary
 
 
 class Auditor(object, metaclass=AuditorType):
@@ -165,6 +173,8 @@ class Auditor(object, metaclass=AuditorType):
     support_watcher_indexes = []
     OBJECT_STORE = defaultdict(dict)
     OBJECT_STORE_LOCK = Lock()
+    CIDR_INDEX = None
+    ACCOUNT_DIRECTORY = None
 
     def __init__(self, accounts=None, debug=False):
         self.datastore = datastore.Datastore()
@@ -176,6 +186,9 @@ class Auditor(object, metaclass=AuditorType):
         self.current_support_items = {}
         self.override_scores = None
         self.current_method_name = None
+        # The parsed policies, by (config hash, policy keys), while `audit_objects` runs:
+        self.policy_cache = None
+        self.config_hashes = None
 
         if isinstance(self.team_emails,  string_types):
             self.emails.append(self.team_emails)
@@ -191,6 +204,9 @@ class Auditor(object, metaclass=AuditorType):
     def load_policies(self, item, policy_keys):
         """For a given item, return a list of all resource policies.
 
+        While `audit_objects` runs, the policies are parsed once for each item config (by its hash) and set of
+        `policy_keys`, and shared by all of the check methods. They must not be modified.
+
         Most items only have a single resource policy, typically found
         inside the config with the key, "Policy".
 
@@ -205,24 +221,43 @@ class Auditor(object, metaclass=AuditorType):
         Returns:
             list of Policy objects
         """
+        if self.policy_cache is None:
+            return self._parse_policies(item.config, policy_keys)
+
+        config_hash = self.config_hashes.get(id(item))
+        if config_hash is None:
+            config_hash = self.config_hashes[id(item)] = hash_config(item.config, [])[0]
+
+        key = (config_hash, tuple(policy_keys))
+        if key not in self.policy_cache:
+            self.policy_cache[key] = self._parse_policies(item.config, policy_keys)
+        return self.policy_cache[key]
+
+    @staticmethod
+    def _parse_policies(config, policy_keys):
         import dpath.util
         from dpath.exceptions import PathNotFound
         from policyuniverse.policy import Policy
 
+        def parse(document):
+            policy = Policy(document)
+            policy.statements = [CachedStatement(statement.statement) for statement in policy.statements]
+            return policy
+
         policies = list()
         for key in policy_keys:
             try:
-                policy = dpath.util.values(item.config, key, separator='$')
+                policy = dpath.util.values(config, key, separator='$')
                 if isinstance(policy, list):
                     for p in policy:
                         if not p:
                             continue
                         if isinstance(p, list):
-                            policies.extend([Policy(pp) for pp in p])
+                            policies.extend([parse(pp) for pp in p])
                         else:
-                            policies.append(Policy(p))
+                            policies.append(parse(p))
                 else:
-                    policies.append(Policy(policy))
+                    policies.append(parse(policy))
             except PathNotFound:
                 continue
         return policies
@@ -274,186 +309,31 @@ class Auditor(object, metaclass=AuditorType):
     @classmethod
     def _load_object_store(cls):
         with cls.OBJECT_STORE_LOCK:
-            if not cls.OBJECT_STORE:
-                cls._load_s3_buckets()
-                cls._load_userids()
-                cls._load_accounts()
-                cls._load_elasticips()
-                cls._load_vpcs()
-                cls._load_vpces()
-                cls._load_natgateways()
-                cls._load_network_whitelist()
-                cls._merge_cidrs()
-
-
-    @classmethod
-    def _merge_cidrs(cls):
-        """
-        We learned about CIDRs from the following functions:
-        -   _load_elasticips()
-        -   _load_vpcs()
-        -   _load_vpces()
-        -   _load_natgateways()
-        -   _load_network_whitelist()
-
-        These cidr's are stored in the OBJECT_STORE in a way that is not optimal:
-
-            OBJECT_STORE['cidr']['54.0.0.1'] = set(['123456789012'])
-            OBJECT_STORE['cidr']['54.0.0.0'] = set(['123456789012'])
-            ...
-            OBJECT_STORE['cidr']['54.0.0.255/32'] = set(['123456789012'])
-
-        The above example is attempting to illustrate that account `123456789012`
-        contains `54.0.0.0/24`, maybe from 256 elastic IPs.
-
-        If a resource policy were attempting to ingress this range as a `/24` instead
-        of as individual IPs, it would not work.  We need to use the `cidr_merge`
-        method from the `netaddr` library.  We need to preserve the account identifiers
-        that are associated with each cidr as well.
-
-        # Using:
-        # https://netaddr.readthedocs.io/en/latest/tutorial_01.html?highlight=summarize#summarizing-list-of-addresses-and-subnets
-        # import netaddr
-        # netaddr.cidr_merge(ip_list)
-
-        Step 1: Group CIDRs by account:
-        #   ['123456789012'] = ['IP', 'IP']
-
-        Step 2:
-        Merge each account's cidr's separately and repalce the OBJECT_STORE['cidr'] entry.
-
-        Return:
-            `None`.  Mutates the cls.OBJECT_STORE['cidr'] datastructure.
-        """
-        if not 'cidr' in cls.OBJECT_STORE:
-            return
-
-        # step 1
-        merged = defaultdict(set)
-        for cidr, accounts in list(cls.OBJECT_STORE['cidr'].items()):
-            for account in accounts:
-                merged[account].add(cidr)
-
-        del cls.OBJECT_STORE['cidr']
-
-        # step 2
-        for account, cidrs in list(merged.items()):
-            merged_cidrs = netaddr.cidr_merge(cidrs)
-            for cidr in merged_cidrs:
-                add(cls.OBJECT_STORE['cidr'], str(cidr), account)
+            load_object_store(cls.OBJECT_STORE)
+            cls._get_cidr_index()
+            cls._get_account_directory()
 
     @classmethod
-    def _load_s3_buckets(cls):
-        """Store the S3 bucket ARNs from all our accounts"""
-        results = cls._load_related_items('s3')
-        for item in results:
-            add(cls.OBJECT_STORE['s3'], item.name, item.account.identifier)
+    def _get_cidr_index(cls):
+        """The index of the OBJECT_STORE's CIDRs. Rebuilt whenever the CIDRs are (re)loaded."""
+        cidrs = cls.OBJECT_STORE.get('cidr', {})
+        if Auditor.CIDR_INDEX is None or Auditor.CIDR_INDEX.cidrs is not cidrs:
+            Auditor.CIDR_INDEX = CIDRIndex(cidrs)
+        return Auditor.CIDR_INDEX
 
     @classmethod
-    def _load_vpcs(cls):
-        """Store the VPC IDs. Also, extract & store network/NAT ranges."""
-        results = cls._load_related_items('vpc')
-        for item in results:
-            add(cls.OBJECT_STORE['vpc'], item.latest_config.get('id'), item.account.identifier)
-            add(cls.OBJECT_STORE['cidr'], item.latest_config.get('cidr_block'), item.account.identifier)
-
-            vpcnat_tags = text_type(item.latest_config.get('tags', {}).get('vpcnat', ''))
-            vpcnat_tag_cidrs = vpcnat_tags.split(',')
-            for vpcnat_tag_cidr in vpcnat_tag_cidrs:
-                add(cls.OBJECT_STORE['cidr'], vpcnat_tag_cidr.strip(), item.account.identifier)
-
-    @classmethod
-    def _load_vpces(cls):
-        """Store the VPC Endpoint IDs."""
-        results = cls._load_related_items('endpoint')
-        for item in results:
-            add(cls.OBJECT_STORE['vpce'], item.latest_config.get('id'), item.account.identifier)
-
-    @classmethod
-    def _load_elasticips(cls):
-        """Store the Elastic IPs."""
-        results = cls._load_related_items('elasticip')
-        for item in results:
-            add(cls.OBJECT_STORE['cidr'], item.latest_config.get('public_ip'), item.account.identifier)
-            add(cls.OBJECT_STORE['cidr'], item.latest_config.get('private_ip_address'), item.account.identifier)
-
-    @classmethod
-    def _load_natgateways(cls):
-        """Store the NAT Gateway CIDRs."""
-        results = cls._load_related_items('natgateway')
-        for gateway in results:
-            for address in gateway.latest_config.get('nat_gateway_addresses', []):
-                add(cls.OBJECT_STORE['cidr'], address['public_ip'], gateway.account.identifier)
-                add(cls.OBJECT_STORE['cidr'], address['private_ip'], gateway.account.identifier)
-
-    @classmethod
-    def _load_network_whitelist(cls):
-        """Stores the Network Whitelist CIDRs."""
-        whitelist_entries = NetworkWhitelistEntry.query.all()
-        for entry in whitelist_entries:
-            add(cls.OBJECT_STORE['cidr'], entry.cidr, '000000000000')
-
-    @classmethod
-    def _load_userids(cls):
-        """Store the UserIDs from all IAMUsers and IAMRoles."""
-        user_results = cls._load_related_items('iamuser')
-        role_results = cls._load_related_items('iamrole')
-
-        for item in user_results:
-            fixed_item = ensure_item_has_latest_revision_id(item)
-            if not fixed_item:
-                continue
-
-            add(cls.OBJECT_STORE['userid'], fixed_item.latest_config.get('UserId'), fixed_item.account.identifier)
-
-        for item in role_results:
-            fixed_item = ensure_item_has_latest_revision_id(item)
-            if not fixed_item:
-                continue
-
-            add(cls.OBJECT_STORE['userid'], fixed_item.latest_config.get('RoleId'), fixed_item.account.identifier)
-
-    @classmethod
-    def _load_accounts(cls):
-        """Store the account IDs of all friendly/thirdparty accounts."""
-        friendly_accounts = Account.query.filter(Account.third_party == False).all()
-        third_party = Account.query.filter(Account.third_party == True).all()
-
-        cls.OBJECT_STORE['ACCOUNTS']['DESCRIPTIONS'] = list()
-        cls.OBJECT_STORE['ACCOUNTS']['FRIENDLY'] = set()
-        cls.OBJECT_STORE['ACCOUNTS']['THIRDPARTY'] = set()
-
-        for account in friendly_accounts:
-            add(cls.OBJECT_STORE['ACCOUNTS'], 'FRIENDLY', account.identifier)
-            cls.OBJECT_STORE['ACCOUNTS']['DESCRIPTIONS'].append(dict(
-                name=account.name,
-                identifier=account.identifier,
-                label='friendly',
-                s3_name=account.getCustom('s3_name'),
-                s3_canonical_id=account.getCustom('canonical_id')))
-
-        for account in third_party:
-            add(cls.OBJECT_STORE['ACCOUNTS'], 'THIRDPARTY', account.identifier)
-            cls.OBJECT_STORE['ACCOUNTS']['DESCRIPTIONS'].append(dict(
-                name=account.name,
-                identifier=account.identifier,
-                label='thirdparty',
-                s3_name=account.getCustom('s3_name'),
-                s3_canonical_id=account.getCustom('canonical_id')))
-
-    @staticmethod
-    def _load_related_items(technology_name):
-        query = Item.query.join((Technology, Technology.id == Item.tech_id))
-        query = query.filter(Technology.name==technology_name)
-        return query.all()
+    def _get_account_directory(cls):
+        """The index of the OBJECT_STORE's accounts. Rebuilt whenever the accounts are (re)loaded."""
+        accounts = cls.OBJECT_STORE.get('ACCOUNTS', {})
+        if Auditor.ACCOUNT_DIRECTORY is None or Auditor.ACCOUNT_DIRECTORY.accounts is not accounts:
+            Auditor.ACCOUNT_DIRECTORY = AccountDirectory(accounts)
+        return Auditor.ACCOUNT_DIRECTORY
 
     def _get_account(self, key, value):
         """ _get_account('s3_name', 'blah') """
         if key == 'aws':
             return dict(name='AWS', identifier='AWS')
-        for account in self.OBJECT_STORE['ACCOUNTS']['DESCRIPTIONS']:
-            if text_type(account.get(key, '')).lower() == value.lower():
-                return account
+        return self._get_account_directory().find(key, value)
 
     def inspect_entity(self, entity, item):
         """A entity can represent an:
@@ -473,7 +353,7 @@ class Auditor(object, metaclass=AuditorType):
             'FRIENDLY' - The who is in an account Security Monkey knows about.
             'UNKNOWN' - The who is in an account Security Monkey does not know about.
         """
-        same = Account.query.filter(Account.name == item.account).first()
+        same = self._get_account_directory().identifier(item.account)
 
         if entity.category in ['arn', 'principal']:
             return self.inspect_entity_arn(entity, same, item)
@@ -511,20 +391,21 @@ class Auditor(object, metaclass=AuditorType):
 
     def inspect_entity_account(self, entity, account_number, same):
 
+        directory = self._get_account_directory()
+
         # Enrich the entity with account data if available.
-        for account in self.OBJECT_STORE['ACCOUNTS']['DESCRIPTIONS']:
-            if account['identifier'] == account_number:
-                entity.account_name = account['name']
-                entity.account_identifier = account['identifier']
-                break
+        account = directory.get(account_number)
+        if account:
+            entity.account_name = account['name']
+            entity.account_identifier = account['identifier']
 
         if account_number == '000000000000':
             return 'SAME'
-        if account_number == same.identifier:
+        if same and account_number == same:
             return 'SAME'
-        if account_number in self.OBJECT_STORE['ACCOUNTS']['FRIENDLY']:
+        if directory.is_friendly(account_number):
             return 'FRIENDLY'
-        if account_number in self.OBJECT_STORE['ACCOUNTS']['THIRDPARTY']:
+        if directory.is_thirdparty(account_number):
             return 'THIRDPARTY'
         return 'UNKNOWN'
 
@@ -542,10 +423,8 @@ class Auditor(object, metaclass=AuditorType):
 
     def inspect_entity_cidr(self, entity, same):
         values = set()
-        for str_cidr in self.OBJECT_STORE.get('cidr', []):
-            if ipaddr.IPNetwork(entity.value) in ipaddr.IPNetwork(str_cidr):
-                for account in self.OBJECT_STORE['cidr'].get(str_cidr, []):
-                    values.add(self.inspect_entity_account(entity, account, same))
+        for account in self._get_cidr_index().lookup(entity.value):
+            values.add(self.inspect_entity_account(entity, account, same))
         if not values:
             return set(['UNKNOWN'])
         return values
@@ -674,13 +553,19 @@ class Auditor(object, metaclass=AuditorType):
 
         methods = [getattr(self, method_name) for method_name in dir(self) if method_name.find("check_") == 0]
         app.logger.debug("methods: {}".format(methods))
-        for item in self.items:
-            for method in methods:
-                self.current_method_name = method.__name__
-                # If the check function is disabled by an entry on Settings/Audit Issue Scores
-                # the function will not be run and any previous issues will be cleared
-                if not self._is_current_method_disabled():
-                    method(item)
+        self.policy_cache = {}
+        self.config_hashes = {}
+        try:
+            for item in self.items:
+                for method in methods:
+                    self.current_method_name = method.__name__
+                    # If the check function is disabled by an entry on Settings/Audit Issue Scores
+                    # the function will not be run and any previous issues will be cleared
+                    if not self._is_current_method_disabled():
+                        method(item)
+        finally:
+            self.policy_cache = None
+            self.config_hashes = None
 
         self.override_scores = None
 
@@ -701,20 +586,16 @@ class Auditor(object, metaclass=AuditorType):
         :return: List of all items for the given technology and the given account.
         """
         prev_list = []
-        for account in self.accounts:
-            prev = self.datastore.get_all_ctype_filtered(tech=self.index, account=account, include_inactive=False)
-            # Returns a map of {Item: ItemRevision}
-            for item in prev:
-                item_revision = prev[item]
-                new_item = ChangeItem(index=self.index,
-                                      region=item.region,
-                                      account=item.account.name,
-                                      name=item.name,
-                                      arn=item.arn,
-                                      new_config=item_revision.config)
-                new_item.audit_issues = []
-                new_item.db_item = item
-                prev_list.append(new_item)
+        for item, config, account in self.datastore.iter_latest_revisions(tech=self.index, accounts=self.accounts):
+            new_item = ChangeItem(index=self.index,
+                                  region=item.region,
+                                  account=account,
+                                  name=item.name,
+                                  arn=item.arn,
+                                  new_config=config)
+            new_item.audit_issues = []
+            new_item.db_item = item
+            prev_list.append(new_item)
         return prev_list
 
     def read_previous_items_for_account(self, index, account):
@@ -723,16 +604,13 @@ class Auditor(object, metaclass=AuditorType):
         :return: List of all items for the given technology and the given account.
         """
         prev_list = []
-        prev = self.datastore.get_all_ctype_filtered(tech=index, account=account, include_inactive=False)
-        # Returns a map of {Item: ItemRevision}
-        for item in prev:
-            item_revision = prev[item]
+        for item, config, account_name in self.datastore.iter_latest_revisions(tech=index, accounts=[account]):
             new_item = ChangeItem(index=self.index,
                                   region=item.region,
-                                  account=item.account.name,
+                                  account=account_name,
                                   name=item.name,
                                   arn=item.arn,
-                                  new_config=item_revision.config)
+                                  new_config=config)
             new_item.audit_issues = []
             new_item.db_item = item
             prev_list.append(new_item)
@@ -747,6 +625,7 @@ class Auditor(object, metaclass=AuditorType):
 
         # Work around for issue where previous get's may cause commit to fail
         db.session.rollback()
+        rescored_item_ids = []
         for item in self.items:
             changes = False
             loaded = False
@@ -820,12 +699,17 @@ class Auditor(object, metaclass=AuditorType):
 
             if changes:
                 db.session.add(item.db_item)
+                rescored_item_ids.append(item.db_item.id)
             else:
                 if loaded:
                     db.session.expunge(item.db_item)
 
         db.session.commit()
         self._create_auditor_settings()
+
+        # The new issues count once their auditor settings are assigned:
+        update_item_scores(rescored_item_ids)
+        db.session.commit()
         report_auditor_changes(self)
 
     def email_report(self, report):
@@ -12,10 +12,9 @@ class EC2ImageAuditor(Auditor):
 
     def prep_for_audit(self):
         super(EC2ImageAuditor, self).prep_for_audit()
-        self.FRIENDLY = {account['identifier']: account['name']
-                         for account in self.OBJECT_STORE['ACCOUNTS']['DESCRIPTIONS'] if account['label'] == 'friendly'}
-        self.THIRDPARTY = {account['identifier']: account['name'] for account in
-                           self.OBJECT_STORE['ACCOUNTS']['DESCRIPTIONS'] if account['label'] == 'thirdparty'}
+        directory = self._get_account_directory()
+        self.FRIENDLY = {account['identifier']: account['name'] for account in directory.labelled('friendly')}
+        self.THIRDPARTY = {account['identifier']: account['name'] for account in directory.labelled('thirdparty')}
 
     def check_internet_accessible(self, item):
         accounts = {lp.get('UserId', lp.get('Group')) for lp in item.config.get('LaunchPermissions', [])}
@@ -33,8 +33,9 @@ class RDSSnapshotAuditor(Auditor):
 
     def prep_for_audit(self):
         super(RDSSnapshotAuditor, self).prep_for_audit()
-        self.FRIENDLY = { account['identifier']: account['name'] for account in self.OBJECT_STORE['ACCOUNTS']['DESCRIPTIONS'] if account['label'] == 'friendly'}
-        self.THIRDPARTY = { account['identifier']: account['name'] for account in self.OBJECT_STORE['ACCOUNTS']['DESCRIPTIONS'] if account['label'] == 'thirdparty'}
+        directory = self._get_account_directory()
+        self.FRIENDLY = {account['identifier']: account['name'] for account in directory.labelled('friendly')}
+        self.THIRDPARTY = {account['identifier']: account['name'] for account in directory.labelled('thirdparty')}
 
     def check_internet_accessible(self, item):
         if 'all' in item.config.get('Attributes', {}).get('restore', []):
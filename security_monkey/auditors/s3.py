@@ -38,10 +38,11 @@ class S3Auditor(ResourcePolicyAuditor):
 
     def prep_for_audit(self):
         super(S3Auditor, self).prep_for_audit()
-        self.FRIENDLY_S3NAMES = [text_type(account['s3_name']).lower() for account in self.OBJECT_STORE['ACCOUNTS']['DESCRIPTIONS'] if account['label'] == 'friendly']
-        self.THIRDPARTY_S3NAMES = [text_type(account['s3_name']).lower() for account in self.OBJECT_STORE['ACCOUNTS']['DESCRIPTIONS'] if account['label'] == 'thirdparty']
-        self.FRIENDLY_S3CANONICAL = [text_type(account['s3_canonical_id']).lower() for account in self.OBJECT_STORE['ACCOUNTS']['DESCRIPTIONS'] if account['label'] == 'friendly']
-        self.THIRDPARTY_S3CANONICAL = [text_type(account['s3_canonical_id']).lower() for account in self.OBJECT_STORE['ACCOUNTS']['DESCRIPTIONS'] if account['label'] == 'thirdparty']
+        directory = self._get_account_directory()
+        self.FRIENDLY_S3NAMES = [text_type(account['s3_name']).lower() for account in directory.labelled('friendly')]
+        self.THIRDPARTY_S3NAMES = [text_type(account['s3_name']).lower() for account in directory.labelled('thirdparty')]
+        self.FRIENDLY_S3CANONICAL = [text_type(account['s3_canonical_id']).lower() for account in directory.labelled('friendly')]
+        self.THIRDPARTY_S3CANONICAL = [text_type(account['s3_canonical_id']).lower() for account in directory.labelled('thirdparty')]
         self.INTERNET_ACCESSIBLE = [
             'http://acs.amazonaws.com/groups/global/AuthenticatedUsers'.lower(),
             'http://acs.amazonaws.com/groups/global/AllUsers'.lower()]
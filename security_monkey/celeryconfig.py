@@ -33,6 +33,12 @@ security_monkey_watcher_ignore = set([])
 # This will specify the technologies that workers for the above Redis broker should exclusively watch.
 security_monkey_only_watch = set([])
 # ^^ If this is specified, the `security_monkey_watcher_ignore` variable is ignored for this stack.
+
+# Batched watchers (like IAM Roles) can dispatch each batch as its own task so that the work is spread across all of
+# the workers. This requires a result backend (the Redis broker above works) so the deleted items can be found once
+# all of the batches have completed:
+security_monkey_parallel_batches = False
+# result_backend = broker_url
 #################
 
 # DO NOT TOUCH ANYTHING BELOW THIS LINE:
@@ -40,6 +46,9 @@ timezone = "UTC"
 enable_utc = True
 imports = ('security_monkey.task_scheduler.tasks',)
 
+# Only the tasks that need their results stored (like the parallel batches) will store them:
+task_ignore_result = True
+
 ###########################
 # IMPORTANT: This helps avoid memory leak issues - do not change this number!
 worker_max_tasks_per_child = 1
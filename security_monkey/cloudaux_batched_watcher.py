@@ -1,7 +1,11 @@
+import json
+
 from security_monkey import app
 from security_monkey.cloudaux_watcher import CloudAuxWatcher
 from security_monkey.cloudaux_watcher import CloudAuxChangeItem
 from security_monkey.decorators import record_exception
+from security_monkey.common.regions import is_region_enabled
+from security_monkey.common.utils import encode_datetime, decode_datetime
 from cloudaux.decorators import iter_account_region
 
 
@@ -22,6 +26,12 @@ class CloudAuxBatchedWatcher(CloudAuxWatcher):
         @iter_account_region(self.service_name, accounts=self.account_identifiers,
                              regions=self._get_regions(), conn_type='dict')
         def get_item_list(**kwargs):
+            account_number = kwargs['conn_dict']['account_number']
+            region = kwargs['conn_dict']['region']
+            if not is_region_enabled(self._get_account(account_number), region):
+                app.logger.debug("Skipping disabled region: {}/{}/{}".format(self.index, account_number, region))
+                return list(), dict()
+
             kwargs, exception_map = self._add_exception_fields_to_kwargs(**kwargs)
             items = invoke_list_method(**kwargs)
 
@@ -38,6 +48,31 @@ class CloudAuxBatchedWatcher(CloudAuxWatcher):
 
         return items, exception_map
 
+    def get_batches(self):
+        """
+        Splits the total list into serialized batches of `batched_size` items.
+        This is used to dispatch each batch as an independent Celery task.
+
+        The list output can contain datetimes (like an IAM Role's CreateDate), which are preserved.
+        :return: List of JSON strings, one per batch.
+        """
+        return [json.dumps(self.total_list[i:i + self.batched_size], default=encode_datetime)
+                for i in range(0, len(self.total_list), self.batched_size)]
+
+    def load_batch(self, batch):
+        """
+        Loads a single batch (from `get_batches`) as the total list, so that the next `slurp` fetches exactly that
+        batch. `prep_for_batch_slurp` must be called before this.
+        """
+        self.total_list = json.loads(batch, object_hook=decode_datetime)
+        self.batch_counter = 0
+        self.done_slurping = not self.total_list
+
+    def fetch_items(self, account_number, region, list_items):
+        # Some batched watchers (like SQS) track the items in the total list as they are fetched:
+        self.load_batch(json.dumps(list_items, default=encode_datetime))
+        return super(CloudAuxBatchedWatcher, self).fetch_items(account_number, region, self.total_list)
+
     def slurp(self):
         @record_exception(source='{index}-watcher'.format(index=self.index), pop_exception_fields=True)
         def invoke_get_method(item, **kwargs):
@@ -62,6 +97,15 @@ class CloudAuxBatchedWatcher(CloudAuxWatcher):
                     continue
 
                 kwargs["conn_dict"]["region"] = cursor["Region"]    # Inject the region in.
+
+                # Unchanged per its list fingerprint -- there is nothing to fetch or persist:
+                if self._get_unchanged_item_id((cursor, item_name, kwargs)):
+                    item_counter += 1
+                    skip_counter += 1
+                    if item_counter == len(self.total_list):
+                        self.done_slurping = True
+                    continue
+
                 app.logger.debug("Account: {account}, Batched Watcher: {watcher}, Fetching item: "
                                  "{item}/{region}".format(account=kwargs["account_name"],
                                                           watcher=self.index,
@@ -84,6 +128,7 @@ class CloudAuxBatchedWatcher(CloudAuxWatcher):
                         source_watcher=self,
                         **kwargs)
                     item_list.append(item)
+                    self._remember_list_fingerprints([(cursor, item_name, kwargs)], [item])
                 else:
                     # Item not fetched (possibly deleted after grabbing the list) -- have to account in batch
                     skip_counter += 1
@@ -1,7 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import hashlib
+import json
+
 from security_monkey.watcher import Watcher, ChangeItem
 from security_monkey.decorators import record_exception
+from security_monkey.common.sts_connect import use_cache_for_cloudaux
+from security_monkey.common.regions import get_available_regions, is_region_enabled
 from cloudaux.decorators import iter_account_region
-from security_monkey import AWS_DEFAULT_REGION
+from security_monkey import app, db, AWS_DEFAULT_REGION
+
+# CloudAux calls share the process-wide STS credential and client caches:
+use_cache_for_cloudaux()
 
 
 class CloudAuxWatcher(Watcher):
@@ -12,6 +22,14 @@ class CloudAuxWatcher(Watcher):
     ephemeral_paths = ['_version']
     override_region = None
     service_name = None
+    # The CloudTrail eventSources (like 'iam.amazonaws.com') of the events that can change this technology's items.
+    # See `list_item_from_cloudtrail`.
+    cloudtrail_event_sources = []
+    # Fields of the list output that change whenever the item's details do. See `get_list_fingerprint`.
+    list_fingerprint_fields = []
+    # Number of threads used to fan out the list and get calls. 1 keeps everything serial.
+    # Can be overridden per technology with the SLURP_CONCURRENCY config dict.
+    slurp_concurrency = 1
 
     def list_method(self, **kwargs):
         raise Exception('Not Implemented')
@@ -24,6 +42,13 @@ class CloudAuxWatcher(Watcher):
 
     def __init__(self, accounts=None, debug=None):
         super(CloudAuxWatcher, self).__init__(accounts=accounts, debug=debug)
+        self._accounts = {}
+        # (account name, region, name) -> (list fingerprint, item ID) of the items fetched less than
+        # LIST_FINGERPRINT_MAX_AGE seconds ago:
+        self._stored_list_fingerprints = None
+        # (account name, region, name) -> list fingerprint of the items fetched by this watcher, to be stored
+        # once they have been persisted:
+        self.list_fingerprints = {}
 
     def _get_account_name(self, identifier):
         idx = 0
@@ -31,19 +56,22 @@ class CloudAuxWatcher(Watcher):
             if ident == identifier:
                 return self.accounts[idx]
 
+    def _get_account(self, identifier):
+        if identifier not in self._accounts:
+            from security_monkey.datastore import Account
+            self._accounts[identifier] = Account.query.filter(Account.identifier == identifier).first()
+
+        return self._accounts[identifier]
+
     def _get_assume_role(self, identifier):
-        from security_monkey.datastore import Account
-        account = Account.query.filter(Account.identifier == identifier).first()
-        return account.getCustom("role_name") or 'SecurityMonkey'
+        return self._get_account(identifier).getCustom("role_name") or 'SecurityMonkey'
 
     def _get_regions(self):
-        from security_monkey.decorators import get_regions
-        from security_monkey.datastore import Account
-        # pick an arbitrary account:
-        identifier = self.account_identifiers[0]
-        account = Account.query.filter(Account.identifier == identifier).first()
-        _, regions = get_regions(account, self.service_name)
-        return regions
+        if not self.service_name:
+            return [AWS_DEFAULT_REGION]
+
+        # The regions each account has disabled are skipped per account/region pair, when the items are listed:
+        return get_available_regions(self.service_name)
 
     def _add_exception_fields_to_kwargs(self, **kwargs):
         exception_map = dict()
@@ -69,6 +97,191 @@ class CloudAuxWatcher(Watcher):
             exception_map.update(result[1])
         return items, exception_map
 
+    def get_slurp_concurrency(self):
+        """ Returns the number of threads to use when slurping this technology """
+        return app.config.get('SLURP_CONCURRENCY', {}).get(self.index, self.slurp_concurrency)
+
+    def _fan_out(self, func, jobs):
+        """
+        Runs func over every job and returns the results in the same order as the jobs.
+
+        With a concurrency of 1 this is a plain loop. Otherwise, the jobs are run on a bounded thread pool.
+        Each thread runs inside of an app context so that exception recording gets its own DB session.
+        """
+        concurrency = self.get_slurp_concurrency()
+        if concurrency <= 1 or len(jobs) <= 1:
+            return [func(job) for job in jobs]
+
+        def run_in_app_context(job):
+            with app.app_context():
+                return func(job)
+
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(jobs))) as executor:
+            return list(executor.map(run_in_app_context, jobs))
+
+    def _get_item(self, job):
+        """
+        Fetches the details of a single item from the list output.
+        :param job: Tuple of the list output item, the item name, and the account/region kwargs.
+        :return: CloudAuxChangeItem, or None if the item could not be fetched.
+        """
+        @record_exception(source='{index}-watcher'.format(index=self.index), pop_exception_fields=True)
+        def invoke_get_method(item, **kwargs):
+            return self.get_method(item, **kwargs['conn_dict'])
+
+        item, item_name, kwargs = job
+        item_details = invoke_get_method(item, name=item_name, **kwargs)
+        if not item_details:
+            return None
+
+        # Has the item name been updated? (Things like Security Groups and VPCs have friendlier names
+        # than just their ID's:
+        item_name = item_details.pop("DEFERRED_ITEM_NAME", item_name)
+
+        # Determine which region to record the item into.
+        # Some tech, like IAM, is global and so we record it as 'universal' by setting an override_region
+        # Some tech, like S3, requires an initial connection to us-east-1, though a buckets actual
+        # region may be different. Extract the actual region from item_details.
+        # Otherwise, just use the region where the boto connection was made.
+        record_region = self.override_region or \
+            item_details.get('Region') or kwargs['conn_dict']['region']
+        return CloudAuxChangeItem.from_item(
+            name=item_name,
+            item=item_details,
+            record_region=record_region,
+            source_watcher=self,
+            **kwargs)
+
+    def get_list_fingerprint(self, item):
+        """
+        Fingerprints the list output of an item. When this matches the fingerprint stored the last time that the
+        item was fetched, then the item has not changed, and `get_method` is skipped for it.
+        By default, this hashes the `list_fingerprint_fields`.
+        :return: The fingerprint, or None if the item must always be fetched.
+        """
+        if not self.list_fingerprint_fields:
+            return None
+
+        fields = [item.get(field) for field in self.list_fingerprint_fields]
+        return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _get_stored_list_fingerprints(self):
+        if self._stored_list_fingerprints is None:
+            self._stored_list_fingerprints = {}
+
+            # Items are fully fetched at least this often regardless, for anything the fingerprint doesn't cover:
+            max_age = app.config.get('LIST_FINGERPRINT_MAX_AGE', 86400)
+            if not max_age:
+                return self._stored_list_fingerprints
+
+            from security_monkey.datastore import Account, Item, Technology
+            fetched_after = datetime.datetime.utcnow() - datetime.timedelta(seconds=max_age)
+            query = db.session.query(Account.name, Item.region, Item.name, Item.list_fingerprint, Item.id) \
+                .join((Account, Item.account_id == Account.id)) \
+                .join((Technology, Item.tech_id == Technology.id)) \
+                .filter(Technology.name == self.index, Account.name.in_(self.accounts),
+                        Item.list_fingerprint != None, Item.list_fingerprint_date > fetched_after)  # noqa
+
+            for account_name, region, name, fingerprint, item_id in query:
+                self._stored_list_fingerprints[(account_name, region, name)] = (fingerprint, item_id)
+
+        return self._stored_list_fingerprints
+
+    def _get_unchanged_item_id(self, job):
+        """
+        :param job: Tuple of the list output item, the item name, and the account/region kwargs.
+        :return: The ID of the DB item if its list fingerprint is unchanged, otherwise None.
+        """
+        item, item_name, kwargs = job
+        location = (kwargs['account_name'], self.override_region or kwargs['conn_dict']['region'], item_name)
+        fingerprint, item_id = self._get_stored_list_fingerprints().get(location, (None, None))
+        if fingerprint and fingerprint == self.get_list_fingerprint(item):
+            return item_id
+
+        return None
+
+    def _skip_unchanged(self, jobs):
+        """
+        Splits the jobs (see `_get_item`) into the items that need to be fetched, and the ones that are unchanged
+        per their list fingerprint. The unchanged items are loaded from their latest revisions instead, so that
+        they are neither seen as changed nor deleted.
+        :return: The jobs to fetch, and the CloudAuxChangeItems of the unchanged items.
+        """
+        unchanged_jobs = {}
+        for job in jobs:
+            item_id = self._get_unchanged_item_id(job)
+            if item_id:
+                unchanged_jobs[item_id] = job
+
+        if not unchanged_jobs:
+            return jobs, []
+
+        from security_monkey.datastore import Account, Item, ItemRevision
+        query = db.session.query(Item, ItemRevision, Account.name) \
+            .join((ItemRevision, Item.latest_revision_id == ItemRevision.id)) \
+            .join((Account, Item.account_id == Account.id)) \
+            .filter(Item.id.in_(list(unchanged_jobs.keys())), ItemRevision.active == True)  # noqa
+
+        unchanged_items = []
+        skipped_jobs = set()
+        for db_item, revision, account_name in query:
+            skipped_jobs.add(id(unchanged_jobs[db_item.id]))
+            unchanged_items.append(CloudAuxChangeItem(index=self.index, account=account_name, region=db_item.region,
+                                                      name=db_item.name, arn=db_item.arn, config=revision.config,
+                                                      source_watcher=self))
+
+        # Anything that couldn't be loaded (like a since deleted item) is fetched after all:
+        jobs = [job for job in jobs if id(job) not in skipped_jobs]
+        app.logger.debug("Skipping {skipped} unchanged {technology} per their list fingerprints.".format(
+            skipped=len(unchanged_items), technology=self.i_am_plural))
+        return jobs, unchanged_items
+
+    def _remember_list_fingerprints(self, jobs, items):
+        """Remembers the list fingerprints of the fetched items, for `store_list_fingerprints`."""
+        for (list_item, _, _), item in zip(jobs, items):
+            if not item:
+                continue
+
+            fingerprint = self.get_list_fingerprint(list_item)
+            if fingerprint:
+                self.list_fingerprints[(item.account, item.region, item.name)] = fingerprint
+
+    def store_list_fingerprints(self):
+        """
+        Stores the list fingerprints of the items fetched by this watcher. This must only be done once the items
+        have been persisted, so that a stored fingerprint always means that the latest revision is current.
+        """
+        if not self.list_fingerprints:
+            return
+
+        from security_monkey.datastore import Account, Item, Technology
+        query = db.session.query(Item.id, Account.name, Item.region, Item.name) \
+            .join((Account, Item.account_id == Account.id)) \
+            .join((Technology, Item.tech_id == Technology.id)) \
+            .filter(Technology.name == self.index,
+                    Account.name.in_(set(account for account, _, _ in self.list_fingerprints)),
+                    Item.name.in_(set(name for _, _, name in self.list_fingerprints)))
+
+        now = datetime.datetime.utcnow()
+        mappings = []
+        for item_id, account_name, region, name in query:
+            fingerprint = self.list_fingerprints.get((account_name, region, name))
+            if fingerprint:
+                mappings.append({'id': item_id, 'list_fingerprint': fingerprint, 'list_fingerprint_date': now})
+
+        db.session.bulk_update_mappings(Item, mappings)
+        db.session.commit()
+        self.list_fingerprints = {}
+
+    def find_changes_batch(self, items, exception_map):
+        durable_items = super(CloudAuxWatcher, self).find_changes_batch(items, exception_map)
+        self.store_list_fingerprints()
+        return durable_items
+
+    def save(self):
+        super(CloudAuxWatcher, self).save()
+        self.store_list_fingerprints()
+
     def slurp(self):
         self.prep_for_slurp()
 
@@ -76,49 +289,75 @@ class CloudAuxWatcher(Watcher):
         def invoke_list_method(**kwargs):
             return self.list_method(**kwargs['conn_dict'])
 
-        @record_exception(source='{index}-watcher'.format(index=self.index), pop_exception_fields=True)
-        def invoke_get_method(item, **kwargs):
-            return self.get_method(item, **kwargs['conn_dict'])
-
+        # Only builds the per account/region arguments. The actual calls are made below so they can be fanned out:
         @iter_account_region(self.service_name, accounts=self.account_identifiers,
                              regions=self._get_regions(), conn_type='dict')
-        def slurp_items(**kwargs):
-            kwargs, exception_map = self._add_exception_fields_to_kwargs(**kwargs)
+        def get_region_kwargs(**kwargs):
+            account_number = kwargs['conn_dict']['account_number']
+            region = kwargs['conn_dict']['region']
+            if not is_region_enabled(self._get_account(account_number), region):
+                app.logger.debug("Skipping disabled region: {}/{}/{}".format(self.index, account_number, region))
+                return None
+
+            return self._add_exception_fields_to_kwargs(**kwargs)
 
-            results = []
+        def list_items(region):
+            kwargs, _ = region
             item_list = invoke_list_method(**kwargs)
             if not item_list:
-                return results, exception_map
+                return []
 
+            jobs = []
             for item in item_list:
                 item_name = self.get_name_from_list_output(item)
                 if item_name and self.check_ignore_list(item_name):
                     continue
 
-                item_details = invoke_get_method(item, name=item_name, **kwargs)
-                if item_details:
-                    # Has the item name been updated? (Things like Security Groups and VPCs have friendlier names
-                    # than just their ID's:
-                    item_name = item_details.pop("DEFERRED_ITEM_NAME", item_name)
-
-                    # Determine which region to record the item into.
-                    # Some tech, like IAM, is global and so we record it as 'universal' by setting an override_region
-                    # Some tech, like S3, requires an initial connection to us-east-1, though a buckets actual
-                    # region may be different. Extract the actual region from item_details.
-                    # Otherwise, just use the region where the boto connection was made.
-                    record_region = self.override_region or \
-                        item_details.get('Region') or kwargs['conn_dict']['region']
-                    item = CloudAuxChangeItem.from_item(
-                        name=item_name,
-                        item=item_details,
-                        record_region=record_region,
-                        source_watcher=self,
-                        **kwargs)
-                    results.append(item)
-
-            return results, exception_map
-
-        return self._flatten_iter_response(slurp_items())
+                jobs.append((item, item_name, kwargs))
+
+            return jobs
+
+        regions = get_region_kwargs()
+
+        # Fan out the list calls per account/region, and then the get calls per item.
+        # Both preserve ordering, so the result is identical to doing this serially:
+        jobs = [job for region_jobs in self._fan_out(list_items, regions) for job in region_jobs]
+        jobs, unchanged_items = self._skip_unchanged(jobs)
+        fetched_items = self._fan_out(self._get_item, jobs)
+        self._remember_list_fingerprints(jobs, fetched_items)
+        items = [item for item in fetched_items if item] + unchanged_items
+
+        exception_map = dict()
+        for _, region_exception_map in regions:
+            exception_map.update(region_exception_map)
+
+        return items, exception_map
+
+    def list_item_from_cloudtrail(self, event):
+        """
+        Maps a mutating CloudTrail event from one of the `cloudtrail_event_sources` to the affected item,
+        in the same format as the output of `list_method`. This is what lets the item be re-fetched
+        with `fetch_items` without a full slurp.
+        :return: The list output item, or None if the event doesn't affect an item of this technology.
+        """
+        return None
+
+    def fetch_items(self, account_number, region, list_items):
+        """
+        Fetches only the given items (in the format of the output of `list_method`) in the account and region.
+        :return: List of (list output item, CloudAuxChangeItem or None if it could not be fetched), and the
+                 exception map.
+        """
+        @iter_account_region(self.service_name, accounts=[account_number], regions=[region], conn_type='dict')
+        def get_region_kwargs(**kwargs):
+            return self._add_exception_fields_to_kwargs(**kwargs)
+
+        (kwargs, exception_map), = get_region_kwargs()
+        jobs = [(item, self.get_name_from_list_output(item), kwargs) for item in list_items]
+        items = self._fan_out(self._get_item, jobs)
+        self._remember_list_fingerprints(jobs, items)
+
+        return list(zip(list_items, items)), exception_map
 
 
 class CloudAuxChangeItem(ChangeItem):
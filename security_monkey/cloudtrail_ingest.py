@@ -0,0 +1,255 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.cloudtrail_ingest
+    :platform: Unix
+    :synopsis: Incremental watching from CloudTrail events.
+
+    Each mutating CloudTrail event is mapped to the item it affects (by the watchers that define
+    `cloudtrail_event_sources` and `list_item_from_cloudtrail`). Only those items are re-fetched, persisted,
+    audited and alerted on, and the events are stored as CloudTrailEntry rows against the items' revisions.
+
+    Events are read from a directory of files, which can be CloudTrail log files (`{"Records": [...]}`, optionally
+    gzipped), or JSON lines files with one event (or CloudWatch Event wrapping one) per line.
+
+.. version:: $$VERSION$$
+
+"""
+from collections import OrderedDict
+import datetime
+import gzip
+import json
+import os
+import shutil
+import traceback
+
+from security_monkey import app, db, sentry
+from security_monkey.alerter import Alerter
+from security_monkey.cloudaux_watcher import CloudAuxWatcher
+from security_monkey.datastore import Account, CloudTrailEntry, Item, ItemRevision, store_exception
+from security_monkey.datastore_utils import inactivate_item, result_from_item
+from security_monkey.monitors import get_monitors
+from security_monkey.watcher import watcher_registry
+
+READ_ONLY_PREFIXES = ('Get', 'List', 'Describe', 'Head', 'Lookup')
+
+EVENT_FILE_EXTENSIONS = ('.json', '.json.gz', '.jsonl')
+
+
+def read_event_file(path):
+    """Returns the CloudTrail events in the file."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        if path.endswith('.jsonl'):
+            events = [json.loads(line) for line in f if line.strip()]
+        else:
+            events = json.load(f).get('Records', [])
+
+    # CloudWatch Events wrap the CloudTrail event:
+    return [event.get('detail', event) for event in events]
+
+
+def is_mutating(event):
+    """Whether the (successful) event could have changed something."""
+    if event.get('errorCode'):
+        return False
+
+    if 'readOnly' in event:
+        return not event['readOnly']
+
+    return not event.get('eventName', '').startswith(READ_ONLY_PREFIXES)
+
+
+def is_deletion(event):
+    return event['eventName'].startswith('Delete')
+
+
+def _parse_event_time(event_time):
+    return datetime.datetime.strptime(event_time, '%Y-%m-%dT%H:%M:%SZ')
+
+
+def get_watchers_by_event_source():
+    """Returns a dict of CloudTrail eventSource to the watcher classes that can ingest its events."""
+    watchers = {}
+    for watcher_class in watcher_registry.values():
+        if not issubclass(watcher_class, CloudAuxWatcher) or not watcher_class.active:
+            continue
+
+        for event_source in watcher_class.cloudtrail_event_sources:
+            watchers.setdefault(event_source, []).append(watcher_class)
+
+    return watchers
+
+
+def group_events(events):
+    """
+    Groups the mutating events by the watchers that can ingest them, and the account and region they happened in.
+    :return: OrderedDict of (watcher class, account number, region) to the list of events.
+    """
+    watchers_by_source = get_watchers_by_event_source()
+    groups = OrderedDict()
+    for event in events:
+        if not is_mutating(event):
+            continue
+
+        account_number = event.get('recipientAccountId') or (event.get('userIdentity') or {}).get('accountId')
+        for watcher_class in watchers_by_source.get(event.get('eventSource'), []):
+            groups.setdefault((watcher_class, account_number, event['awsRegion']), []).append(event)
+
+    return groups
+
+
+def store_cloudtrail_entry(event, db_item):
+    """Records the event against the latest revision of the item, unless it was already recorded."""
+    if CloudTrailEntry.query.filter(CloudTrailEntry.event_id == event['eventID']).count():
+        return
+
+    user_identity = event.get('userIdentity') or {}
+    db.session.add(CloudTrailEntry(
+        event_id=event['eventID'],
+        request_id=event.get('requestID'),
+        event_source=event['eventSource'],
+        event_name=event['eventName'],
+        event_time=_parse_event_time(event['eventTime']),
+        request_parameters=event.get('requestParameters'),
+        responseElements=event.get('responseElements'),
+        source_ip=(event.get('sourceIPAddress') or '')[:45],
+        user_agent=(event.get('userAgent') or '')[:300],
+        full_entry=event,
+        user_identity=user_identity,
+        user_identity_arn=user_identity.get('arn'),
+        revision_id=db_item.latest_revision_id,
+        item_id=db_item.id
+    ))
+
+
+def _find_db_item(watcher, account, name, region):
+    """Finds the item without having fetched it. Some watchers give their items friendlier names, like "name (id)"."""
+    query = Item.query.filter(Item.account_id == account.id, Item.tech_id == watcher.technology.id,
+                              Item.region == region)
+    return query.filter(Item.name == name).first() or \
+        query.filter(Item.name.like('% ({})'.format(name))).first()
+
+
+def ingest_group(watcher_class, account, region, events, debug=False):
+    """
+    Re-fetches, persists, audits, and alerts on the items affected by the events of one watcher, account, and region.
+    """
+    from security_monkey.task_scheduler.tasks import _audit_specific_changes
+
+    monitors = get_monitors(account.name, [watcher_class.index], debug)
+    if not monitors:
+        return
+
+    monitor = monitors[0]
+    watcher = monitor.watcher
+    watcher.prep_for_batch_slurp()
+
+    # The affected items (as list output), and the events that affected each:
+    targets = OrderedDict()
+    for event in events:
+        list_item = watcher.list_item_from_cloudtrail(event)
+        if not list_item:
+            continue
+
+        name = watcher.get_name_from_list_output(list_item)
+        if watcher.check_ignore_list(name):
+            continue
+
+        key = json.dumps(list_item, sort_keys=True)
+        targets.setdefault(key, (list_item, name, []))[2].append(event)
+
+    if not targets:
+        return
+
+    app.logger.info("[+] Fetching {count} {technology} changed in {account}/{region} per CloudTrail.".format(
+        count=len(targets), technology=watcher.i_am_plural, account=account.name, region=region))
+
+    results, exception_map = watcher.fetch_items(account.identifier, region,
+                                                 [list_item for list_item, _, _ in targets.values()])
+    audit_items = watcher.find_changes_batch([item for _, item in results if item], exception_map)
+    _audit_specific_changes(monitor, audit_items, False, debug)
+
+    deleted_items = []
+    for (_, name, target_events), (_, item) in zip(targets.values(), results):
+        if item:
+            db_item = result_from_item(item, account, watcher.technology)
+        else:
+            db_item = _find_db_item(watcher, account, name, watcher.override_region or region)
+            if db_item and any(is_deletion(event) for event in target_events) and \
+                    ItemRevision.query.get(db_item.latest_revision_id).active:
+                inactivate_item(watcher, db_item, account, watcher.technology)
+                deleted_items.append(db_item)
+
+        # Nothing to correlate the events with if the item was never recorded:
+        if not db_item:
+            continue
+
+        for event in target_events:
+            store_cloudtrail_entry(event, db_item)
+
+    db.session.commit()
+    watcher.add_inactivated_items(deleted_items)
+    Alerter([monitor], account=account.name).report()
+
+
+def ingest_events(events, debug=False):
+    """
+    Ingests the CloudTrail events.
+    :return: True if all of the events were ingested, False if any failed (and should be retried).
+    """
+    succeeded = True
+    for (watcher_class, account_number, region), group in group_events(events).items():
+        account = Account.query.filter(Account.identifier == account_number, Account.active == True,  # noqa
+                                       Account.third_party == False).first()  # noqa
+        if not account:
+            continue
+
+        try:
+            ingest_group(watcher_class, account, region, group, debug)
+        except Exception as e:
+            if sentry:
+                sentry.captureException()
+            app.logger.error("[X] Unable to ingest CloudTrail events for {}/{}/{}: {}".format(
+                watcher_class.index, account.name, region, e))
+            app.logger.error(traceback.format_exc())
+            store_exception("cloudtrail-ingest", (watcher_class.index, account.name, region), e)
+            db.session.rollback()
+            succeeded = False
+
+    return succeeded
+
+
+def ingest_directory(directory, processed_directory=None, debug=False):
+    """
+    Ingests the event files in the directory. Files that are fully ingested are moved to the processed
+    directory (by default, a "processed" directory inside of the directory), and the others are left to be retried.
+    :return: The number of files ingested.
+    """
+    processed_directory = processed_directory or os.path.join(directory, 'processed')
+    ingested = 0
+    for file_name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, file_name)
+        if not os.path.isfile(path) or not file_name.endswith(EVENT_FILE_EXTENSIONS):
+            continue
+
+        if not ingest_events(read_event_file(path), debug=debug):
+            continue
+
+        if not os.path.isdir(processed_directory):
+            os.makedirs(processed_directory)
+        shutil.move(path, os.path.join(processed_directory, file_name))
+        ingested += 1
+
+    return ingested
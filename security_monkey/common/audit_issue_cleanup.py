@@ -22,7 +22,7 @@
 """
 
 from security_monkey.auditor import auditor_registry
-from security_monkey.datastore import AuditorSettings, Account, Technology, Datastore
+from security_monkey.datastore import AuditorSettings, Account, ItemAudit, Technology, Datastore, update_item_scores
 from security_monkey.watcher import ChangeItem
 from security_monkey import app, db
 
@@ -60,9 +60,9 @@ def _delete_issues(settings):
     tech = Technology.query.filter(Technology.id == settings.tech_id).first()
     if account and tech:
         # Report issues as fixed
-        db_items = Datastore().get_all_ctype_filtered(tech=tech.name, account=account.name, include_inactive=False)
+        db_items = Datastore().iter_latest_revisions(tech=tech.name, accounts=[account.name], include_config=False)
         items = []
-        for item in db_items:
+        for item, _, _ in db_items:
             new_item = ChangeItem(index=tech.name,
                                   region=item.region,
                                   account=account.name,
@@ -77,4 +77,10 @@ def _delete_issues(settings):
                 if issue.auditor_setting_id == settings.id:
                     item.confirmed_fixed_issues.append(issue)
 
+    # The issues are deleted with their settings, so their items need to be rescored afterwards:
+    item_ids = {item_id for item_id, in db.session.query(ItemAudit.item_id).filter(
+        ItemAudit.auditor_setting_id == settings.id).distinct()}
+
     db.session.delete(settings)
+    db.session.flush()
+    update_item_scores(item_ids)
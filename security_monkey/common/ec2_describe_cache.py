@@ -0,0 +1,151 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.common.ec2_describe_cache
+    :platform: Unix
+    :synopsis: Shares the heavy, paginated EC2 describe calls between the watchers that need them.
+
+    The Security Group, EC2 Instance, and Elastic IP watchers all describe the instances and/or tags of the same
+    account and region, on different workers, at around the same time. The full (all pages) responses are cached
+    for EC2_DESCRIBE_CACHE_TTL seconds -- about one scheduler cycle -- in Redis (the Celery broker by default), so
+    that each is only fetched once.
+
+.. version:: $$VERSION$$
+
+"""
+from collections import defaultdict
+import json
+import threading
+import time
+
+import redis
+
+from security_monkey import app
+from security_monkey.common.utils import encode_datetime, decode_datetime, get_redis_url
+
+# Default for the EC2_DESCRIBE_CACHE_TTL configuration option (seconds). 0 disables the cache:
+DEFAULT_TTL = 300
+
+# How long a worker may hold the lock for fetching a response -- the largest accounts take minutes:
+FETCH_LOCK_TIMEOUT = 600
+
+KEY_PREFIX = 'security_monkey:ec2_describe'
+
+
+class LocalResponseStore(object):
+    """Keeps the responses in this process. Used when Redis isn't configured or can't be reached."""
+
+    def __init__(self):
+        # key -> (expiration, JSON response)
+        self.responses = {}
+        self.lock = threading.Lock()
+        # One lock per key, so that only one thread fetches a given response:
+        self.fetch_locks = defaultdict(threading.Lock)
+
+    def get_or_fetch(self, key, ttl, fetch):
+        with self.lock:
+            fetch_lock = self.fetch_locks[key]
+
+        with fetch_lock:
+            with self.lock:
+                expiration, response = self.responses.get(key, (0, None))
+            if expiration <= time.time():
+                response = json.dumps(fetch(), default=encode_datetime)
+                with self.lock:
+                    self.responses[key] = (time.time() + ttl, response)
+
+        return json.loads(response, object_hook=decode_datetime)
+
+
+class RedisResponseStore(object):
+    """Keeps the responses in Redis so that they are shared by every worker."""
+
+    def __init__(self, url):
+        self.client = redis.StrictRedis.from_url(url)
+
+    def get_or_fetch(self, key, ttl, fetch):
+        redis_key = ':'.join([KEY_PREFIX] + list(key))
+        response = self.client.get(redis_key)
+        if response is None:
+            # Only one worker fetches the response. The others wait for it:
+            with self.client.lock(redis_key + ':lock', timeout=FETCH_LOCK_TIMEOUT,
+                                  blocking_timeout=FETCH_LOCK_TIMEOUT):
+                response = self.client.get(redis_key)
+                if response is None:
+                    response = json.dumps(fetch(), default=encode_datetime)
+                    self.client.set(redis_key, response, ex=ttl)
+
+        return json.loads(response, object_hook=decode_datetime)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if not _store:
+            url = get_redis_url('EC2_DESCRIBE_CACHE_REDIS_URL')
+            _store = RedisResponseStore(url) if url else LocalResponseStore()
+        return _store
+
+
+def _get_or_fetch(key, fetch):
+    ttl = app.config.get('EC2_DESCRIBE_CACHE_TTL', DEFAULT_TTL)
+    if not ttl:
+        return fetch()
+
+    global _store
+    store = get_store()
+    try:
+        return store.get_or_fetch(key, ttl, fetch)
+    except redis.exceptions.LockError as e:
+        app.logger.warn("[?] Timed out waiting for {} to be fetched. Fetching it instead. Error: {}".format(
+            '/'.join(key), e))
+        return fetch()
+    except redis.exceptions.RedisError as e:
+        app.logger.warn("[?] Unable to use Redis for the EC2 describe cache. Falling back to a per-process cache. "
+                        "Error: {}".format(e))
+        with _store_lock:
+            if _store is store:
+                _store = LocalResponseStore()
+        return get_store().get_or_fetch(key, ttl, fetch)
+
+
+def _describe_all(ec2, operation, result_key):
+    results = []
+    for page in ec2.get_paginator(operation).paginate():
+        results.extend(page[result_key])
+
+    return {result_key: results}
+
+
+def describe_instances(ec2, account_number, region):
+    """Returns the describe_instances response (with every page's Reservations) for the account and region."""
+    return _get_or_fetch((account_number, region, 'describe_instances'),
+                         lambda: _describe_all(ec2, 'describe_instances', 'Reservations'))
+
+
+def describe_tags(ec2, account_number, region):
+    """Returns the describe_tags response (with every page's Tags) for the account and region."""
+    return _get_or_fetch((account_number, region, 'describe_tags'),
+                         lambda: _describe_all(ec2, 'describe_tags', 'Tags'))
+
+
+def reset():
+    """Forgets the response store. Mostly for tests."""
+    global _store
+    with _store_lock:
+        _store = None
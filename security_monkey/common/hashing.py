@@ -0,0 +1,192 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.common.hashing
+    :platform: Unix
+    :synopsis: Versioned hashing of item configurations.
+
+    Each item stores the complete hash of its configuration, and the durable hash (without the watcher's ephemeral
+    paths), along with the `hash_version` they were made with. Items hashed with an older version are compared
+    with that version's hashes, so that changing the hashing doesn't make every item look changed.
+
+    Version 1 is `deepdiff.DeepHash` of the config (and of the config without the ephemeral paths).
+    Version 2 streams a canonical (key sorted, compact) JSON serialization of the config into BLAKE2b. The complete
+    and durable hashes are made in a single walk that leaves the ephemeral paths out of the durable hash.
+
+.. version:: $$VERSION$$
+
+"""
+from fnmatch import fnmatchcase
+from functools import lru_cache
+import hashlib
+import json
+
+from deepdiff import DeepHash
+
+# The version that new hashes are made with:
+HASH_VERSION = 2
+
+# Items hashed before hash versions were recorded:
+LEGACY_HASH_VERSION = 1
+
+EPHEMERAL_PATH_SEPARATOR = '$'
+
+
+def _encode(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def _encode_key(key):
+    # The same as how `json.dumps` encodes the keys:
+    return json.dumps(key if isinstance(key, str) else _encode(key))
+
+
+class EphemeralPaths(object):
+    """
+    A compiled set of ephemeral paths, like `AccessKeys$*$LastUsedDate`. Each segment of a path is a key of a dict
+    or an index of a list, and can be a glob. Use `compile_ephemeral_paths` to get one.
+    """
+
+    def __init__(self, ephemeral_paths):
+        self.patterns = tuple(tuple(path.split(EPHEMERAL_PATH_SEPARATOR)) for path in ephemeral_paths)
+
+    @staticmethod
+    def match(patterns, segment):
+        """
+        :return: The patterns that continue to match below the segment, and whether a pattern matched the segment
+                 entirely (making it ephemeral).
+        """
+        remaining = []
+        ephemeral = False
+        for pattern in patterns:
+            if fnmatchcase(segment, pattern[0]):
+                if len(pattern) == 1:
+                    ephemeral = True
+                else:
+                    remaining.append(pattern[1:])
+
+        return remaining, ephemeral
+
+    def durable_view(self, config):
+        """
+        Returns the config without the ephemeral paths. This is not a copy: only the dicts and lists that contain
+        ephemeral paths are rebuilt, and everything else is shared with the config. Don't modify it.
+        """
+        return self._project(config, self.patterns)
+
+    def _project(self, value, patterns):
+        if not patterns:
+            return value
+
+        if isinstance(value, dict):
+            view = {}
+            for key, child in value.items():
+                child_patterns, ephemeral = self.match(patterns, str(key))
+                if not ephemeral:
+                    view[key] = self._project(child, child_patterns)
+            return view
+
+        if isinstance(value, (list, tuple)):
+            view = []
+            for index, child in enumerate(value):
+                child_patterns, ephemeral = self.match(patterns, str(index))
+                if not ephemeral:
+                    view.append(self._project(child, child_patterns))
+            return view
+
+        return value
+
+    def hash(self, config):
+        """
+        Streams the canonical serialization of the config into the complete and durable hashes.
+        :return: Tuple of the complete hash and the durable hash.
+        """
+        complete = hashlib.blake2b(digest_size=32)
+        durable = hashlib.blake2b(digest_size=32)
+
+        def update(data, is_durable):
+            data = data.encode('utf-8')
+            complete.update(data)
+            if is_durable:
+                durable.update(data)
+
+        def walk(value, patterns, is_durable):
+            # Nothing below here can be ephemeral, so this can be serialized in one go:
+            if not patterns or not isinstance(value, (dict, list, tuple)):
+                update(_encode(value), is_durable)
+                return
+
+            if isinstance(value, dict):
+                children = [(_encode_key(key), str(key), value[key]) for key in sorted(value)]
+                opening, closing = '{', '}'
+            else:
+                children = [(None, str(index), child) for index, child in enumerate(value)]
+                opening, closing = '[', ']'
+
+            update(opening, is_durable)
+            first_complete = first_durable = True
+            for encoded_key, segment, child in children:
+                child_patterns, ephemeral = self.match(patterns, segment)
+                child_durable = is_durable and not ephemeral
+
+                # The separators differ when an ephemeral entry is left out of the durable serialization:
+                if not first_complete:
+                    complete.update(b',')
+                if child_durable and not first_durable:
+                    durable.update(b',')
+                first_complete = False
+                first_durable = first_durable and not child_durable
+
+                if encoded_key:
+                    update(encoded_key + ':', child_durable)
+                walk(child, child_patterns, child_durable)
+
+            update(closing, is_durable)
+
+        walk(config, self.patterns, True)
+        return complete.hexdigest(), durable.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _compile_ephemeral_paths(ephemeral_paths):
+    return EphemeralPaths(ephemeral_paths)
+
+
+def compile_ephemeral_paths(ephemeral_paths):
+    """Returns the compiled `EphemeralPaths`. These are cached, so each set of paths is only compiled once."""
+    return _compile_ephemeral_paths(tuple(ephemeral_paths or []))
+
+
+def _deephash(config, ephemeral_paths):
+    durable_item = compile_ephemeral_paths(ephemeral_paths).durable_view(config)
+    return DeepHash(config)[config], DeepHash(durable_item)[durable_item]
+
+
+def _canonical_blake2b(config, ephemeral_paths):
+    return compile_ephemeral_paths(ephemeral_paths).hash(config)
+
+
+HASHERS = {
+    1: _deephash,
+    2: _canonical_blake2b,
+}
+
+
+def hash_config(config, ephemeral_paths, hash_version=HASH_VERSION):
+    """
+    Hashes the config.
+    :param hash_version: The version of the hashing to use. Defaults to the current version.
+    :return: Tuple of the complete hash, and the durable hash (which excludes the ephemeral paths).
+    """
+    return HASHERS[hash_version or LEGACY_HASH_VERSION](config, ephemeral_paths or [])
@@ -0,0 +1,89 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.common.json_delta
+    :platform: Unix
+    :synopsis: Deltas between JSON documents, as JSON Patch (RFC 6902) operations.
+
+    Only the `add`, `remove`, and `replace` operations are made. Dicts are compared key by key, and lists of the
+    same length index by index. Lists that change length are replaced entirely.
+
+.. version:: $$VERSION$$
+
+"""
+from copy import deepcopy
+
+
+def _escape(token):
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def _diff(old, new, path, operations):
+    # The types are compared as well, since True == 1 and 1 == 1.0:
+    if type(old) is not type(new):
+        operations.append({'op': 'replace', 'path': path, 'value': new})
+
+    elif isinstance(old, dict):
+        for key in old:
+            if key not in new:
+                operations.append({'op': 'remove', 'path': path + '/' + _escape(key)})
+
+        for key, value in new.items():
+            if key not in old:
+                operations.append({'op': 'add', 'path': path + '/' + _escape(key), 'value': value})
+            else:
+                _diff(old[key], value, path + '/' + _escape(key), operations)
+
+    elif isinstance(old, list) and len(old) == len(new):
+        for index, (old_value, new_value) in enumerate(zip(old, new)):
+            _diff(old_value, new_value, path + '/' + str(index), operations)
+
+    elif old != new:
+        operations.append({'op': 'replace', 'path': path, 'value': new})
+
+
+def make_delta(old, new):
+    """Returns the list of JSON Patch operations that turn the `old` document into the `new` one."""
+    operations = []
+    _diff(old, new, '', operations)
+    return operations
+
+
+def apply_delta(document, delta):
+    """
+    Applies the JSON Patch operations (from `make_delta`) to the document, which is modified in place.
+    :return: The patched document. This is a different object if the whole document was replaced.
+    """
+    for operation in delta:
+        tokens = [_unescape(token) for token in operation['path'].split('/')[1:]]
+        value = deepcopy(operation.get('value'))
+        if not tokens:
+            document = value
+            continue
+
+        parent = document
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+
+        key = int(tokens[-1]) if isinstance(parent, list) else tokens[-1]
+        if operation['op'] == 'remove':
+            del parent[key]
+        else:
+            parent[key] = value
+
+    return document
@@ -0,0 +1,254 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.common.rate_limiter
+    :platform: Unix
+    :synopsis: Token bucket rate limiting of AWS calls per (account, service, region).
+
+    The buckets are kept in Redis (the Celery broker by default) so that all of the workers calling the same
+    account, service, and region share them. The rate of each bucket is adjusted AIMD style: it is halved when
+    AWS throttles a call, and slowly increased as calls succeed.
+
+.. version:: $$VERSION$$
+
+"""
+import functools
+import threading
+import time
+
+import redis
+
+from security_monkey import app
+from security_monkey.common.utils import get_redis_url
+
+THROTTLING_ERROR_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'BandwidthLimitExceeded',
+    'SlowDown',
+])
+
+# Defaults for the AWS_RATE_LIMIT_* configuration options (calls per second):
+DEFAULT_INITIAL_RATE = 20.0
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_MAX_RATE = 100.0
+
+# The rate is multiplied by this when a call is throttled. This happens at most once a second, so that a burst of
+# throttled calls doesn't collapse the rate:
+DECREASE_FACTOR = 0.5
+# Each successful call increases the rate by this divided by the current rate -- roughly this many calls per second,
+# every second:
+ADDITIVE_INCREASE = 1.0
+
+# Idle buckets are dropped from Redis after this many seconds:
+BUCKET_TTL = 3600
+
+KEY_PREFIX = 'security_monkey:rate_limit'
+
+# Reserves a token from the bucket, and returns how long the caller must wait before using it.
+# Tokens can go negative, which queues callers up behind each other.
+RESERVE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate')) or tonumber(ARGV[2])
+local burst = math.max(1, rate)
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens')) or burst
+local timestamp = tonumber(redis.call('HGET', KEYS[1], 'timestamp')) or now
+tokens = math.min(burst, tokens + math.max(0, now - timestamp) * rate) - 1
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'timestamp', now, 'rate', rate)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+# Adjusts the rate of the bucket, and returns the new rate.
+ADJUST_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate')) or tonumber(ARGV[3])
+if ARGV[2] == '1' then
+    local last_decrease = tonumber(redis.call('HGET', KEYS[1], 'last_decrease')) or 0
+    if now - last_decrease >= 1 then
+        rate = math.max(tonumber(ARGV[4]), rate * tonumber(ARGV[6]))
+        redis.call('HSET', KEYS[1], 'last_decrease', now)
+    end
+else
+    rate = math.min(tonumber(ARGV[5]), rate + tonumber(ARGV[7]) / rate)
+end
+redis.call('HSET', KEYS[1], 'rate', rate)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[8]))
+return tostring(rate)
+"""
+
+
+def _get_rates():
+    return (
+        float(app.config.get('AWS_RATE_LIMIT_INITIAL_RATE', DEFAULT_INITIAL_RATE)),
+        float(app.config.get('AWS_RATE_LIMIT_MIN_RATE', DEFAULT_MIN_RATE)),
+        float(app.config.get('AWS_RATE_LIMIT_MAX_RATE', DEFAULT_MAX_RATE)),
+    )
+
+
+class LocalBucketStore(object):
+    """Keeps the buckets in this process. Used when Redis isn't configured or can't be reached."""
+
+    def __init__(self):
+        # key -> dict of tokens, timestamp, rate, last_decrease
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _get_bucket(self, key, now):
+        if key not in self.buckets:
+            initial_rate, _, _ = _get_rates()
+            self.buckets[key] = dict(tokens=max(1.0, initial_rate), timestamp=now, rate=initial_rate,
+                                     last_decrease=0)
+        return self.buckets[key]
+
+    def reserve(self, key, now):
+        with self.lock:
+            bucket = self._get_bucket(key, now)
+            rate = bucket['rate']
+            tokens = min(max(1.0, rate), bucket['tokens'] + max(0, now - bucket['timestamp']) * rate) - 1
+            bucket['tokens'] = tokens
+            bucket['timestamp'] = now
+
+        if tokens >= 0:
+            return 0
+        return -tokens / rate
+
+    def adjust(self, key, now, throttled):
+        _, min_rate, max_rate = _get_rates()
+        with self.lock:
+            bucket = self._get_bucket(key, now)
+            if throttled:
+                if now - bucket['last_decrease'] >= 1:
+                    bucket['rate'] = max(min_rate, bucket['rate'] * DECREASE_FACTOR)
+                    bucket['last_decrease'] = now
+            else:
+                bucket['rate'] = min(max_rate, bucket['rate'] + ADDITIVE_INCREASE / bucket['rate'])
+
+            return bucket['rate']
+
+
+class RedisBucketStore(object):
+    """Keeps the buckets in Redis so that they are shared by every worker."""
+
+    def __init__(self, url):
+        self.client = redis.StrictRedis.from_url(url)
+        self.reserve_script = self.client.register_script(RESERVE_SCRIPT)
+        self.adjust_script = self.client.register_script(ADJUST_SCRIPT)
+
+    @staticmethod
+    def _redis_key(key):
+        return ':'.join([KEY_PREFIX] + [str(part) for part in key])
+
+    def reserve(self, key, now):
+        initial_rate, _, _ = _get_rates()
+        return float(self.reserve_script(keys=[self._redis_key(key)], args=[now, initial_rate, BUCKET_TTL]))
+
+    def adjust(self, key, now, throttled):
+        initial_rate, min_rate, max_rate = _get_rates()
+        return float(self.adjust_script(keys=[self._redis_key(key)],
+                                        args=[now, '1' if throttled else '0', initial_rate, min_rate, max_rate,
+                                              DECREASE_FACTOR, ADDITIVE_INCREASE, BUCKET_TTL]))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if not _store:
+            url = get_redis_url('AWS_RATE_LIMIT_REDIS_URL')
+            _store = RedisBucketStore(url) if url else LocalBucketStore()
+        return _store
+
+
+def _call_store(method, key, *args):
+    """Calls the store, falling back to keeping the buckets in this process if Redis can't be reached."""
+    global _store
+    store = get_store()
+    try:
+        return getattr(store, method)(key, time.time(), *args)
+    except redis.exceptions.RedisError as e:
+        app.logger.warn("[?] Unable to use Redis for AWS rate limiting. Falling back to per-process rate limiting. "
+                        "Error: {}".format(e))
+        with _store_lock:
+            if _store is store:
+                _store = LocalBucketStore()
+        return getattr(get_store(), method)(key, time.time(), *args)
+
+
+def acquire(key):
+    """Blocks until a call may be made for the (account, service, region) key."""
+    wait = _call_store('reserve', key)
+    if wait > 0:
+        time.sleep(wait)
+
+
+def record_throttle(key):
+    rate = _call_store('adjust', key, True)
+    app.logger.warn("Being rate-limited by AWS on {}. Reducing the call rate to {:.2f} per second.".format(
+        '/'.join([str(part) for part in key]), rate))
+
+
+def record_success(key):
+    _call_store('adjust', key, False)
+
+
+def is_throttling_error_code(code):
+    return code in THROTTLING_ERROR_CODES
+
+
+def _before_send(key, **kwargs):
+    acquire(key)
+
+
+def _needs_retry(key, response=None, **kwargs):
+    if not response:
+        return
+
+    http_response, parsed = response
+    if is_throttling_error_code(parsed.get('Error', {}).get('Code')):
+        record_throttle(key)
+    elif http_response.status_code < 400:
+        record_success(key)
+
+
+def instrument_client(client, account_number, region):
+    """
+    Rate limits every request the boto3 client makes (including botocore's own retries) with the bucket for
+    the account, service, and region.
+    """
+    key = (account_number, client.meta.service_model.service_name, region)
+    client.meta.events.register('before-send', functools.partial(_before_send, key))
+    client.meta.events.register('needs-retry', functools.partial(_needs_retry, key))
+    client.rate_limit_key = key
+    client.rate_limited_by_events = True
+    return client
+
+
+def reset():
+    """Forgets the bucket store. Mostly for tests."""
+    global _store
+    with _store_lock:
+        _store = None
@@ -0,0 +1,106 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.common.regions
+    :platform: Unix
+    :synopsis: Caches which regions each service is available in, and which regions each account has enabled.
+
+.. version:: $$VERSION$$
+
+"""
+import threading
+import time
+
+import botocore.session
+
+from security_monkey import app, ARN_PARTITION
+from security_monkey.common.sts_connect import get_assumed_role_for_account, get_client
+from security_monkey.constants import TROUBLE_REGIONS
+
+# How long (in seconds) an account's enabled regions are cached for, unless overridden with REGION_CATALOG_TTL:
+DEFAULT_REGION_CATALOG_TTL = 3600
+
+# (service_name, partition_name) -> list of regions botocore knows the service is available in
+AVAILABLE_REGIONS_CACHE = {}
+# account identifier -> (expiration, set of enabled regions -- or None if the account's regions could not be described)
+ENABLED_REGIONS_CACHE = {}
+
+_cache_lock = threading.Lock()
+
+
+def get_available_regions(service_name, partition_name=ARN_PARTITION):
+    """
+    Returns the regions that botocore knows the service is available in. This is static data that ships
+    with botocore, so it is cached for the life of the process.
+    """
+    key = (service_name, partition_name)
+    with _cache_lock:
+        if key not in AVAILABLE_REGIONS_CACHE:
+            AVAILABLE_REGIONS_CACHE[key] = botocore.session.get_session().get_available_regions(
+                service_name, partition_name=partition_name)
+        return AVAILABLE_REGIONS_CACHE[key]
+
+
+def _describe_enabled_regions(account):
+    """Returns the set of regions that the account has enabled (opted in to, or that don't require opting in)."""
+    try:
+        role = get_assumed_role_for_account(account)
+        ec2 = get_client(role, 'ec2')
+        regions = ec2.describe_regions(AllRegions=True)['Regions']
+    except Exception as e:
+        app.logger.warn("[?] Unable to describe the enabled regions for account: {account}. All regions will be "
+                        "checked. Error: {error}".format(account=account.name, error=e))
+        return None
+
+    return set(region['RegionName'] for region in regions if region.get('OptInStatus') != 'not-opted-in')
+
+
+def get_enabled_regions(account):
+    """
+    Returns the set of regions that the account has enabled, or None if this can't be determined.
+    The result is cached for REGION_CATALOG_TTL seconds.
+    """
+    now = time.time()
+    with _cache_lock:
+        cached = ENABLED_REGIONS_CACHE.get(account.identifier)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    enabled = _describe_enabled_regions(account)
+    ttl = app.config.get('REGION_CATALOG_TTL', DEFAULT_REGION_CATALOG_TTL)
+    with _cache_lock:
+        ENABLED_REGIONS_CACHE[account.identifier] = (now + ttl, enabled)
+
+    return enabled
+
+
+def is_region_enabled(account, region):
+    """Returns False if the region is known to be disabled for the account, or is a known trouble region."""
+    if region in TROUBLE_REGIONS:
+        return False
+
+    enabled = get_enabled_regions(account)
+    return enabled is None or region in enabled
+
+
+def get_regions_for_account(account, service_name):
+    """Returns the regions the service is available in that the account has enabled."""
+    return [region for region in get_available_regions(service_name) if is_region_enabled(account, region)]
+
+
+def clear_cache():
+    """Empties the region caches."""
+    with _cache_lock:
+        AVAILABLE_REGIONS_CACHE.clear()
+        ENABLED_REGIONS_CACHE.clear()
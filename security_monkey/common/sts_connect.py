@@ -19,11 +19,197 @@
 .. moduleauthor:: Patrick Kelley <pkelley@netflix.com> @monkeysecurity
 
 """
+from collections import defaultdict
+import datetime
+import threading
+
 from security_monkey.datastore import Account
 import botocore.session
+from botocore.config import Config
 import boto3
 import boto
-from security_monkey import app, AWS_DEFAULT_REGION, ARN_PREFIX
+import cloudaux.aws.sts
+from dateutil.tz import tzutc
+from security_monkey import app, AWS_DEFAULT_REGION, ARN_PARTITION
+from security_monkey.common import rate_limiter
+
+# Credentials are refreshed when they are this close to expiring:
+REFRESH_BEFORE_EXPIRATION = datetime.timedelta(minutes=15)
+
+# (account_number, role_name, external_id) -> AssumeRole response
+CREDENTIALS_CACHE = {}
+# (access_key_id, region) -> boto3 Session
+SESSION_CACHE = {}
+# (access_key_id, region, service, retry_max_attempts) -> boto3 client
+CLIENT_CACHE = {}
+
+_cache_lock = threading.Lock()
+# One lock per credential key, so that only one thread assumes a given role while others can assume different roles:
+_role_locks = defaultdict(threading.Lock)
+
+
+def _role_is_fresh(role):
+    expiration = role['Credentials']['Expiration']
+    if not expiration.tzinfo:
+        expiration = expiration.replace(tzinfo=tzutc())
+    return expiration > datetime.datetime.now(tzutc()) + REFRESH_BEFORE_EXPIRATION
+
+
+def _evict_credentials(access_key_id):
+    """Drops the sessions and clients made with credentials that have been replaced. Must hold the cache lock."""
+    for cache in [SESSION_CACHE, CLIENT_CACHE]:
+        for key in [key for key in cache if key[0] == access_key_id]:
+            del cache[key]
+
+
+def _get_account_number(role):
+    """Returns the account number of the assumed role, for rate limiting."""
+    return role['AssumedRoleUser']['Arn'].split(':')[4]
+
+
+def get_role_name_and_external_id(account):
+    """Returns the role to assume into the account, and the external ID (if any) to use."""
+    role_name = 'SecurityMonkey'
+    external_id = None
+    if account.getCustom("role_name") and account.getCustom("role_name") != '':
+        role_name = account.getCustom("role_name")
+    if account.getCustom("external_id") and account.getCustom("external_id") != '':
+        external_id = account.getCustom("external_id")
+
+    return role_name, external_id
+
+
+def get_assumed_role(account_number, role_name='SecurityMonkey', external_id=None, session_name='secmonkey',
+                arn_partition=ARN_PARTITION):
+    """
+    Returns the sts:AssumeRole response for the account and role. The response is cached for the whole process
+    and is refreshed shortly before the credentials expire. This is thread-safe.
+    """
+    key = (account_number, role_name, external_id)
+
+    with _cache_lock:
+        role = CREDENTIALS_CACHE.get(key)
+        if role and _role_is_fresh(role):
+            return role
+        role_lock = _role_locks[key]
+
+    with role_lock:
+        # Another thread may have refreshed this while we were waiting:
+        with _cache_lock:
+            role = CREDENTIALS_CACHE.get(key)
+        if role and _role_is_fresh(role):
+            return role
+
+        sts = boto3.client('sts', region_name=AWS_DEFAULT_REGION)
+        assume_role_kwargs = {
+            'RoleArn': 'arn:{partition}:iam::{account}:role/{role}'.format(partition=arn_partition,
+                                                                         account=account_number, role=role_name),
+            'RoleSessionName': session_name
+        }
+        if external_id:
+            assume_role_kwargs['ExternalId'] = external_id
+
+        new_role = sts.assume_role(**assume_role_kwargs)
+
+        with _cache_lock:
+            if role:
+                _evict_credentials(role['Credentials']['AccessKeyId'])
+            CREDENTIALS_CACHE[key] = new_role
+
+        return new_role
+
+
+def get_assumed_role_for_account(account):
+    """Returns the cached sts:AssumeRole response for the Account object."""
+    role_name, external_id = get_role_name_and_external_id(account)
+    return get_assumed_role(account.identifier, role_name=role_name, external_id=external_id)
+
+
+def get_session(role, region=AWS_DEFAULT_REGION):
+    """Returns the cached boto3 Session for the assumed role credentials and region."""
+    key = (role['Credentials']['AccessKeyId'], region)
+    with _cache_lock:
+        if key not in SESSION_CACHE:
+            SESSION_CACHE[key] = boto3.Session(
+                aws_access_key_id=role['Credentials']['AccessKeyId'],
+                aws_secret_access_key=role['Credentials']['SecretAccessKey'],
+                aws_session_token=role['Credentials']['SessionToken'],
+                region_name=region
+            )
+        return SESSION_CACHE[key]
+
+
+def get_client(role, service, region=AWS_DEFAULT_REGION, retry_max_attempts=None):
+    """
+    Returns the cached boto3 client for the assumed role credentials, region, and service.
+    boto3 clients are thread-safe, so these are shared by all threads. (Resources are not, and are not cached.)
+    Every request the client makes is rate limited by the account/service/region token bucket.
+    """
+    key = (role['Credentials']['AccessKeyId'], region, service, retry_max_attempts)
+    session = get_session(role, region)
+    with _cache_lock:
+        if key not in CLIENT_CACHE:
+            if retry_max_attempts:
+                client = session.client(service, config=Config(retries=dict(max_attempts=retry_max_attempts)))
+            else:
+                client = session.client(service)
+            CLIENT_CACHE[key] = rate_limiter.instrument_client(client, _get_account_number(role), region)
+        return CLIENT_CACHE[key]
+
+
+def get_resource(role, service, region=AWS_DEFAULT_REGION):
+    """Returns a new boto3 resource from the cached Session. Resources are not thread-safe, so they are not shared."""
+    session = get_session(role, region)
+    with _cache_lock:
+        resource = session.resource(service)
+    rate_limiter.instrument_client(resource.meta.client, _get_account_number(role), region)
+    return resource
+
+
+def clear_cache():
+    """Empties all of the credential, session, and client caches."""
+    with _cache_lock:
+        CREDENTIALS_CACHE.clear()
+        SESSION_CACHE.clear()
+        CLIENT_CACHE.clear()
+
+
+_cloudaux_boto3_cached_conn = cloudaux.aws.sts.boto3_cached_conn
+
+
+def cloudaux_cached_conn(service, service_type='client', future_expiration_minutes=15, account_number=None,
+                         assume_role=None, session_name='cloudaux', region='us-east-1', return_credentials=False,
+                         external_id=None, arn_partition='aws', read_only=False, retry_max_attempts=10, config=None):
+    """
+    Drop-in replacement for CloudAux's `boto3_cached_conn` that makes CloudAux share the credential and client
+    caches above, instead of assuming the role for every service and region.
+    Anything the caches can't represent (no role, read only, custom client configs) is passed through to CloudAux.
+    """
+    if not assume_role or read_only or config:
+        return _cloudaux_boto3_cached_conn(
+            service, service_type=service_type, future_expiration_minutes=future_expiration_minutes,
+            account_number=account_number, assume_role=assume_role, session_name=session_name, region=region,
+            return_credentials=return_credentials, external_id=external_id, arn_partition=arn_partition,
+            read_only=read_only, retry_max_attempts=retry_max_attempts, config=config)
+
+    role = get_assumed_role(account_number, role_name=assume_role, external_id=external_id,
+                            arn_partition=arn_partition)
+
+    if service_type == 'client':
+        conn = get_client(role, service, region=region, retry_max_attempts=retry_max_attempts)
+    else:
+        conn = get_resource(role, service, region=region)
+
+    if return_credentials:
+        return conn, role['Credentials']
+
+    return conn
+
+
+def use_cache_for_cloudaux():
+    """Makes all CloudAux connections use the caches in this module."""
+    cloudaux.aws.sts.boto3_cached_conn = cloudaux_cached_conn
+
 
 def connect(account_name, connection_type, **args):
     """
@@ -52,22 +238,7 @@ def connect(account_name, connection_type, **args):
         role = args['assumed_role']
     else:
         account = Account.query.filter(Account.name == account_name).first()
-        sts = boto3.client('sts', region_name=region)
-        role_name = 'SecurityMonkey'
-        external_id = None
-        if account.getCustom("role_name") and account.getCustom("role_name") != '':
-            role_name = account.getCustom("role_name")
-        if account.getCustom("external_id") and account.getCustom("external_id") != '':
-            external_id = account.getCustom("external_id")
-        arn = ARN_PREFIX + ':iam::' + account.identifier + ':role/' + role_name
-        assume_role_kwargs = {
-            'RoleArn': arn,
-            'RoleSessionName': 'secmonkey'
-        }
-        if external_id:
-            assume_role_kwargs['ExternalId'] = external_id
-
-        role = sts.assume_role(**assume_role_kwargs)
+        role = get_assumed_role_for_account(account)
 
     if connection_type == 'botocore':
         botocore_session = botocore.session.get_session()
@@ -86,23 +257,21 @@ def connect(account_name, connection_type, **args):
     if 'boto3' in connection_type:
         # Should be called in this format: boto3.iam.client
         _, tech, api = connection_type.split('.')
-        session = boto3.Session(
-            aws_access_key_id=role['Credentials']['AccessKeyId'],
-            aws_secret_access_key=role['Credentials']['SecretAccessKey'],
-            aws_session_token=role['Credentials']['SessionToken'],
-            region_name=region
-        )
         if api == 'resource':
-            return session.resource(tech)
-        return session.client(tech)
+            return get_resource(role, tech, region=region)
+        return get_client(role, tech, region=region)
 
     module = __import__("boto.{}".format(connection_type))
     for subm in connection_type.split('.'):
         module = getattr(module, subm)
 
-    return module.connect_to_region(
+    conn = module.connect_to_region(
         region,
         aws_access_key_id=role['Credentials']['AccessKeyId'],
         aws_secret_access_key=role['Credentials']['SecretAccessKey'],
         security_token=role['Credentials']['SessionToken']
     )
+    # boto calls are rate limited by Watcher.wrap_aws_rate_limited_call:
+    if conn:
+        conn.rate_limit_key = (_get_account_number(role), connection_type, region)
+    return conn
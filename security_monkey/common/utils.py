@@ -20,6 +20,7 @@
 .. moduleauthor:: Patrick Kelley <pkelley@netflix.com> @monkeysecurity
 
 """
+import datetime
 import os
 import imp
 import traceback
@@ -162,3 +163,34 @@ def send_email(subject=None, recipients=None, html=""):
                 m = "Failed to send failure message with subject: {}\n{} {}".format(subject, Exception, e)
                 app.logger.warn(m)
                 app.logger.warn(traceback.format_exc())
+
+
+def encode_datetime(obj):
+    """`default` for json.dumps that keeps datetimes (like the ones boto returns), to be read with `decode_datetime`."""
+    if isinstance(obj, datetime.datetime):
+        return {"__datetime__": obj.isoformat()}
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+def decode_datetime(obj):
+    """`object_hook` for json.loads that restores the datetimes encoded by `encode_datetime`."""
+    if "__datetime__" in obj:
+        return datetime.datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+def get_redis_url(option_name):
+    """
+    Returns the Redis URL in the given configuration option. If the option isn't set, the Celery broker
+    is used if it is Redis. Returns None (meaning Redis shouldn't be used) otherwise, or if the option is ''.
+    """
+    url = app.config.get(option_name)
+    if url is not None:
+        return url or None
+
+    from security_monkey.task_scheduler.util import get_celery_config_file, get_sm_celery_config_value
+    broker_url = get_sm_celery_config_value(get_celery_config_file(), 'broker_url', str)
+    if broker_url and broker_url.startswith(('redis://', 'rediss://')):
+        return broker_url
+
+    return None
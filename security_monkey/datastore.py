@@ -20,45 +20,40 @@
 .. moduleauthor:: Patrick Kelley <pkelley@netflix.com> @monkeysecurity
 
 """
-from deepdiff import DeepHash
 from flask_security.core import UserMixin, RoleMixin
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import BigInteger, desc
+from sqlalchemy import BigInteger
 
 from .auth.models import RBACUserMixin
 
 from security_monkey import db, app
 
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.dialects.postgresql import JSON, insert
 from sqlalchemy import Column, Integer, String, DateTime, Boolean, Unicode, Text
 from sqlalchemy.dialects.postgresql import CIDR
 from sqlalchemy.schema import ForeignKey, UniqueConstraint
-from sqlalchemy.orm import relationship, column_property, load_only
+from sqlalchemy.orm import relationship, load_only, object_session, selectinload, undefer
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy import select, func
+from sqlalchemy import and_, case, cast, or_, select, func, null
 
 from sqlalchemy.orm import deferred
 
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from copy import deepcopy
 import datetime
+import json
+import threading
 import traceback
 
-import dpath.util
-from deepdiff import DeepHash
-from dpath.exceptions import PathNotFound
-from copy import deepcopy
+from security_monkey.common.hashing import hash_config, HASH_VERSION
+from security_monkey.common.json_delta import apply_delta, make_delta
 
 
 def durable_hash(config, ephemeral_paths):
-    durable_item = deepcopy(config)
-    for path in ephemeral_paths:
-        try:
-            dpath.util.delete(durable_item, path, separator='$')
-        except PathNotFound:
-            pass
-    return DeepHash(durable_item)[durable_item]
+    return hash_config(config, ephemeral_paths)[1]
 
 
-def hash_item(config, ephemeral_paths):
+def hash_item(config, ephemeral_paths, hash_version=HASH_VERSION):
     """
     Finds the hash of a dict.
 
@@ -66,11 +61,10 @@ def hash_item(config, ephemeral_paths):
     :param config:
     :param item: dictionary, typically representing an item tracked in SM
                  such as an IAM role
-    :return: hash of the json dump of the item
+    :param hash_version: The version of the hashing to use (see `security_monkey.common.hashing`)
+    :return: tuple of the complete and the durable hashes of the item
     """
-    complete = DeepHash(config)[config]
-    durable = durable_hash(config, ephemeral_paths)
-    return complete, durable
+    return hash_config(config, ephemeral_paths, hash_version=hash_version)
 
 
 association_table = db.Table(
@@ -292,6 +286,19 @@ class Item(db.Model):
     tech_id = Column(Integer, ForeignKey("technology.id"), nullable=False, index=True)
     account_id = Column(Integer, ForeignKey("account.id"), nullable=False, index=True)
     latest_revision_id = Column(Integer, nullable=True)
+    # Fingerprint of the item's list output when it was last fully fetched (see CloudAuxWatcher.get_list_fingerprint):
+    list_fingerprint = Column(String(64), nullable=True)
+    list_fingerprint_date = Column(DateTime(), nullable=True)
+    # The version of the hashing that the latest revision hashes were made with. NULL for the original DeepHash ones:
+    hash_version = Column(Integer, nullable=True)
+    # Totals of the item's unfixed issues from enabled auditors. These are kept up to date by `update_item_scores`:
+    score = Column(Integer, nullable=False, default=0, server_default="0", index=True)
+    unjustified_score = Column(Integer, nullable=False, default=0, server_default="0", index=True)
+    issue_count = Column(Integer, nullable=False, default=0, server_default="0", index=True)
+    # When the first and the latest revisions were created, and whether the latest one is active:
+    first_seen = Column(DateTime(), nullable=True)
+    last_seen = Column(DateTime(), nullable=True, index=True)
+    latest_active = Column(Boolean(), nullable=True, index=True)
     comments = relationship("ItemComment", backref="revision", cascade="all, delete, delete-orphan",
                             order_by="ItemComment.date_created")
     revisions = relationship("ItemRevision", backref="item", cascade="all, delete, delete-orphan",
@@ -302,58 +309,21 @@ class Item(db.Model):
                           single_parent=True, cascade="all, delete, delete-orphan")
     exceptions = relationship("ExceptionLogs", backref="item", cascade="all, delete, delete-orphan")
 
-    @hybrid_property
-    def score(self):
-        return db.session.query(
-            func.cast(
-                func.sum(ItemAudit.score),
-                Integer)
-        ).filter(
-            ItemAudit.item_id == self.id,
-            ItemAudit.auditor_setting_id == AuditorSettings.id,
-            ItemAudit.fixed == False,
-            AuditorSettings.disabled == False).one()[0] or 0
-
-    @score.expression
-    def score(cls):
-        return select([func.sum(ItemAudit.score)]). \
-            where(ItemAudit.item_id == cls.id). \
-            where(ItemAudit.auditor_setting_id == AuditorSettings.id). \
-            where(ItemAudit.fixed == False). \
-            where(AuditorSettings.disabled == False). \
-            label('item_score')
-
-    @hybrid_property
-    def unjustified_score(self):
-        return db.session.query(
-            func.cast(
-                func.sum(ItemAudit.score),
-                Integer)
-        ).filter(
-            ItemAudit.item_id == self.id,
-            ItemAudit.justified == False,
-            ItemAudit.fixed == False,
-            ItemAudit.auditor_setting_id == AuditorSettings.id,
-            AuditorSettings.disabled == False).one()[0] or 0
-
-    @unjustified_score.expression
-    def unjustified_score(cls):
-        return select([func.sum(ItemAudit.score)]). \
-            where(ItemAudit.item_id == cls.id). \
-            where(ItemAudit.justified == False). \
-            where(ItemAudit.fixed == False). \
-            where(ItemAudit.auditor_setting_id == AuditorSettings.id). \
-            where(AuditorSettings.disabled == False). \
-            label('item_unjustified_score')
-
-    issue_count = column_property(
-        select([func.count(ItemAudit.id)])
-        .where(ItemAudit.item_id == id)
-        .where(ItemAudit.fixed == False)
-        .where(ItemAudit.auditor_setting_id == AuditorSettings.id)
-        .where(AuditorSettings.disabled == False),
-        deferred=True
-    )
+    def set_latest_revision(self, revision, repair=False):
+        """
+        Points the item at its (flushed) latest revision, and records when it was first and last seen.
+        :param repair: The item is being repaired, so a missing first_seen is looked up from its earliest revision.
+                       Otherwise, an item without one is new, and its only revision is this one.
+        """
+        self.latest_revision_id = revision.id
+        self.last_seen = revision.date_created
+        self.latest_active = revision.active
+        if self.first_seen is None:
+            if repair:
+                self.first_seen = db.session.query(func.min(ItemRevision.date_created)) \
+                    .filter(ItemRevision.item_id == self.id).scalar() or revision.date_created
+            else:
+                self.first_seen = revision.date_created
 
     @hybrid_property
     def latest_config(self):
@@ -383,22 +353,87 @@ class ItemComment(db.Model):
         return self.__str__()
 
 
+class ItemRevisionConfig(db.Model):
+    """
+    Item revision configs, stored once per distinct config (keyed by the hash of its content). Revisions reference
+    these when `REVISION_CONFIG_STORAGE` is "deduplicated", and once they have been compacted.
+    """
+    __tablename__ = "itemrevisionconfig"
+    id = Column(Integer, primary_key=True)
+    hash = Column(String(64), nullable=False, unique=True)
+    config = Column(JSON)
+
+
 class ItemRevision(db.Model):
     """
     Every new configuration for an item is saved in a new ItemRevision.
+
+    The config is stored in one of three ways (`config` reads and writes it transparently):
+    - Inline, in the `config` column.
+    - As a reference to a deduplicated ItemRevisionConfig (`config_id`).
+    - As a JSON Patch (`config_delta`) against the config of an earlier revision of the item (`delta_base_id`),
+      `delta_depth` revisions away from a revision with a stored config (a keyframe).
+    See `compact_revision_configs`.
     """
     __tablename__ = "itemrevision"
     id = Column(Integer, primary_key=True)
     active = Column(Boolean())
-    config = deferred(Column(JSON))
+    _config = deferred(Column('config', JSON(none_as_null=True)))
+    config_id = Column(Integer, ForeignKey("itemrevisionconfig.id"), nullable=True, index=True)
+    config_delta = deferred(Column(JSON(none_as_null=True), nullable=True))
+    delta_base_id = Column(Integer, nullable=True, index=True)
+    delta_depth = Column(Integer, nullable=True)
     date_created = Column(DateTime(), default=datetime.datetime.utcnow, nullable=False, index=True)
     date_last_ephemeral_change = Column(DateTime(), nullable=True, index=True)
     item_id = Column(Integer, ForeignKey("item.id"), nullable=False, index=True)
+    stored_config = relationship("ItemRevisionConfig")
     comments = relationship("ItemRevisionComment", backref="revision", cascade="all, delete, delete-orphan",
                             order_by="ItemRevisionComment.date_created")
     cloudtrail_entries = relationship("CloudTrailEntry", backref="revision", cascade="all, delete, delete-orphan",
                                       order_by="CloudTrailEntry.event_time")
 
+    @hybrid_property
+    def config(self):
+        if self._config is not None:
+            return self._config
+
+        if self.config_id:
+            return self.stored_config.config
+
+        if self.config_delta is not None:
+            # Walk back to the keyframe, and then apply the deltas from there:
+            deltas = []
+            revision = self
+            while revision.config_delta is not None:
+                deltas.append(revision.config_delta)
+                revision = (object_session(self) or db.session).query(ItemRevision).get(revision.delta_base_id)
+
+            config = deepcopy(revision.config)
+            for delta in reversed(deltas):
+                config = apply_delta(config, delta)
+
+            return config
+
+        return None
+
+    @config.setter
+    def config(self, value):
+        self._config = value
+        self.config_id = None
+        self.config_delta = None
+        self.delta_base_id = None
+        self.delta_depth = None
+
+    @config.expression
+    def config(cls):
+        # Deltas can't be resolved in SQL, so this is NULL for the revisions stored as deltas. Only historical
+        # revisions are ever stored as deltas, so the configs of the latest revisions are always available here.
+        # Use `filter_revision_configs` to search the configs.
+        return func.coalesce(cls._config,
+                             select([ItemRevisionConfig.config]).where(ItemRevisionConfig.id == cls.config_id)
+                             .as_scalar(),
+                             type_=JSON)
+
 
 class CloudTrailEntry(db.Model):
     """
@@ -474,6 +509,10 @@ class ExceptionLogs(db.Model):
     stacktrace = Column(Text)
     region = Column(String(32), nullable=True, index=True)
 
+    # Identical exceptions are coalesced into one row. `occurred` is when it was first seen:
+    occurrences = Column(Integer, default=1, nullable=False, server_default="1")
+    last_seen = Column(DateTime, nullable=True)
+
     tech_id = Column(Integer, ForeignKey("technology.id", ondelete="CASCADE"), index=True)
     item_id = Column(Integer, ForeignKey("item.id", ondelete="CASCADE"), index=True)
     account_id = Column(Integer, ForeignKey("account.id", ondelete="CASCADE"), index=True)
@@ -547,25 +586,14 @@ class Datastore(object):
         Returns a list of Items joined with their most recent ItemRevision,
         potentially filtered by the criteria above.
         """
-        item_map = {}
-        query = Item.query
-        if tech:
-            query = query.join((Technology, Item.tech_id == Technology.id)).filter(Technology.name == tech)
-        if account:
-            query = query.join((Account, Item.account_id == Account.id)).filter(Account.name == account)
-
-        filter_by = {'region': region, 'name': name}
-        for k, v in list(filter_by.items()):
-            if not v:
-                del filter_by[k]
-
-        query = query.filter_by(**filter_by)
+        query = self._latest_revisions_query(db.session.query(Item, ItemRevision), tech=tech,
+                                             accounts=[account] if account else None, region=region, name=name,
+                                             include_inactive=include_inactive)
 
         attempt = 1
         while True:
             try:
-                items = query.all()
-                break
+                return {item: revision for item, revision in query.all()}
             except Exception as e:
                 app.logger.warn("Database Exception in Datastore::get_all_ctype_filtered. "
                                 "Sleeping for a few seconds. Attempt {}.".format(attempt))
@@ -576,16 +604,40 @@ class Datastore(object):
                 if attempt > 5:
                     raise Exception("Too many retries for database connections.")
 
-        for item in items:
-            if not item.latest_revision_id:
-                app.logger.debug("There are no itemrevisions for this item: {}".format(item.id))
-                continue
-            most_recent = ItemRevision.query.get(item.latest_revision_id)
-            if not most_recent.active and not include_inactive:
-                continue
-            item_map[item] = most_recent
+    def iter_latest_revisions(self, tech=None, accounts=None, region=None, name=None, include_inactive=False,
+                              include_config=True, yield_per=1000):
+        """
+        Streams the Items, potentially filtered by the criteria above, with the config of their most recent
+        ItemRevision. This is a single query, read with a server side cursor `yield_per` rows at a time.
+        :param accounts: List of account names.
+        :param include_config: False to skip loading the configs, for callers that only need the items.
+        :return: Generator of (Item, config or None, account name) tuples.
+        """
+        columns = [Item, ItemRevision.config if include_config else null(), Account.name]
+        query = self._latest_revisions_query(db.session.query(*columns), tech=tech, accounts=accounts, region=region,
+                                             name=name, include_inactive=include_inactive)
+
+        return (tuple(row) for row in query.yield_per(yield_per))
+
+    def _latest_revisions_query(self, query, tech=None, accounts=None, region=None, name=None,
+                                include_inactive=False):
+        # Items without a latest revision are skipped:
+        query = query.select_from(Item) \
+            .join((ItemRevision, Item.latest_revision_id == ItemRevision.id)) \
+            .join((Account, Item.account_id == Account.id))
+
+        if tech:
+            query = query.join((Technology, Item.tech_id == Technology.id)).filter(Technology.name == tech)
+        if accounts is not None:
+            query = query.filter(Account.name.in_(accounts))
+        if region:
+            query = query.filter(Item.region == region)
+        if name:
+            query = query.filter(Item.name == name)
+        if not include_inactive:
+            query = query.filter(ItemRevision.active == True)  # noqa
 
-        return item_map
+        return query
 
     def get(self, ctype, region, account, name):
         """
@@ -606,68 +658,142 @@ class Datastore(object):
         """
         Saves an itemrevision.  Create the item if it does not already exist.
         """
-        new_issues = new_issues if new_issues else []
-        item = self._get_item(ctype, region, account, name)
+        record = (ctype, region, account, name, active_flag, config, arn, new_issues, ephemeral)
+        return self._store_records([record], source_watcher=source_watcher)[0]
+
+    def store_many(self, changes, source_watcher=None):
+        """
+        Saves the item revisions of many ChangeItems in a single transaction. The items are looked up (and created
+        if they don't exist yet), the ARNs are moved, and the issues are reconciled for all of them at once.
+        :param changes: List of (ChangeItem, ephemeral) tuples. Ephemeral changes update the latest revision instead
+                        of adding a new one.
+        :return: List of the Items, in the same order as the changes.
+        """
+        records = [(item.index, item.region, item.account, item.name, item.active, item.new_config, item.arn,
+                    item.audit_issues, ephemeral) for item, ephemeral in changes]
+        return self._store_records(records, source_watcher=source_watcher)
+
+    def _store_records(self, records, source_watcher=None):
+        if not records:
+            return []
 
-        if arn:
-            duplicate_arns = Item.query.filter(Item.arn == arn).all()
-            for duplicate_item in duplicate_arns:
-                if duplicate_item.id != item.id:
-                    duplicate_item.arn = None
-                    app.logger.info("Moving ARN {arn} from {duplicate} to {item}".format(
-                        arn=arn,
-                        duplicate=duplicate_item.name,
-                        item=item.name
-                    ))
-                    db.session.add(duplicate_item)
-                    db.session.commit()
-
-        if arn:
-            item.arn = arn
-
-        item.latest_revision_complete_hash = DeepHash(config)[config]
         if source_watcher and source_watcher.honor_ephemerals:
             ephemeral_paths = source_watcher.ephemeral_paths
         else:
             ephemeral_paths = []
-        item.latest_revision_durable_hash = durable_hash(config, ephemeral_paths)
 
-        if ephemeral:
-            item_revision = item.revisions.first()
-            item_revision.config = config
-            item_revision.date_last_ephemeral_change = datetime.datetime.utcnow()
-        else:
-            item_revision = ItemRevision(active=active_flag, config=config)
-            item.revisions.append(item_revision)
+        try:
+            items = self._get_items([(ctype, region, account, name)
+                                     for ctype, region, account, name, _, _, _, _, _ in records])
+
+            # An ARN can only belong to one item: the last record that carries it gets it, and the earlier ones
+            # in the batch lose it:
+            arn_owners = dict((record[6], index) for index, record in enumerate(records) if record[6])
+            self._move_arns([(items[index], arn) for arn, index in arn_owners.items()])
+
+            # Load the issues of all of the items at once:
+            Item.query.options(selectinload(Item.issues)).filter(Item.id.in_([item.id for item in items])).all()
+
+            ephemeral_revision_ids = [item.latest_revision_id for item, record in zip(items, records)
+                                      if record[8] and item.latest_revision_id]
+            latest_revisions = {revision.id: revision for revision in
+                                ItemRevision.query.filter(ItemRevision.id.in_(ephemeral_revision_ids))}
+
+            revisions = []
+            rescored_items = []
+            for index, (item, record) in enumerate(zip(items, records)):
+                _, _, _, _, active_flag, config, arn, new_issues, ephemeral = record
+                if arn:
+                    item.arn = arn if arn_owners[arn] == index else None
+
+                item.latest_revision_complete_hash, item.latest_revision_durable_hash = hash_item(config,
+                                                                                                  ephemeral_paths)
+                item.hash_version = HASH_VERSION
+
+                if ephemeral:
+                    item_revision = latest_revisions.get(item.latest_revision_id) or item.revisions.first()
+                    item_revision.config = config
+                    item_revision.date_last_ephemeral_change = datetime.datetime.utcnow()
+                else:
+                    item_revision = ItemRevision(active=active_flag, config=config)
+                    item.revisions.append(item_revision)
+
+                if self._reconcile_issues(item, new_issues or []):
+                    rescored_items.append(item)
+
+                db.session.add(item)
+                db.session.add(item_revision)
+                revisions.append(item_revision)
+
+            if deduplicate_revision_configs():
+                config_ids = store_revision_configs([item_revision.config for item_revision in revisions])
+                for item_revision, config_id in zip(revisions, config_ids):
+                    item_revision._config = None
+                    item_revision.config_id = config_id
+
+            # Assigns the IDs of the new revisions:
+            db.session.flush()
+            for item, item_revision in zip(items, revisions):
+                item.set_latest_revision(item_revision)
+
+            update_item_scores([item.id for item in rescored_items])
 
-        # Add new issues
-        for new_issue in new_issues:
-            nk = "{}/{}".format(new_issue.issue, new_issue.notes)
-            if nk not in ["{}/{}".format(old_issue.issue, old_issue.notes) for old_issue in item.issues]:
-                item.issues.append(new_issue)
-                db.session.add(new_issue)
+            db.session.commit()
 
-        # Delete old issues
-        for old_issue in item.issues:
-            ok = "{}/{}".format(old_issue.issue, old_issue.notes)
-            if ok not in ["{}/{}".format(new_issue.issue, new_issue.notes) for new_issue in new_issues]:
-                db.session.delete(old_issue)
+        except Exception:
+            db.session.rollback()
+            raise
 
-        db.session.add(item)
-        db.session.add(item_revision)
-        db.session.commit()
+        return items
 
-        self._set_latest_revision(item)
-        return item
+    def _reconcile_issues(self, item, new_issues):
+        """
+        Adds the new issues that the item doesn't have yet, and deletes the ones that are no longer present.
+        :return: Whether any issues were added or deleted.
+        """
+        changed = False
+        issue_keys = set("{}/{}".format(old_issue.issue, old_issue.notes) for old_issue in item.issues)
+        new_issue_keys = set("{}/{}".format(new_issue.issue, new_issue.notes) for new_issue in new_issues)
 
-    def _set_latest_revision(self, item):
-        latest_revision = item.revisions.first()
-        item.latest_revision_id = latest_revision.id
-        db.session.add(item)
-        db.session.commit()
-        #db.session.close()
+        # Delete old issues
+        for old_issue in item.issues:
+            if "{}/{}".format(old_issue.issue, old_issue.notes) not in new_issue_keys:
+                db.session.delete(old_issue)
+                changed = True
 
-    def _delete_duplicate_item(self, items):
+        # Add new issues
+        for new_issue in new_issues:
+            nk = "{}/{}".format(new_issue.issue, new_issue.notes)
+            if nk not in issue_keys:
+                issue_keys.add(nk)
+                item.issues.append(new_issue)
+                db.session.add(new_issue)
+                changed = True
+
+        return changed
+
+    def _move_arns(self, items_and_arns):
+        """Takes the ARNs away from any other items that have them, before they are given to the items."""
+        if not items_and_arns:
+            return
+
+        item_ids = dict((arn, item.id) for item, arn in items_and_arns)
+        item_names = dict((arn, item.name) for item, arn in items_and_arns)
+        duplicate_arns = Item.query.filter(Item.arn.in_(list(item_ids.keys())))
+        for duplicate_item in duplicate_arns:
+            if duplicate_item.id != item_ids[duplicate_item.arn]:
+                app.logger.info("Moving ARN {arn} from {duplicate} to {item}".format(
+                    arn=duplicate_item.arn,
+                    duplicate=duplicate_item.name,
+                    item=item_names[duplicate_item.arn]
+                ))
+                duplicate_item.arn = None
+                db.session.add(duplicate_item)
+
+        # The ARNs must be released before they are reassigned:
+        db.session.flush()
+
+    def _delete_duplicate_item(self, items, commit=True):
         """
         Given a list of identical items (account, name, region, technology), delete the duplicate, and return
         the most current item back out.
@@ -683,9 +809,62 @@ class Datastore(object):
                 db.session.delete(last_item)
                 last_item = i
 
-        db.session.commit()
+        if commit:
+            db.session.commit()
         return last_item
 
+    def _get_items(self, locations):
+        """
+        Returns the items at the locations, creating the ones that don't exist yet. Nothing is committed.
+        :param locations: List of (technology, region, account, name) tuples.
+        :return: List of the Items, in the same order as the locations.
+        """
+        account_names = set(account for _, _, account, _ in locations)
+        accounts = {account.name: account for account in Account.query.filter(Account.name.in_(account_names))}
+        for account in account_names:
+            if account not in accounts:
+                raise Exception("Account with name [{}] not found.".format(account))
+
+        technology_names = set(technology for technology, _, _, _ in locations)
+        technologies = {technology.name: technology
+                        for technology in Technology.query.filter(Technology.name.in_(technology_names))}
+        for technology in technology_names:
+            if technology not in technologies:
+                technologies[technology] = Technology(name=technology)
+                db.session.add(technologies[technology])
+                db.session.flush()
+                app.logger.info("Creating a new Technology: {} - ID: {}"
+                                .format(technology, technologies[technology].id))
+
+        query = Item.query.filter(Item.tech_id.in_([technology.id for technology in technologies.values()]),
+                                  Item.account_id.in_([account.id for account in accounts.values()]),
+                                  Item.name.in_(set(name for _, _, _, name in locations)))
+        found = defaultdict(list)
+        for item in query:
+            found[(item.tech_id, item.account_id, item.region, item.name)].append(item)
+
+        items = {}
+        for technology, region, account, name in locations:
+            key = (technologies[technology].id, accounts[account].id, region, name)
+            if key in items:
+                continue
+
+            if len(found[key]) > 1:
+                app.logger.error("[?] Duplicate items have been detected: {a}/{t}/{r}/{n}. Removing duplicate..."
+                                 .format(a=account, t=technology, r=region, n=name))
+                items[key] = self._delete_duplicate_item(found[key], commit=False)
+                app.logger.info("[-] Duplicate items removed: {a}/{t}/{r}/{n}...".format(a=account, t=technology,
+                                                                                         r=region, n=name))
+            elif found[key]:
+                items[key] = found[key][0]
+            else:
+                items[key] = Item(tech_id=key[0], region=region, account_id=key[1], name=name)
+                db.session.add(items[key])
+
+        db.session.flush()
+        return [items[(technologies[technology].id, accounts[account].id, region, name)]
+                for technology, region, account, name in locations]
+
     def _get_item(self, technology, region, account, name):
         """
         Returns the first item with matching parameters.
@@ -729,9 +908,144 @@ class Datastore(object):
         return item
 
 
+class ExceptionBuffer(object):
+    """
+    Collects the exceptions to store in the database. Identical exceptions (same source, location, type, and
+    message) are coalesced into a single row with an occurrence count, so an outage that makes every call fail
+    only writes a handful of rows.
+
+    Outside of `buffering()`, each exception is written right away. Inside of it, the exceptions are written in
+    bulk once `EXCEPTION_BUFFER_SIZE` of them have been collected, and when the outermost `buffering()` exits.
+    """
+
+    def __init__(self):
+        self.records = OrderedDict()
+        self.count = 0
+        self.depth = 0
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def buffering(self):
+        with self.lock:
+            self.depth += 1
+
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.depth -= 1
+                done = not self.depth
+
+            if done:
+                self.flush()
+
+    def add(self, source, location, exception, ttl=None):
+        now = datetime.datetime.utcnow()
+        key = (source, tuple(location or ()), type(exception).__name__, str(exception)[:512])
+        ttl = ttl or now + datetime.timedelta(days=10)
+        stacktrace = traceback.format_exc()
+
+        with self.lock:
+            record = self.records.get(key)
+            if record:
+                record['occurrences'] += 1
+                record['last_seen'] = now
+                record['ttl'] = max(record['ttl'], ttl)
+                record['stacktrace'] = stacktrace
+            else:
+                self.records[key] = dict(occurred=now, last_seen=now, occurrences=1, ttl=ttl, stacktrace=stacktrace)
+
+            self.count += 1
+            full = not self.depth or self.count >= app.config.get('EXCEPTION_BUFFER_SIZE', 100)
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Writes the collected exceptions to the database."""
+        with self.lock:
+            records, self.records = self.records, OrderedDict()
+            self.count = 0
+
+        if not records:
+            return
+
+        try:
+            app.logger.debug("Logging {} exceptions to the database.".format(len(records)))
+            _write_exception_records(records)
+            app.logger.debug("Completed logging exceptions to database.")
+
+        except Exception as e:
+            app.logger.error("Encountered exception while logging exception to database:")
+            app.logger.exception(e)
+            db.session.rollback()
+
+
+exception_buffer = ExceptionBuffer()
+
+
+def _write_exception_records(records):
+    """
+    Writes the coalesced exceptions. Exceptions that already have an unexpired row get added to it.
+    :param records: Dict of (source, location, type, message) to the occurrences of the exception.
+    """
+    locations = [location for _, location, _, _ in records]
+
+    technology_names = set(location[0] for location in locations if len(location) >= 1)
+    technologies = dict(Technology.query.with_entities(Technology.name, Technology.id)
+                        .filter(Technology.name.in_(technology_names)))
+    for name in technology_names - set(technologies):
+        technology = Technology(name=name)
+        db.session.add(technology)
+        db.session.flush()
+        technologies[name] = technology.id
+        app.logger.info("Creating a new Technology: {} - ID: {}".format(technology.name, technology.id))
+
+    account_names = set(location[1] for location in locations if len(location) >= 2)
+    accounts = dict(Account.query.with_entities(Account.name, Account.id).filter(Account.name.in_(account_names)))
+
+    item_names = set(location[3] for location in locations if len(location) == 4)
+    items = {}
+    for name, item_id in Item.query.with_entities(Item.name, Item.id).filter(Item.name.in_(item_names)) \
+            .order_by(Item.id):
+        items.setdefault(name, item_id)
+
+    rows = OrderedDict()
+    for (source, location, exception_type, message), record in records.items():
+        fields = dict(
+            source=source,
+            type=exception_type,
+            message=message,
+            region=location[2] if len(location) >= 3 else None,
+            tech_id=technologies[location[0]] if len(location) >= 1 else None,
+            account_id=accounts.get(location[1]) if len(location) >= 2 else None,
+            item_id=items.get(location[3]) if len(location) == 4 else None)
+        rows[tuple(sorted(fields.items()))] = (fields, record)
+
+    columns = ('source', 'type', 'message', 'region', 'tech_id', 'account_id', 'item_id')
+    existing = ExceptionLogs.query.filter(ExceptionLogs.source.in_(set(source for source, _, _, _ in records)),
+                                          ExceptionLogs.message.in_(set(message for _, _, _, message in records)),
+                                          ExceptionLogs.ttl > datetime.datetime.utcnow())
+    existing = dict((tuple(sorted((column, getattr(row, column)) for column in columns)), row) for row in existing)
+
+    for key, (fields, record) in rows.items():
+        row = existing.get(key)
+        if row:
+            row.occurrences = (row.occurrences or 1) + record['occurrences']
+            row.last_seen = record['last_seen']
+            row.ttl = max(row.ttl, record['ttl'])
+            row.stacktrace = record['stacktrace']
+        else:
+            row = ExceptionLogs(**dict(fields, **record))
+        db.session.add(row)
+
+    db.session.commit()
+
+
 def store_exception(source, location, exception, ttl=None):
     """
-    Method to store exceptions in the database.
+    Method to store exceptions in the database. They are buffered (and coalesced) by the `exception_buffer`
+    while it's buffering, and are otherwise written right away.
     :param source:
     :param location:
     :param exception:
@@ -740,37 +1054,7 @@ def store_exception(source, location, exception, ttl=None):
     """
     try:
         app.logger.debug("Logging exception from {} with location: {} to the database.".format(source, location))
-        message = str(exception)[:512]
-
-        exception_entry = ExceptionLogs(source=source, ttl=ttl, type=type(exception).__name__,
-                                        message=message, stacktrace=traceback.format_exc())
-        if location:
-            if len(location) == 4:
-                item = Item.query.filter(Item.name == location[3]).first()
-                if item:
-                    exception_entry.item_id = item.id
-
-            if len(location) >= 3:
-                exception_entry.region = location[2]
-
-            if len(location) >= 2:
-                account = Account.query.filter(Account.name == location[1]).one()
-                if account:
-                    exception_entry.account_id = account.id
-
-            if len(location) >= 1:
-                technology = Technology.query.filter(Technology.name == location[0]).first()
-                if not technology:
-                    technology = Technology(name=location[0])
-                    db.session.add(technology)
-                    db.session.commit()
-                    db.session.refresh(technology)
-                    app.logger.info("Creating a new Technology: {} - ID: {}".format(technology.name, technology.id))
-                exception_entry.tech_id = technology.id
-
-        db.session.add(exception_entry)
-        db.session.commit()
-        app.logger.debug("Completed logging exception to database.")
+        exception_buffer.add(source, location, exception, ttl=ttl)
 
     except Exception as e:
         app.logger.error("Encountered exception while logging exception to database:")
@@ -778,81 +1062,228 @@ def store_exception(source, location, exception, ttl=None):
 
 
 def clear_old_exceptions():
-    exc_list = ExceptionLogs.query.filter(ExceptionLogs.ttl <= datetime.datetime.utcnow()).all()
+    ExceptionLogs.query.filter(ExceptionLogs.ttl <= datetime.datetime.utcnow()).delete(synchronize_session=False)
+    db.session.commit()
 
-    for exc in exc_list:
-        db.session.delete(exc)
 
-    db.session.commit()
+def deduplicate_revision_configs():
+    """Whether new revisions reference deduplicated configs (instead of storing their configs inline)."""
+    return app.config.get('REVISION_CONFIG_STORAGE', 'inline') == 'deduplicated'
 
 
-def delete_item_revisions_by_date(start_date, end_date):
-    """This will remove all item revisions per the following strategy:
-    0. Iterate over every item.
-    1. Get a list of all item revisions within the date range provided.
-    2. If the revisions on the date selected refers to ALL revisions of a given item, then delete the item outright, and skip to the next item.
-    3. Otherwise, get the latest revision for the item before the start date.
-    4. Update the item's latest revision ID to that last good revision
-    6. Delete the revisions in the date range.
-    """
-    db = SQLAlchemy(app=app, session_options={"_enable_transaction_accounting": False})  # Override the session options. This will make things MUUUUCH faster!
-    whole_items_to_delete = []
-    total_revisions_deleted = 0
-    whole_items_deleted = 0
-    for item in db.session.query(Item).all():
-        # Get all the revisions for this item:
-        affected_revisions = db.session.query(ItemRevision).join(Item).filter(ItemRevision.item_id == item.id,
-                                                                              ItemRevision.date_created >= start_date, ItemRevision.date_created < end_date
-                                                                              ).all()
-        if not affected_revisions:
-            continue
-
-        # How many revisions does this item have?
-        total_number_of_revisions = db.session.query(ItemRevision).filter(ItemRevision.item_id == item.id).count()
-        if total_number_of_revisions == len(affected_revisions):
-            app.logger.info("[+] Marking Item: {} for deletion as all revisions are in the deletion timeframe.".format(item.arn))
-            whole_items_to_delete.append(item)
-
-            # Purge the whole items on 100 item batches
-            if len(whole_items_to_delete) == 100:
-                for item_to_delete in whole_items_to_delete:
-                    db.session.delete(item_to_delete)
-                db.session.commit()
-                app.logger.info("[---] Deleted a batch of 100 items marked for deletion.")
-                whole_items_deleted += 100
-                whole_items_to_delete = []  # Reset the batch
-
-            continue
-
-        # Add the affected versions to the deletion list:
-        affected_revision_ids = set()
-        for af in affected_revisions:
-            total_revisions_deleted += 1
-            affected_revision_ids.add(af.id)
-            app.logger.info("[+] Marking Item Revision for Item: {} / {} to be deleted...".format(af.date_created, item.arn))
-            db.session.delete(af)
-
-        # Check if the latest revision ID for the item is in the affected revision:
-        if item.latest_revision_id in affected_revision_ids:
-            # If so, then we need to point the latest revision of the item to the last known good item (before the deletion start date)
-            # Get the latest revision that is
-            latest_good_revision = db.session.query(ItemRevision).filter(ItemRevision.item_id == item.id,
-                                                                         ItemRevision.date_created < start_date
-                                                                         ).order_by(desc(ItemRevision.date_created)).first()
-            # Update the item to point to the last good revision:
-            item.latest_revision_id = latest_good_revision.id
-            app.logger.info("[~] The item's latest revision is in the deletion list. "
-                            "Updating with the last known good change item: {}.".format(latest_good_revision.date_created))
-            db.session.add(item)
+def store_revision_configs(configs, session=None):
+    """
+    Stores each distinct config once in the ItemRevisionConfig table (if it isn't there already).
+    :return: List of the IDs of the ItemRevisionConfigs, in the same order as the configs.
+    """
+    session = session or db.session
+    hashes = [hash_config(config, [])[0] for config in configs]
+    distinct = OrderedDict(zip(hashes, configs))
+    if not distinct:
+        return []
+
+    table = ItemRevisionConfig.__table__
+    session.execute(insert(table).values([{'hash': config_hash, 'config': config}
+                                          for config_hash, config in distinct.items()])
+                    .on_conflict_do_nothing(index_elements=['hash']))
 
+    with session.no_autoflush:
+        ids = dict(session.query(ItemRevisionConfig.hash, ItemRevisionConfig.id)
+                   .filter(ItemRevisionConfig.hash.in_(list(distinct))))
+
+    return [ids[config_hash] for config_hash in hashes]
+
+
+def revision_config_columns(configs):
+    """
+    Returns the ItemRevision column values that store each of the configs: inline, or as a reference to the
+    deduplicated config if `REVISION_CONFIG_STORAGE` is "deduplicated".
+    """
+    empty = dict(config=None, config_id=None, config_delta=None, delta_base_id=None, delta_depth=None)
+    if not deduplicate_revision_configs():
+        return [dict(empty, config=config) for config in configs]
+
+    return [dict(empty, config_id=config_id) for config_id in store_revision_configs(configs)]
+
+
+def filter_revision_configs(query, text):
+    """
+    Filters the query (which selects or joins ItemRevision) to the revisions whose config contains the text,
+    ignoring case. The deduplicated configs are joined, rather than selected for each row. The revisions stored as
+    deltas can't be searched in SQL, and never match: see `delta_revisions_exist`.
+    """
+    pattern = '%{}%'.format(text)
+    return query.outerjoin(ItemRevisionConfig, ItemRevisionConfig.id == ItemRevision.config_id) \
+        .filter(or_(cast(ItemRevision._config, String).ilike(pattern),
+                    cast(ItemRevisionConfig.config, String).ilike(pattern)))
+
+
+def delta_revisions_exist():
+    """Whether any revisions are stored as deltas (by `compact_revision_configs`)."""
+    return db.session.query(ItemRevision.query.filter(ItemRevision.delta_base_id != None).exists()).scalar()  # noqa
+
+
+def materialize_revisions(revisions, session=None):
+    """
+    Stores the configs of the delta revisions as keyframes, so that they no longer depend on earlier revisions.
+    This is needed before the revisions that they are deltas against are deleted, and for the revisions that become
+    the latest revision of their item again.
+    """
+    revisions = [revision for revision in revisions if revision.config_delta is not None]
+    configs = [revision.config for revision in revisions]
+    for revision, config_id in zip(revisions, store_revision_configs(configs, session=session)):
+        revision.config_id = config_id
+        revision.config_delta = None
+        revision.delta_base_id = None
+        revision.delta_depth = 0
+
+
+def compact_revision_configs(batch_size=100, keyframe_interval=None, prune=False):
+    """
+    Moves the item revision configs out of the `itemrevision` table, a batch of `batch_size` items at a time (each
+    batch is committed on its own):
+    - The latest revision of each item references the deduplicated config, so it can still be loaded and searched
+      with SQL.
+    - Each earlier revision is stored as a delta against the revision before it. Every `keyframe_interval`
+      revisions, and whenever the delta isn't smaller than the config itself, the revision references the
+      deduplicated config instead (a keyframe), so that no config needs more than that many deltas applied.
+    Revisions that were already compacted are skipped, so this can be run periodically.
+    :param prune: Also delete the deduplicated configs that are no longer referenced. A watcher may be about to
+                  reference one of them, so this should only be done while the watchers are stopped.
+    :return: The number of revisions compacted.
+    """
+    keyframe_interval = keyframe_interval or app.config.get('REVISION_CONFIG_KEYFRAME_INTERVAL', 10)
+    compacted = 0
+    last_item_id = 0
+    while True:
+        latest_revision_ids = dict(db.session.query(Item.id, Item.latest_revision_id).filter(Item.id > last_item_id)
+                                   .order_by(Item.id).limit(batch_size))
+        if not latest_revision_ids:
+            break
+        last_item_id = max(latest_revision_ids)
+
+        # The last compacted revision of each item, which the first of the others is a delta against:
+        previous_ids = db.session.query(func.max(ItemRevision.id)) \
+            .filter(ItemRevision.item_id.in_(list(latest_revision_ids)), ItemRevision.delta_depth != None) \
+            .group_by(ItemRevision.item_id)  # noqa
+        previous = {revision.item_id: (revision.id, revision.config, revision.delta_depth) for revision in
+                    ItemRevision.query.filter(ItemRevision.id.in_([revision_id for revision_id, in previous_ids]))}
+
+        revisions = ItemRevision.query.options(undefer(ItemRevision._config), undefer(ItemRevision.config_delta),
+                                               selectinload(ItemRevision.stored_config)) \
+            .filter(ItemRevision.item_id.in_(list(latest_revision_ids)), ItemRevision.delta_depth == None) \
+            .order_by(ItemRevision.item_id, ItemRevision.id)  # noqa
+
+        updates = []
+        keyframes = []
+        for revision in revisions:
+            latest = revision.id == latest_revision_ids[revision.item_id]
+            if latest and revision._config is None:
+                continue
+
+            config = revision.config
+            update = dict(id=revision.id, _config=None, config_id=None, config_delta=None, delta_base_id=None,
+                          delta_depth=None)
+
+            base_id, base_config, base_depth = previous.get(revision.item_id, (None, None, None))
+            if not latest and base_id and base_id < revision.id and base_depth + 1 < keyframe_interval:
+                delta = make_delta(base_config, config)
+                if len(json.dumps(delta)) < len(json.dumps(config)):
+                    update.update(config_delta=delta, delta_base_id=base_id, delta_depth=base_depth + 1)
+
+            if update['config_delta'] is None:
+                keyframes.append((update, config))
+                if not latest:
+                    update['delta_depth'] = 0
+
+            updates.append(update)
+            previous[revision.item_id] = (revision.id, config, update['delta_depth'])
+
+        config_ids = store_revision_configs([config for _, config in keyframes])
+        for (update, _), config_id in zip(keyframes, config_ids):
+            update['config_id'] = config_id
+
+        db.session.bulk_update_mappings(ItemRevision, updates)
         db.session.commit()
-        app.logger.info("[-] Deleted {} Item Revisions for Item: {}".format(len(affected_revisions), item.arn))
+        compacted += len(updates)
+        app.logger.info("[-] Compacted {} item revisions.".format(compacted))
 
-    # Delete remaining whole items not processed in the 100 batches above:
-    for item_to_delete in whole_items_to_delete:
-        db.session.delete(item_to_delete)
-        whole_items_deleted += 1
-    db.session.commit()
+    if prune:
+        referenced = select([ItemRevision.id]).where(ItemRevision.config_id == ItemRevisionConfig.id)
+        pruned = ItemRevisionConfig.query.filter(~referenced.exists()).delete(synchronize_session=False)
+        db.session.commit()
+        app.logger.info("[-] Deleted {} item revision configs that are no longer referenced.".format(pruned))
+
+    return compacted
+
+
+def _item_score_totals(item_filter):
+    """The score, unjustified score, and number of the unfixed issues from enabled auditors, of each item."""
+    return select([ItemAudit.item_id.label('item_id'),
+                   func.coalesce(func.sum(ItemAudit.score), 0).label('score'),
+                   func.coalesce(func.sum(case([(ItemAudit.justified == False, ItemAudit.score)], else_=0)),  # noqa
+                                 0).label('unjustified_score'),
+                   func.count(ItemAudit.id).label('issue_count')]) \
+        .select_from(ItemAudit.__table__.join(AuditorSettings.__table__,
+                                              AuditorSettings.id == ItemAudit.auditor_setting_id)) \
+        .where(and_(item_filter(ItemAudit.item_id), ItemAudit.fixed == False, AuditorSettings.disabled == False)) \
+        .group_by(ItemAudit.item_id) \
+        .alias('totals')  # noqa
+
+
+def _update_item_scores(item_filter, session):
+    table = Item.__table__
+    totals = _item_score_totals(item_filter)
+    updated = session.execute(
+        table.update()
+        .where(table.c.id == totals.c.item_id)
+        .where(or_(table.c.score != totals.c.score,
+                   table.c.unjustified_score != totals.c.unjustified_score,
+                   table.c.issue_count != totals.c.issue_count))
+        .values(score=totals.c.score, unjustified_score=totals.c.unjustified_score,
+                issue_count=totals.c.issue_count)).rowcount
+
+    # The items that no longer have any issues that count:
+    counted = select([totals.c.item_id]).where(totals.c.item_id == table.c.id)
+    updated += session.execute(
+        table.update()
+        .where(item_filter(table.c.id))
+        .where(or_(table.c.score != 0, table.c.unjustified_score != 0, table.c.issue_count != 0))
+        .where(~counted.exists())
+        .values(score=0, unjustified_score=0, issue_count=0)).rowcount
+
+    return updated
+
+
+def update_item_scores(item_ids, session=None):
+    """
+    Recalculates the `score`, `unjustified_score`, and `issue_count` of the items, after their issues were added,
+    fixed, justified, or deleted, or their auditor settings were enabled or disabled. The caller commits.
+    :param item_ids: The item IDs, or a select of them.
+    :return: The number of items whose totals changed.
+    """
+    if isinstance(item_ids, (list, set, tuple)):
+        item_ids = list(item_ids)
+        if not item_ids:
+            return 0
+
+    return _update_item_scores(lambda column: column.in_(item_ids), session or db.session)
+
+
+def rebuild_item_scores(batch_size=1000):
+    """
+    Recalculates the totals of every item, `batch_size` items (by ID) at a time, to correct any drift.
+    :return: The number of items whose totals changed.
+    """
+    min_id, max_id = db.session.query(func.min(Item.id), func.max(Item.id)).one()
+    if min_id is None:
+        return 0
+
+    updated = 0
+    for start in range(min_id, max_id + 1, batch_size):
+        updated += _update_item_scores(lambda column: and_(column >= start, column < start + batch_size),
+                                       db.session)
+        db.session.commit()
 
-    app.logger.info("[-] Deleted {} full items.".format(whole_items_deleted))
-    app.logger.info("[-] Deleted {} individual revisions.".format(total_revisions_deleted))
+    app.logger.info("[-] Corrected the scores of {} items.".format(updated))
+    return updated
@@ -1,64 +1,161 @@
+from collections import OrderedDict
 import datetime
 from six import text_type
 
 from security_monkey import datastore, app
 from cloudaux.orchestration.aws.arn import ARN
-from security_monkey.datastore import Item, ItemRevision, hash_item
+from sqlalchemy import bindparam
+from sqlalchemy.orm import selectinload, undefer
+from security_monkey.datastore import Item, ItemRevision, hash_item, revision_config_columns
+from security_monkey.common.hashing import HASH_VERSION, LEGACY_HASH_VERSION
+from security_monkey.object_store import mark_stale
 
 prims = [int, str, text_type, bool, float, type(None)]
 
 
 def persist_item(item, db_item, technology, account, complete_hash, durable_hash, durable):
-    if not db_item:
-        if account.account_type.name != "AWS":
-            db_item = create_item(item, technology, account)
-        else:
-            db_item = create_item_aws(item, technology, account)
+    persist_items([(item, db_item, complete_hash, durable_hash, durable)], technology, account)
 
-    if db_item.latest_revision_complete_hash == complete_hash:
-        app.logger.debug("Change persister doesn't see any change. Ignoring...")
 
-        # Check if the durable hash is out of date for some reason. This could happen if the
-        # ephemeral definitions change. If this is the case, then update it.
-        if db_item.latest_revision_durable_hash != durable_hash:
-            app.logger.info("[?] Item: {item} in {account}/{tech} has an out of date durable hash. Updating...".format(
-                item=db_item.name, account=account.name, tech=technology.name
-            ))
-            db_item.latest_revision_durable_hash = durable_hash
-            datastore.db.session.add(db_item)
-            datastore.db.session.commit()
+def persist_items(changes, technology, account):
+    """
+    Persists the changes of a batch of items in a single transaction. The new revisions are inserted with one
+    statement, and the items' hashes, latest revision IDs, and first and last seen dates are then updated with
+    another.
+    If anything fails, nothing in the batch is persisted.
+    :param changes: List of (item, db_item or None if it doesn't exist yet, complete_hash, durable_hash, durable)
+    """
+    # An existing item only gets one new revision per batch -- the last change to it wins:
+    last_changes = {id(db_item): index for index, (_, db_item, _, _, _) in enumerate(changes) if db_item}
+    changes = [change for index, change in enumerate(changes)
+               if not change[1] or last_changes[id(change[1])] == index]
+
+    try:
+        # Write out any pending changes (like upgraded hashes) first, so that the bulk updates below win:
+        datastore.db.session.flush()
+
+        # Create the items that don't exist yet:
+        new_items = {}
+        for item, db_item, _, _, _ in changes:
+            if not db_item:
+                if account.account_type.name != "AWS":
+                    new_items[id(item)] = create_item(item, technology, account)
+                else:
+                    new_items[id(item)] = create_item_aws(item, technology, account)
+
+        if new_items:
+            datastore.db.session.add_all(list(new_items.values()))
+            datastore.db.session.flush()
+
+        now = datetime.datetime.utcnow()
+        item_updates = []
+        new_revisions = []
+        ephemeral_revisions = []
+        for item, db_item, complete_hash, durable_hash, durable in changes:
+            db_item = db_item or new_items[id(item)]
+
+            if db_item.latest_revision_complete_hash == complete_hash:
+                app.logger.debug("Change persister doesn't see any change. Ignoring...")
+
+                # Check if the durable hash is out of date for some reason. This could happen if the
+                # ephemeral definitions change. If this is the case, then update it.
+                if db_item.latest_revision_durable_hash != durable_hash:
+                    app.logger.info("[?] Item: {item} in {account}/{tech} has an out of date durable hash. "
+                                    "Updating...".format(item=db_item.name, account=account.name,
+                                                         tech=technology.name))
+                    item_updates.append({'id': db_item.id, 'latest_revision_durable_hash': durable_hash,
+                                         'hash_version': HASH_VERSION})
+                continue
+
+            item_updates.append({'id': db_item.id, 'latest_revision_complete_hash': complete_hash,
+                                 'latest_revision_durable_hash': durable_hash, 'hash_version': HASH_VERSION})
+
+            # Create the new revision
+            if durable:
+                app.logger.debug("Persisting DURABLE change to item: {technology}/{account}/{item}".format(
+                    technology=technology.name, account=account.name, item=db_item.name
+                ))
+                active = is_active(item.config)
+                new_revisions.append({'active': active, 'config': item.config,
+                                      'item_id': db_item.id, 'date_created': now})
+                item_updates[-1].update(last_seen=now, latest_active=active)
+                if not db_item.first_seen:
+                    item_updates[-1]['first_seen'] = now
+
+            # Ephemeral -- update the existing revision:
+            else:
+                app.logger.debug("Persisting EPHEMERAL change to item: {technology}/{account}/{item}".format(
+                    technology=technology.name, account=account.name, item=db_item.name
+                ))
+                revision_id = db_item.latest_revision_id or db_item.revisions.first().id
+                ephemeral_revisions.append({'id': revision_id, 'config': item.config,
+                                            'date_last_ephemeral_change': now})
+
+        latest_revision_ids = insert_revisions(new_revisions)
+        for update in item_updates:
+            if update['id'] in latest_revision_ids:
+                update['latest_revision_id'] = latest_revision_ids[update['id']]
+
+        update_items(item_updates)
+        update_revision_configs(ephemeral_revisions)
+
+        datastore.db.session.commit()
+        mark_stale(technology.name)
+
+    except Exception:
+        datastore.db.session.rollback()
+        raise
+
+
+def insert_revisions(revisions):
+    """
+    Inserts the revisions (dicts of the ItemRevision columns) with a single statement. An item gets at most one new
+    revision: if there are several for it, only the last one is inserted.
+    :return: dict of the item ID to the ID of its new revision.
+    """
+    if not revisions:
+        return {}
+
+    revisions = list(OrderedDict((revision['item_id'], revision) for revision in revisions).values())
+
+    # The configs are stored inline, or as references to the deduplicated configs:
+    columns = revision_config_columns([revision['config'] for revision in revisions])
+    revisions = [dict(revision, **config_columns) for revision, config_columns in zip(revisions, columns)]
+
+    table = ItemRevision.__table__
+    result = datastore.db.session.execute(table.insert().values(revisions).returning(table.c.id, table.c.item_id))
+    return {item_id: revision_id for revision_id, item_id in result}
+
+
+def update_revision_configs(revision_updates):
+    """
+    Updates the configs of the revisions with a single executemany.
+    :param revision_updates: List of dicts of the revision `id`, and its new `config` and `date_last_ephemeral_change`.
+    """
+    if not revision_updates:
         return
 
-    # Create the new revision
-    if durable:
-        revision = create_revision(item.config, db_item)
-        db_item.revisions.append(revision)
+    columns = revision_config_columns([update['config'] for update in revision_updates])
+    params = []
+    for update, config_columns in zip(revision_updates, columns):
+        params.append({'b_' + key: value for key, value in dict(update, **config_columns).items()})
 
-    # Ephemeral -- update the existing revision:
-    else:
-        revision = db_item.revisions.first()
-        revision.date_last_ephemeral_change = datetime.datetime.utcnow()
-        revision.config = item.config
-        app.logger.debug("Persisting EPHEMERAL change to item: {technology}/{account}/{item}".format(
-            technology=technology.name, account=account.name, item=db_item.name
-        ))
+    table = ItemRevision.__table__
+    values = {key[2:]: bindparam(key) for key in params[0] if key != 'b_id'}
+    datastore.db.session.execute(table.update().where(table.c.id == bindparam('b_id')).values(values), params)
 
-    db_item.latest_revision_complete_hash = complete_hash
-    db_item.latest_revision_durable_hash = durable_hash
 
-    datastore.db.session.add(db_item)
-    datastore.db.session.add(revision)
-    datastore.db.session.commit()
+def update_items(item_updates):
+    """
+    Updates the items from the dicts of their ID and changed columns. The updates are grouped by the columns
+    that they change, so that each group is a single executemany.
+    """
+    groups = {}
+    for update in item_updates:
+        groups.setdefault(tuple(sorted(update.keys())), []).append(update)
 
-    if durable:
-        app.logger.debug("Persisting DURABLE change to item: {technology}/{account}/{item}".format(
-            technology=technology.name, account=account.name, item=db_item.name
-        ))
-        datastore.db.session.refresh(revision)
-        db_item.latest_revision_id = revision.id
-        datastore.db.session.add(revision)
-        datastore.db.session.add(db_item)
-        datastore.db.session.commit()
+    for updates in groups.values():
+        datastore.db.session.bulk_update_mappings(Item, updates)
 
 
 def is_active(config):
@@ -100,7 +197,7 @@ def create_item(item, technology, account):
     )
 
 
-def detect_change(item, account, technology, complete_hash, durable_hash):
+def detect_change(item, account, technology, complete_hash, durable_hash, db_items=None):
     """
     Checks the database to see if the latest revision of the specified
     item matches what Security Monkey has pulled from AWS.
@@ -110,9 +207,13 @@ def detect_change(item, account, technology, complete_hash, durable_hash):
 
     :param item: dict describing an item tracked by Security Monkey
     :param hash: hash of the item dict for quicker change detection
+    :param db_items: Optional dict of the prefetched DB items (see `prefetch_items`), to avoid querying for the item
     :return: bool. True if the database differs from our copy of item
     """
-    result = result_from_item(item, account, technology)
+    if db_items is not None:
+        result = db_items.get((item.name, item.region))
+    else:
+        result = result_from_item(item, account, technology)
 
     # new item doesn't yet exist in DB
     if not result:
@@ -140,12 +241,69 @@ def detect_change(item, account, technology, complete_hash, durable_hash):
         return False, None, result, None
 
 
+def upgrade_legacy_hashes(item, db_item, ephemeral_paths, complete_hash, durable_hash):
+    """
+    Items hashed with an older hash version are compared with the hashes of that version instead. Where they still
+    match, the stored hashes are replaced with the current version's (complete_hash and durable_hash), so that the
+    new hashing doesn't make the item look changed. This is pending in the session until the next commit.
+    """
+    if not db_item or (db_item.hash_version or LEGACY_HASH_VERSION) == HASH_VERSION:
+        return
+
+    hash_version = db_item.hash_version or LEGACY_HASH_VERSION
+
+    old_complete_hash, old_durable_hash = hash_item(item.config, ephemeral_paths, hash_version=hash_version)
+    if db_item.latest_revision_complete_hash == old_complete_hash:
+        db_item.latest_revision_complete_hash = complete_hash
+    if db_item.latest_revision_durable_hash == old_durable_hash:
+        db_item.latest_revision_durable_hash = durable_hash
+    db_item.hash_version = HASH_VERSION
+
+
 def result_from_item(item, account, technology):
     # Construct the query to obtain the specific item from the database:
     return datastore.Item.query.filter(Item.name == item.name, Item.region == item.region,
                                        Item.account_id == account.id, Item.tech_id == technology.id).scalar()
 
 
+def prefetch_items(items, account, technology):
+    """
+    Loads the DB items for all of the items in a single query.
+    :return: dict of (name, region) to the DB item.
+    """
+    names = set(item.name for item in items)
+    if not names:
+        return {}
+
+    query = Item.query.filter(Item.name.in_(names), Item.account_id == account.id, Item.tech_id == technology.id)
+    return {(db_item.name, db_item.region): db_item for db_item in query}
+
+
+def load_previous_state(db_items):
+    """
+    Loads the issues and the latest revision config of the DB items (as `audit_issues` and `config`) with one query
+    each, so that they can be used as the old item of a ChangeItem.
+    """
+    db_items = [db_item for db_item in db_items if db_item.id]
+    if not db_items:
+        return
+
+    # Populates the issues of the DB items in the session:
+    Item.query.options(selectinload(Item.issues)).filter(Item.id.in_([db_item.id for db_item in db_items])).all()
+
+    revision_ids = [db_item.latest_revision_id for db_item in db_items if db_item.latest_revision_id]
+    revisions = ItemRevision.query.options(undefer(ItemRevision._config), selectinload(ItemRevision.stored_config)) \
+        .filter(ItemRevision.id.in_(revision_ids))
+    configs = {revision.id: revision.config for revision in revisions}
+
+    for db_item in db_items:
+        db_item.audit_issues = db_item.issues
+        if db_item.latest_revision_id in configs:
+            db_item.config = configs[db_item.latest_revision_id]
+        else:
+            db_item.config = db_item.revisions.first().config
+
+
 def inactivate_old_revisions(watcher, arns, account, technology):
     result = Item.query.filter(
         Item.account_id == account.id,
@@ -154,31 +312,47 @@ def inactivate_old_revisions(watcher, arns, account, technology):
     ).join((ItemRevision, Item.latest_revision_id == ItemRevision.id)) \
         .filter(ItemRevision.active == True).all()  # noqa
 
-    for db_item in result:
-        app.logger.debug("Deleting {technology}/{account}/{name}".format(
-            technology=technology.name, account=account.name, name=db_item.name
-        ))
+    inactivate_items(watcher, result, account, technology)
 
-        # Create the new revision
-        config = {"Arn": db_item.arn}
-        revision = create_revision(config, db_item)
-        db_item.revisions.append(revision)
+    return result
 
-        complete_hash, durable_hash = hash_item(config, watcher.ephemeral_paths)
 
-        db_item.latest_revision_complete_hash = complete_hash
-        db_item.latest_revision_durable_hash = durable_hash
+def inactivate_item(watcher, db_item, account, technology):
+    """Records an inactive revision for an item that no longer exists."""
+    inactivate_items(watcher, [db_item], account, technology)
 
-        # Add the revision:
-        datastore.db.session.add(db_item)
-        datastore.db.session.add(revision)
-        datastore.db.session.commit()
 
-        # Do it again to update the latest revision ID:
-        datastore.db.session.refresh(revision)
-        db_item.latest_revision_id = revision.id
-        datastore.db.session.add(db_item)
+def inactivate_items(watcher, db_items, account, technology):
+    """Records inactive revisions for the items that no longer exist, in a single transaction."""
+    if not db_items:
+        return
+
+    try:
+        now = datetime.datetime.utcnow()
+        revisions = []
+        item_updates = []
+        for db_item in db_items:
+            app.logger.debug("Deleting {technology}/{account}/{name}".format(
+                technology=technology.name, account=account.name, name=db_item.name
+            ))
+
+            config = {"Arn": db_item.arn}
+            active = is_active(config)
+            revisions.append({'active': active, 'config': config, 'item_id': db_item.id, 'date_created': now})
 
+            complete_hash, durable_hash = hash_item(config, watcher.ephemeral_paths)
+            item_updates.append({'id': db_item.id, 'latest_revision_complete_hash': complete_hash,
+                                 'latest_revision_durable_hash': durable_hash, 'hash_version': HASH_VERSION,
+                                 'list_fingerprint': None, 'last_seen': now, 'latest_active': active})
+
+        latest_revision_ids = insert_revisions(revisions)
+        for update in item_updates:
+            update['latest_revision_id'] = latest_revision_ids[update['id']]
+
+        update_items(item_updates)
         datastore.db.session.commit()
+        mark_stale(technology.name)
 
-    return result
+    except Exception:
+        datastore.db.session.rollback()
+        raise
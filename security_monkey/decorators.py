@@ -16,9 +16,8 @@ from six import string_types
 
 from security_monkey.datastore import Account, store_exception
 from security_monkey.exceptions import BotoConnectionIssue
-from security_monkey import app, sentry, AWS_DEFAULT_REGION, ARN_PREFIX, ARN_PARTITION
+from security_monkey import app, sentry, AWS_DEFAULT_REGION
 
-import boto3
 
 
 def crossdomain(allowed_origins=None, methods=None, headers=None,
@@ -164,27 +163,7 @@ def get_regions(account, service_name):
     if not service_name:
         return None, [AWS_DEFAULT_REGION]
 
-    sts = boto3.client('sts')
-    role_name = 'SecurityMonkey'
-    external_id = None
-    if account.getCustom("role_name") and account.getCustom("role_name") != '':
-        role_name = account.getCustom("role_name")
-    if account.getCustom("external_id") and account.getCustom("external_id") != '':
-        external_id = account.getCustom("external_id")
-
-    arn = ARN_PREFIX + ':iam::' + account.identifier + ':role/' + role_name
-    assume_role_kwargs = {
-        'RoleArn': arn,
-        'RoleSessionName': 'secmonkey'
-    }
-    if external_id:
-        assume_role_kwargs['ExternalId'] = external_id
-
-    role = sts.assume_role(**assume_role_kwargs)
-
-    session = boto3.Session(
-        aws_access_key_id=role['Credentials']['AccessKeyId'],
-        aws_secret_access_key=role['Credentials']['SecretAccessKey'],
-        aws_session_token=role['Credentials']['SessionToken']
-    )
-    return role, session.get_available_regions(service_name, partition_name=ARN_PARTITION)
+    from security_monkey.common.sts_connect import get_assumed_role_for_account
+    from security_monkey.common.regions import get_regions_for_account
+    role = get_assumed_role_for_account(account)
+    return role, get_regions_for_account(account, service_name)
@@ -1,9 +1,9 @@
 from flask import request, Response
 from flask.blueprints import Blueprint
-from sqlalchemy.sql.expression import cast
-from sqlalchemy import String, or_
+from sqlalchemy import or_
 from security_monkey import rbac
-from security_monkey.datastore import Item, ItemRevision, Account, Technology, ItemAudit, AuditorSettings
+from security_monkey.datastore import Item, ItemRevision, Account, Technology, ItemAudit, AuditorSettings, \
+    filter_revision_configs
 from sqlalchemy.orm import joinedload
 
 
@@ -48,8 +48,7 @@ def export_items():
         active = args['active'].lower() == "true"
         query = query.filter(ItemRevision.active == active)
     if 'searchconfig' in args:
-        searchconfig = args['searchconfig']
-        query = query.filter(cast(ItemRevision.config, String).ilike('%{}%'.format(searchconfig)))
+        query = filter_revision_configs(query, args['searchconfig'])
 
     # Eager load the joins and leave the config column out of this.
     query = query.options(joinedload('issues'))
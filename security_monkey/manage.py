@@ -21,7 +21,7 @@ from six import text_type
 
 from security_monkey.account_manager import bulk_disable_accounts, bulk_enable_accounts
 from security_monkey.common.s3_canonical import get_canonical_ids
-from security_monkey.datastore import clear_old_exceptions, store_exception, AccountType, ItemAudit, NetworkWhitelistEntry, delete_item_revisions_by_date
+from security_monkey.datastore import clear_old_exceptions, store_exception, AccountType, ItemAudit, NetworkWhitelistEntry
 
 from security_monkey import app, db, jirasync
 from security_monkey.common.route53 import Route53Service
@@ -31,6 +31,11 @@ from flask_migrate import Migrate, MigrateCommand
 from security_monkey.task_scheduler.tasks import manual_run_change_reporter, manual_run_change_finder
 from security_monkey.task_scheduler.tasks import audit_changes as sm_audit_changes
 from security_monkey.backup import backup_config_to_json as sm_backup_config_to_json
+from security_monkey.datastore import compact_revision_configs as sm_compact_revision_configs
+from security_monkey.datastore import rebuild_item_scores as sm_rebuild_item_scores
+from security_monkey.datastore import update_item_scores
+from security_monkey.object_store import mark_stale
+from security_monkey.retention import apply_retention_policies, delete_revisions_by_date as sm_delete_revisions_by_date
 from security_monkey.common.utils import find_modules, load_plugins
 from security_monkey.datastore import Account
 from security_monkey.watcher import watcher_registry
@@ -91,6 +96,23 @@ def find_changes(accounts, monitors):
     manual_run_change_finder(account_names, monitor_names)
 
 
+@manager.option('-d', '--directory', dest='directory', type=text_type, required=True)
+@manager.option('-p', '--processed-directory', dest='processed_directory', type=text_type, default=None)
+@manager.option('-i', '--interval', dest='interval', type=int, default=0)
+def ingest_cloudtrail(directory, processed_directory, interval):
+    """ Re-fetches only the items changed by the CloudTrail events in the directory. Polls every interval seconds if set. """
+    import time
+    from security_monkey.cloudtrail_ingest import ingest_directory
+
+    while True:
+        ingested = ingest_directory(directory, processed_directory=processed_directory)
+        app.logger.info("[+] Ingested {} CloudTrail event file(s) from {}.".format(ingested, directory))
+        if not interval:
+            return
+
+        time.sleep(interval)
+
+
 @manager.option('-a', '--accounts', dest='accounts', type=text_type, default=u'all')
 @manager.option('-m', '--monitors', dest='monitors', type=text_type, default=u'all')
 @manager.option('-r', '--send_report', dest='send_report', type=bool, default=False)
@@ -119,9 +141,12 @@ def delete_unjustified_issues(accounts, monitors):
         return -1
 
     issues = ItemAudit.query.filter_by(justified=False).all()
+    item_ids = set(issue.item_id for issue in issues)
     for issue in issues:
         del issue.sub_items[:]
         db.session.delete(issue)
+    db.session.flush()
+    update_item_scores(item_ids)
     db.session.commit()
 
 
@@ -138,7 +163,9 @@ def export_environment_summary(output_file):
     json_safe_object = defaultdict(dict)
     for tech_name, tech_body in Auditor.OBJECT_STORE.items():
         for item_name, item_accounts in tech_body.items():
-            json_safe_object[tech_name][item_name] = list(item_accounts)
+            if isinstance(item_accounts, set):
+                item_accounts = list(item_accounts)
+            json_safe_object[tech_name][item_name] = item_accounts
 
     # Write the file to disk
     with open(output_file, 'w') as of:
@@ -187,10 +214,36 @@ def delete_revisions_by_date(start_date, end_date):
         return -1
 
     app.logger.info("Deleting all change revisions from {start_date} to {end_date}".format(start_date=start, end_date=end))
-    delete_item_revisions_by_date(start, end)
+    sm_delete_revisions_by_date(start, end)
     app.logger.info("DONE!")
 
 
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int, default=None)
+def apply_retention(chunk_size):
+    """ Deletes the item revisions and items that the RETENTION_* options no longer keep. """
+    app.logger.info("Applying the retention policies...")
+    deleted = apply_retention_policies(chunk_size=chunk_size)
+    app.logger.info("Deleted {} rows.".format(deleted))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=100)
+@manager.option('-k', '--keyframe-interval', dest='keyframe_interval', type=int, default=None)
+@manager.option('-p', '--prune', dest='prune', type=bool, default=False)
+def compact_revision_configs(batch_size, keyframe_interval, prune):
+    """ Moves the item revision configs to the deduplicated (and delta) storage, batch-size items at a time. """
+    app.logger.info("Compacting the item revision configs...")
+    compacted = sm_compact_revision_configs(batch_size=batch_size, keyframe_interval=keyframe_interval, prune=prune)
+    app.logger.info("Compacted {} item revisions.".format(compacted))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000)
+def rebuild_item_scores(batch_size):
+    """ Recalculates the stored issue scores and counts of all items, batch-size items at a time. """
+    app.logger.info("Rebuilding the item scores...")
+    updated = sm_rebuild_item_scores(batch_size=batch_size)
+    app.logger.info("Corrected the scores of {} items.".format(updated))
+
+
 @manager.command
 def clear_expired_exceptions():
     """
@@ -835,6 +888,7 @@ def sync_networks(bucket_name, input_filename, authoritative):
             app.logger.debug('Removing stale network %s', entry.name)
             db.session.delete(entry)
     db.session.commit()
+    mark_stale('networkwhitelist')
     db.session.close()
 
 
@@ -0,0 +1,803 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.object_store
+    :platform: Unix
+    :synopsis: Builds the environment summary that the auditors use (the Auditor.OBJECT_STORE), and shares it
+               between the workers as a versioned snapshot.
+
+    The summary is made of sections: one for each technology that contributes to it, the network whitelist, and
+    the accounts. Each section is built with a single query.
+
+    With OBJECT_STORE_SNAPSHOT set to "redis" or "file", the sections are kept in Redis (the Celery broker, unless
+    OBJECT_STORE_SNAPSHOT_REDIS_URL is set), or in files in the OBJECT_STORE_SNAPSHOT_PATH directory, along with a
+    generation number that is incremented whenever sections are rebuilt. When the watchers persist changes to a
+    technology (or the accounts or the network whitelist change), its section is marked as stale. The next worker
+    that loads the summary rebuilds just the stale sections (each at most every OBJECT_STORE_REFRESH_INTERVAL
+    seconds). Every worker checks the generation whenever it loads the summary, and only fetches the sections that
+    changed since it last did. If Redis can't be reached, the process uses its own summary for the next
+    REDIS_RETRY_INTERVAL seconds, and marks the sections that were marked as stale in the meantime in Redis once it
+    can be reached again.
+
+    Otherwise, each process builds the summary itself, and only rebuilds the sections that it changed.
+
+.. version:: $$VERSION$$
+
+"""
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from copy import copy
+import fcntl
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+
+import ipaddr
+import netaddr
+import redis
+from six import text_type
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.orm import selectinload
+
+from security_monkey import app, db
+from security_monkey.common.utils import get_redis_url
+from security_monkey.datastore import Account, Item, ItemRevision, ItemRevisionConfig, NetworkWhitelistEntry, \
+    Technology
+
+# The number of rows that are fetched at a time when a section is built:
+BATCH_SIZE = 1000
+
+# Default for the OBJECT_STORE_REFRESH_INTERVAL configuration option (seconds):
+DEFAULT_REFRESH_INTERVAL = 60
+
+# How long a worker may hold the lock for rebuilding the stale sections:
+REBUILD_LOCK_TIMEOUT = 300
+
+KEY_PREFIX = 'security_monkey:object_store'
+
+# How long a process uses its own snapshot after Redis can't be reached, before it tries Redis again (seconds):
+REDIS_RETRY_INTERVAL = 30
+
+
+def add(to, key, value):
+    if not key:
+        return
+    if key in to:
+        to[key].add(value)
+    else:
+        to[key] = set([value])
+
+
+def latest_config_field(*path, **kwargs):
+    """
+    Extracts the value at the path (of keys) from the config of the latest revision in SQL, so that only that value
+    is fetched. The config is either inline, or the deduplicated one (the latest revision is never a delta).
+    Used with `_load_related_items`.
+    :param as_text: Extracts the value as text (the default), instead of as JSON.
+    """
+    inline = ItemRevision.__table__.c.config
+    stored = ItemRevisionConfig.__table__.c.config
+    key = path[0] if len(path) == 1 else path
+    if kwargs.get('as_text', True):
+        return func.coalesce(inline[key].astext, stored[key].astext)
+
+    return func.coalesce(inline[key], stored[key], type_=JSON)
+
+
+def _load_related_items(technology_name, *fields):
+    """
+    Streams the account identifier, and the fields (like `latest_config_field`s), of each item of the technology
+    with a single query. Items without a latest revision are skipped.
+    """
+    query = db.session.query(Account.identifier, *fields) \
+        .select_from(Item) \
+        .join(Technology, Technology.id == Item.tech_id) \
+        .join(Account, Account.id == Item.account_id) \
+        .join(ItemRevision, ItemRevision.id == Item.latest_revision_id) \
+        .outerjoin(ItemRevisionConfig, ItemRevisionConfig.id == ItemRevision.config_id) \
+        .filter(Technology.name == technology_name)
+    return query.yield_per(BATCH_SIZE)
+
+
+def _load_s3_buckets(section):
+    """Store the S3 bucket ARNs from all our accounts"""
+    for account, name in _load_related_items('s3', Item.name):
+        add(section['s3'], name, account)
+
+
+def _load_vpcs(section):
+    """Store the VPC IDs. Also, extract & store network/NAT ranges."""
+    results = _load_related_items('vpc', latest_config_field('id'), latest_config_field('cidr_block'),
+                                  latest_config_field('tags', 'vpcnat'))
+    for account, vpc_id, cidr_block, vpcnat_tags in results:
+        add(section['vpc'], vpc_id, account)
+        add(section['cidr'], cidr_block, account)
+
+        vpcnat_tag_cidrs = text_type(vpcnat_tags or '').split(',')
+        for vpcnat_tag_cidr in vpcnat_tag_cidrs:
+            add(section['cidr'], vpcnat_tag_cidr.strip(), account)
+
+
+def _load_vpces(section):
+    """Store the VPC Endpoint IDs."""
+    for account, vpce_id in _load_related_items('endpoint', latest_config_field('id')):
+        add(section['vpce'], vpce_id, account)
+
+
+def _load_elasticips(section):
+    """Store the Elastic IPs."""
+    results = _load_related_items('elasticip', latest_config_field('public_ip'),
+                                  latest_config_field('private_ip_address'))
+    for account, public_ip, private_ip_address in results:
+        add(section['cidr'], public_ip, account)
+        add(section['cidr'], private_ip_address, account)
+
+
+def _load_natgateways(section):
+    """Store the NAT Gateway CIDRs."""
+    results = _load_related_items('natgateway', latest_config_field('nat_gateway_addresses', as_text=False))
+    for account, addresses in results:
+        for address in addresses or []:
+            add(section['cidr'], address['public_ip'], account)
+            add(section['cidr'], address['private_ip'], account)
+
+
+def _load_network_whitelist(section):
+    """Stores the Network Whitelist CIDRs."""
+    for entry in NetworkWhitelistEntry.query.all():
+        add(section['cidr'], entry.cidr, '000000000000')
+
+
+def _load_iamuser_ids(section):
+    """Store the UserIDs from all IAMUsers."""
+    for account, user_id in _load_related_items('iamuser', latest_config_field('UserId')):
+        add(section['userid'], user_id, account)
+
+
+def _load_iamrole_ids(section):
+    """Store the RoleIDs from all IAMRoles."""
+    for account, role_id in _load_related_items('iamrole', latest_config_field('RoleId')):
+        add(section['userid'], role_id, account)
+
+
+def _load_accounts(section):
+    """Store the account IDs of all friendly/thirdparty accounts."""
+    accounts = Account.query.options(selectinload(Account.custom_fields)).all()
+
+    section['ACCOUNTS']['DESCRIPTIONS'] = list()
+    section['ACCOUNTS']['FRIENDLY'] = set()
+    section['ACCOUNTS']['THIRDPARTY'] = set()
+    # The identifiers of all of the accounts (including those that are neither), by name:
+    section['ACCOUNTS']['IDENTIFIERS'] = {account.name: account.identifier for account in accounts}
+
+    for third_party, label, key in ((False, 'friendly', 'FRIENDLY'), (True, 'thirdparty', 'THIRDPARTY')):
+        for account in accounts:
+            if account.third_party != third_party:
+                continue
+
+            add(section['ACCOUNTS'], key, account.identifier)
+            section['ACCOUNTS']['DESCRIPTIONS'].append(dict(
+                name=account.name,
+                identifier=account.identifier,
+                label=label,
+                s3_name=account.getCustom('s3_name'),
+                s3_canonical_id=account.getCustom('canonical_id')))
+
+
+# The sections of the summary (technology names, 'accounts', and 'networkwhitelist'), and how each is built:
+SECTIONS = OrderedDict([
+    ('s3', _load_s3_buckets),
+    ('iamuser', _load_iamuser_ids),
+    ('iamrole', _load_iamrole_ids),
+    ('accounts', _load_accounts),
+    ('elasticip', _load_elasticips),
+    ('vpc', _load_vpcs),
+    ('endpoint', _load_vpces),
+    ('natgateway', _load_natgateways),
+    ('networkwhitelist', _load_network_whitelist),
+])
+
+
+def build_section(name):
+    """Builds the section from the database. :return: dict of the OBJECT_STORE keys to their entries."""
+    app.logger.debug("[-] Building the {} section of the OBJECT_STORE.".format(name))
+    section = defaultdict(dict)
+    SECTIONS[name](section)
+    return dict(section)
+
+
+def merge_cidrs(object_store):
+    """
+    We learned about CIDRs from the elastic IP, VPC, VPC endpoint, NAT gateway, and network whitelist sections.
+
+    These cidr's are stored in the OBJECT_STORE in a way that is not optimal:
+
+        OBJECT_STORE['cidr']['54.0.0.1'] = set(['123456789012'])
+        OBJECT_STORE['cidr']['54.0.0.0'] = set(['123456789012'])
+        ...
+        OBJECT_STORE['cidr']['54.0.0.255/32'] = set(['123456789012'])
+
+    The above example is attempting to illustrate that account `123456789012`
+    contains `54.0.0.0/24`, maybe from 256 elastic IPs.
+
+    If a resource policy were attempting to ingress this range as a `/24` instead
+    of as individual IPs, it would not work.  We need to use the `cidr_merge`
+    method from the `netaddr` library.  We need to preserve the account identifiers
+    that are associated with each cidr as well.
+
+    # Using:
+    # https://netaddr.readthedocs.io/en/latest/tutorial_01.html?highlight=summarize#summarizing-list-of-addresses-and-subnets
+    # import netaddr
+    # netaddr.cidr_merge(ip_list)
+
+    Step 1: Group CIDRs by account:
+    #   ['123456789012'] = ['IP', 'IP']
+
+    Step 2:
+    Merge each account's cidr's separately and repalce the OBJECT_STORE['cidr'] entry.
+
+    Return:
+        `None`.  Mutates the object_store['cidr'] datastructure.
+    """
+    if not 'cidr' in object_store:
+        return
+
+    # step 1
+    merged = defaultdict(set)
+    for cidr, accounts in list(object_store['cidr'].items()):
+        for account in accounts:
+            merged[account].add(cidr)
+
+    del object_store['cidr']
+
+    # step 2
+    for account, cidrs in list(merged.items()):
+        merged_cidrs = netaddr.cidr_merge(cidrs)
+        for cidr in merged_cidrs:
+            add(object_store['cidr'], str(cidr), account)
+
+
+class CIDRIndex(object):
+    """
+    Finds the accounts that own the CIDRs in the object store (`object_store['cidr']`) that contain a network.
+
+    The CIDRs are kept in a table per IP version and prefix length, keyed by their network prefix (the network
+    address shifted right by the host bits). A network's containing CIDRs are found by looking up its own prefix
+    at each of the prefix lengths (up to its own) that the store has CIDRs for. This is at most 33 (IPv4) or 129
+    (IPv6) lookups, instead of a comparison with every CIDR.
+    """
+
+    def __init__(self, cidrs):
+        self.cidrs = cidrs
+        # version -> prefix length -> network prefix -> accounts
+        self.tables = defaultdict(lambda: defaultdict(dict))
+        for cidr, accounts in cidrs.items():
+            network = ipaddr.IPNetwork(cidr)
+            prefix = int(network.network) >> (network.max_prefixlen - network.prefixlen)
+            self.tables[network.version][network.prefixlen].setdefault(prefix, set()).update(accounts)
+
+        self.prefixlens = {version: sorted(table) for version, table in self.tables.items()}
+
+    def __len__(self):
+        return len(self.cidrs)
+
+    def lookup(self, cidr):
+        """:return: The set of accounts that own a CIDR that contains the network (an IP or CIDR string)."""
+        network = ipaddr.IPNetwork(cidr)
+        table = self.tables.get(network.version, {})
+        accounts = set()
+        for prefixlen in self.prefixlens.get(network.version, []):
+            if prefixlen > network.prefixlen:
+                break
+            prefix = int(network.network) >> (network.max_prefixlen - prefixlen)
+            accounts.update(table[prefixlen].get(prefix, ()))
+
+        return accounts
+
+
+class AccountDirectory(object):
+    """
+    Looks up the accounts in the object store (`object_store['ACCOUNTS']`) with hash indexes, instead of scanning
+    the account descriptions. Built once for each time the object store is loaded, and not changed after.
+    """
+
+    def __init__(self, accounts):
+        self.accounts = accounts
+        self._identifiers_by_name = dict(accounts.get('IDENTIFIERS', {}))
+        self._friendly = frozenset(accounts.get('FRIENDLY', ()))
+        self._thirdparty = frozenset(accounts.get('THIRDPARTY', ()))
+
+        self._by_identifier = {}
+        # field -> lower cased value -> description. The first description with the value wins:
+        self._by_field = defaultdict(dict)
+        self._by_label = defaultdict(list)
+        for description in accounts.get('DESCRIPTIONS', []):
+            self._by_identifier.setdefault(description['identifier'], description)
+            for field, value in description.items():
+                self._by_field[field].setdefault(text_type(value).lower(), description)
+            self._by_label[description['label']].append(description)
+
+        self._by_field = dict(self._by_field)
+        self._by_label = {label: tuple(descriptions) for label, descriptions in self._by_label.items()}
+
+    def identifier(self, name):
+        """:return: The identifier of the account with the name (friendly, third party, or neither), or None."""
+        return self._identifiers_by_name.get(name)
+
+    def get(self, identifier):
+        """:return: The description of the friendly or third party account with the identifier, or None."""
+        return self._by_identifier.get(identifier)
+
+    def find(self, field, value):
+        """:return: The description of the account whose field (like 's3_name') matches the value, ignoring case."""
+        return self._by_field.get(field, {}).get(text_type(value).lower())
+
+    def labelled(self, label):
+        """:return: The descriptions of the accounts with the label ('friendly' or 'thirdparty')."""
+        return self._by_label.get(label, ())
+
+    def is_friendly(self, identifier):
+        return identifier in self._friendly
+
+    def is_thirdparty(self, identifier):
+        return identifier in self._thirdparty
+
+
+def assemble(sections, object_store):
+    """Replaces the contents of the object store with the union of the sections, and merges the CIDRs."""
+    assembled = defaultdict(dict)
+    for section in sections:
+        for store_key, entries in section.items():
+            for key, value in entries.items():
+                if isinstance(value, set):
+                    assembled[store_key].setdefault(key, set()).update(value)
+                else:
+                    assembled[store_key][key] = copy(value)
+
+    merge_cidrs(assembled)
+    object_store.clear()
+    object_store.update(assembled)
+
+
+def encode_section(section):
+    """Serializes the section compactly. The sets are stored as sorted lists, apart from the other values."""
+    sets = defaultdict(dict)
+    values = defaultdict(dict)
+    for store_key, entries in section.items():
+        for key, value in entries.items():
+            if isinstance(value, set):
+                sets[store_key][key] = sorted(value)
+            else:
+                values[store_key][key] = value
+
+    return json.dumps({'sets': sets, 'values': values}, separators=(',', ':'))
+
+
+def decode_section(data):
+    data = json.loads(data)
+    section = defaultdict(dict)
+    for store_key, entries in data['sets'].items():
+        for key, value in entries.items():
+            section[store_key][key] = set(value)
+    for store_key, entries in data['values'].items():
+        section[store_key].update(entries)
+
+    return dict(section)
+
+
+class SnapshotStore(object):
+    """
+    Where the sections of the summary are kept. Subclasses store:
+    - The generation of the snapshot, which is incremented whenever sections are rebuilt.
+    - Each section, with the generation it was built in, and when it was built.
+    - The names of the stale sections.
+    """
+
+    def get_state(self):
+        """:return: The generation, dict of section name to (generation, time built), and the stale section names."""
+        raise NotImplementedError()
+
+    def get_sections(self, names):
+        """:return: dict of section name to (generation, section), for the sections that exist."""
+        raise NotImplementedError()
+
+    def mark_stale(self, names):
+        raise NotImplementedError()
+
+    def publish(self, generation, sections):
+        """Stores the rebuilt sections (dict of name to section) as the given generation. Holds the rebuild lock."""
+        raise NotImplementedError()
+
+    def clear_stale(self, names):
+        raise NotImplementedError()
+
+    def rebuild_lock(self):
+        raise NotImplementedError()
+
+    def forget(self):
+        """Called when the process's OBJECT_STORE is empty. Stores that are kept in the process start over."""
+        pass
+
+    @staticmethod
+    def _due(sections, stale, interval):
+        now = time.time()
+        return [name for name in SECTIONS if name not in sections or
+                (name in stale and now - sections[name][1] >= interval)]
+
+    def rebuild_stale(self, interval):
+        """Rebuilds the sections that are missing, and the stale ones that weren't built in the last `interval`s."""
+        _, sections, stale = self.get_state()
+        if not self._due(sections, stale, interval):
+            return
+
+        with self.rebuild_lock():
+            # Another worker may have rebuilt them while this one waited:
+            generation, sections, stale = self.get_state()
+            due = self._due(sections, stale, interval)
+            if not due:
+                return
+
+            # Changes persisted while the sections are being built mark them as stale again:
+            self.clear_stale(due)
+            self.publish(generation + 1, OrderedDict((name, build_section(name)) for name in due))
+            app.logger.info("[-] Rebuilt the {} sections of the OBJECT_STORE (generation {}).".format(
+                ', '.join(due), generation + 1))
+
+
+class LocalSnapshotStore(SnapshotStore):
+    """Keeps the sections in this process. Used when the snapshot isn't shared, or Redis can't be reached."""
+
+    def __init__(self):
+        self.generation = 0
+        # name -> (generation, time built, section)
+        self.sections = {}
+        self.stale = set()
+        self.lock = threading.RLock()
+
+    def get_state(self):
+        with self.lock:
+            return self.generation, {name: (generation, built) for name, (generation, built, _) in
+                                     self.sections.items()}, set(self.stale)
+
+    def get_sections(self, names):
+        with self.lock:
+            return {name: (self.sections[name][0], self.sections[name][2]) for name in names
+                    if name in self.sections}
+
+    def mark_stale(self, names):
+        with self.lock:
+            self.stale.update(names)
+
+    def clear_stale(self, names):
+        with self.lock:
+            self.stale.difference_update(names)
+
+    def publish(self, generation, sections):
+        with self.lock:
+            built = time.time()
+            for name, section in sections.items():
+                self.sections[name] = (generation, built, section)
+            self.generation = generation
+
+    def rebuild_lock(self):
+        return self.lock
+
+    def forget(self):
+        with self.lock:
+            self.generation += 1
+            self.sections = {}
+            self.stale = set()
+
+
+class RedisSnapshotStore(SnapshotStore):
+    """Keeps the sections in Redis, so that they are shared by every worker."""
+
+    def __init__(self, url):
+        self.client = redis.StrictRedis.from_url(url)
+
+    def _key(self, name):
+        return '{}:{}'.format(KEY_PREFIX, name)
+
+    def get_state(self):
+        pipeline = self.client.pipeline()
+        pipeline.get(self._key('generation'))
+        pipeline.hgetall(self._key('generations'))
+        pipeline.hgetall(self._key('built'))
+        pipeline.smembers(self._key('stale'))
+        generation, generations, built, stale = pipeline.execute()
+
+        sections = {name.decode('utf-8'): (int(section_generation), float(built.get(name, 0)))
+                    for name, section_generation in generations.items()}
+        return int(generation or 0), sections, set(name.decode('utf-8') for name in stale)
+
+    def get_sections(self, names):
+        if not names:
+            return {}
+
+        pipeline = self.client.pipeline()
+        pipeline.hmget(self._key('generations'), names)
+        pipeline.hmget(self._key('sections'), names)
+        generations, sections = pipeline.execute()
+        return {name: (int(generation), decode_section(section))
+                for name, generation, section in zip(names, generations, sections) if section is not None}
+
+    def mark_stale(self, names):
+        self.client.sadd(self._key('stale'), *names)
+
+    def clear_stale(self, names):
+        self.client.srem(self._key('stale'), *names)
+
+    def publish(self, generation, sections):
+        built = time.time()
+        pipeline = self.client.pipeline()
+        for name, section in sections.items():
+            pipeline.hset(self._key('sections'), name, encode_section(section))
+            pipeline.hset(self._key('generations'), name, generation)
+            pipeline.hset(self._key('built'), name, built)
+        pipeline.set(self._key('generation'), generation)
+        pipeline.execute()
+
+    def rebuild_lock(self):
+        return self.client.lock(self._key('lock'), timeout=REBUILD_LOCK_TIMEOUT, blocking_timeout=REBUILD_LOCK_TIMEOUT)
+
+
+class FileSnapshotStore(SnapshotStore):
+    """
+    Keeps the sections in files in a directory, so that they are shared by the workers on this host. Each section is
+    a file, and `state.json` has the generations and the stale sections. Files are replaced atomically.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path, 0o700)
+
+        # The auditors trust the snapshot, so nobody else may be able to write to it:
+        st = os.stat(path)
+        if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise ValueError("The snapshot directory {} must be owned by this user, and not be writable by "
+                             "anyone else.".format(path))
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _read(self, name):
+        try:
+            with open(self._file(name)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write(self, name, data):
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix='.' + name)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(temp_path, self._file(name))
+
+    @contextmanager
+    def _flock(self, name):
+        with open(self._file(name), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        return self._read('state.json') or {'generation': 0, 'sections': {}, 'stale': []}
+
+    def _update_state(self, update):
+        with self._flock('state.lock'):
+            state = self._read_state()
+            update(state)
+            self._write('state.json', state)
+
+    def get_state(self):
+        state = self._read_state()
+        sections = {name: tuple(section) for name, section in state['sections'].items()}
+        return state['generation'], sections, set(state['stale'])
+
+    def get_sections(self, names):
+        sections = {}
+        for name in names:
+            data = self._read('{}.json'.format(name))
+            if data:
+                sections[name] = (data['generation'], decode_section(data['section']))
+        return sections
+
+    def mark_stale(self, names):
+        self._update_state(lambda state: state.update(stale=sorted(set(state['stale']) | set(names))))
+
+    def clear_stale(self, names):
+        self._update_state(lambda state: state.update(stale=sorted(set(state['stale']) - set(names))))
+
+    def publish(self, generation, sections):
+        built = time.time()
+        for name, section in sections.items():
+            self._write('{}.json'.format(name), {'generation': generation, 'section': encode_section(section)})
+
+        def update(state):
+            state['generation'] = generation
+            for name in sections:
+                state['sections'][name] = [generation, built]
+
+        self._update_state(update)
+
+    def rebuild_lock(self):
+        return self._flock('rebuild.lock')
+
+
+_store = None
+_store_lock = threading.Lock()
+
+# While Redis can't be reached: the per-process store that is used instead, when Redis is tried again, and the
+# sections that were marked as stale in the meantime (which are marked in Redis once it can be reached again):
+_fallback = {'store': None, 'retry_at': 0, 'stale': set()}
+
+# The store and sections that this process assembled its OBJECT_STORE from, and the generation of the snapshot at
+# the time:
+_loaded = {'store': None, 'generation': None, 'sections': {}}
+_loaded_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if not _store:
+            snapshot = app.config.get('OBJECT_STORE_SNAPSHOT')
+            url = get_redis_url('OBJECT_STORE_SNAPSHOT_REDIS_URL') if snapshot == 'redis' else None
+            if url:
+                _store = RedisSnapshotStore(url)
+            elif snapshot == 'file':
+                _store = _get_file_store(app.config.get('OBJECT_STORE_SNAPSHOT_PATH'))
+            else:
+                _store = LocalSnapshotStore()
+        return _store
+
+
+def _get_file_store(path):
+    if not path:
+        app.logger.error("[-] OBJECT_STORE_SNAPSHOT_PATH must be set to use the file OBJECT_STORE snapshot. "
+                         "Falling back to a per-process one.")
+        return LocalSnapshotStore()
+
+    try:
+        return FileSnapshotStore(path)
+    except (OSError, ValueError) as e:
+        app.logger.error("[-] Unable to use {} for the OBJECT_STORE snapshot. Falling back to a per-process one. "
+                         "Error: {}".format(path, e))
+        return LocalSnapshotStore()
+
+
+def _fall_back(e, names=()):
+    app.logger.warn("[?] Unable to use Redis for the OBJECT_STORE snapshot. Using a per-process one for the next {} "
+                    "seconds. Error: {}".format(REDIS_RETRY_INTERVAL, e))
+    with _store_lock:
+        if not _fallback['store']:
+            _fallback['store'] = LocalSnapshotStore()
+        _fallback['retry_at'] = time.time() + REDIS_RETRY_INTERVAL
+        _fallback['stale'].update(names)
+        return _fallback['store']
+
+
+def _get_fallback_store():
+    """Returns the per-process store while Redis can't be reached (until it is tried again), otherwise `None`."""
+    with _store_lock:
+        if time.time() < _fallback['retry_at']:
+            return _fallback['store']
+
+
+def _recover(store):
+    """Marks the sections that were marked as stale while Redis couldn't be reached. Raises a RedisError if it still
+    can't be."""
+    with _store_lock:
+        names = list(_fallback['stale'])
+    if names:
+        store.mark_stale(names)
+
+    with _store_lock:
+        _fallback['stale'].difference_update(names)
+        # Redis can be reached again. A later fallback starts from scratch, since it missed the changes in between:
+        _fallback['store'] = None
+
+
+def _load(store, object_store):
+    with _loaded_lock:
+        if store is not _loaded['store']:
+            _loaded['store'] = store
+            _loaded['generation'] = None
+            _loaded['sections'] = {}
+
+        if not object_store:
+            store.forget()
+            _loaded['generation'] = None
+            _loaded['sections'] = {}
+
+        try:
+            store.rebuild_stale(app.config.get('OBJECT_STORE_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL))
+        except redis.exceptions.LockError as e:
+            app.logger.warn("[?] Timed out waiting for the OBJECT_STORE to be rebuilt. Using the current snapshot. "
+                            "Error: {}".format(e))
+
+        generation, sections, _ = store.get_state()
+        if object_store and generation == _loaded['generation']:
+            return
+
+        changed = [name for name, (section_generation, _) in sections.items()
+                   if _loaded['sections'].get(name, (None, None))[0] != section_generation]
+        _loaded['sections'].update(store.get_sections(changed))
+        assemble([_loaded['sections'][name][1] for name in SECTIONS if name in _loaded['sections']], object_store)
+        _loaded['generation'] = generation
+
+
+def load_object_store(object_store):
+    """
+    Brings the object store (the Auditor.OBJECT_STORE) up to date with the snapshot. The stale (or missing) sections
+    are rebuilt first. The object store is reassembled if any section changed since it was last loaded, or if it's
+    empty.
+    """
+    fallback = _get_fallback_store()
+    if not fallback:
+        store = get_store()
+        try:
+            _recover(store)
+            _load(store, object_store)
+            return
+        except redis.exceptions.RedisError as e:
+            fallback = _fall_back(e)
+
+    _load(fallback, object_store)
+
+
+def mark_stale(*names):
+    """
+    Marks the sections as stale, after changes to them were committed. Takes technology names, 'accounts', and
+    'networkwhitelist'. Names that aren't sections are ignored. Marks all of the sections if none are given.
+    """
+    names = [name for name in (names or SECTIONS) if name in SECTIONS]
+    if not names:
+        return
+
+    fallback = _get_fallback_store()
+    if fallback:
+        with _store_lock:
+            _fallback['stale'].update(names)
+    else:
+        store = get_store()
+        try:
+            _recover(store)
+            store.mark_stale(names)
+            return
+        except redis.exceptions.RedisError as e:
+            fallback = _fall_back(e, names)
+
+    fallback.mark_stale(names)
+
+
+def reset():
+    """Forgets the snapshot store, and what this process loaded. Mostly for tests."""
+    global _store
+    with _store_lock:
+        _store = None
+        _fallback['store'] = None
+        _fallback['retry_at'] = 0
+        _fallback['stale'] = set()
+    with _loaded_lock:
+        _loaded['store'] = None
+        _loaded['generation'] = None
+        _loaded['sections'] = {}
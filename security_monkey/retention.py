@@ -0,0 +1,270 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.retention
+    :platform: Unix
+    :synopsis: Deletes old item revisions and items with set-based SQL.
+
+    The retention policies are:
+    - `RETENTION_KEEP_REVISIONS`: Only the newest N revisions of each item are kept.
+    - `RETENTION_DAILY_AFTER_DAYS`: Revisions older than this many days are thinned to the last revision of each day.
+    - `RETENTION_INACTIVE_ITEM_DAYS`: Items that were deleted (their latest revision is inactive) more than this
+      many days ago are deleted, with everything that belongs to them.
+    The latest revision of an item is never deleted by the first two.
+
+    Rows are deleted a chunk (`RETENTION_CHUNK_SIZE` revisions) at a time, and each chunk is committed on its own,
+    so that a run can be interrupted and picked up again by the next one.
+
+.. version:: $$VERSION$$
+
+"""
+import datetime
+import time
+
+from sqlalchemy import func, or_, select
+
+from security_monkey import app, db
+from security_monkey.datastore import CloudTrailEntry, ExceptionLogs, Item, ItemAudit, ItemComment, ItemRevision, \
+    ItemRevisionComment, issue_item_association, materialize_revisions
+from security_monkey.object_store import mark_stale
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# The window functions rank the revisions of this many items (by ID) at a time:
+ITEM_RANGE_SIZE = 1000
+
+# Items are deleted this many at a time, since each has many rows:
+ITEM_CHUNK_SIZE = 100
+
+
+class RetentionProgress(object):
+    """Logs how many rows a retention step has deleted, and how fast."""
+
+    def __init__(self, step):
+        self.step = step
+        self.deleted = 0
+        self.started = time.time()
+
+    def add(self, deleted):
+        self.deleted += deleted
+        elapsed = max(time.time() - self.started, 0.001)
+        app.logger.info("[-] Retention ({step}): deleted {deleted} rows in {elapsed:.1f}s ({rate:.0f} rows/s).".format(
+            step=self.step, deleted=self.deleted, elapsed=elapsed, rate=self.deleted / elapsed))
+
+
+def _get_chunk_size(chunk_size=None):
+    return chunk_size or app.config.get('RETENTION_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def _item_id_ranges():
+    """Yields the (inclusive start, exclusive end) ranges of item IDs, `ITEM_RANGE_SIZE` at a time."""
+    min_id, max_id = db.session.query(func.min(Item.id), func.max(Item.id)).one()
+    if min_id is None:
+        return
+
+    for start in range(min_id, max_id + 1, ITEM_RANGE_SIZE):
+        yield start, start + ITEM_RANGE_SIZE
+
+
+def _delete_revisions(revision_ids):
+    """
+    Deletes the revisions, and the comments and CloudTrail entries on them. The caller commits.
+    :return: The number of rows deleted.
+    """
+    # The revisions that are deltas against these need to have their own configs first:
+    materialize_revisions(ItemRevision.query.filter(ItemRevision.delta_base_id.in_(revision_ids),
+                                                    ItemRevision.id.notin_(revision_ids)).all())
+    db.session.flush()
+
+    deleted = ItemRevisionComment.query.filter(ItemRevisionComment.revision_id.in_(revision_ids)) \
+        .delete(synchronize_session=False)
+    deleted += CloudTrailEntry.query.filter(CloudTrailEntry.revision_id.in_(revision_ids)) \
+        .delete(synchronize_session=False)
+    deleted += ItemRevision.query.filter(ItemRevision.id.in_(revision_ids)).delete(synchronize_session=False)
+    return deleted
+
+
+def _delete_items(item_ids):
+    """
+    Deletes the items, and everything that belongs to them. The caller commits.
+    :return: The number of rows deleted.
+    """
+    revision_ids = select([ItemRevision.id]).where(ItemRevision.item_id.in_(item_ids))
+    issue_ids = select([ItemAudit.id]).where(ItemAudit.item_id.in_(item_ids))
+
+    deleted = ItemRevisionComment.query.filter(ItemRevisionComment.revision_id.in_(revision_ids)) \
+        .delete(synchronize_session=False)
+    deleted += CloudTrailEntry.query.filter(CloudTrailEntry.item_id.in_(item_ids)).delete(synchronize_session=False)
+    deleted += ItemRevision.query.filter(ItemRevision.item_id.in_(item_ids)).delete(synchronize_session=False)
+    deleted += db.session.execute(issue_item_association.delete().where(
+        or_(issue_item_association.c.sub_item_id.in_(item_ids),
+            issue_item_association.c.super_issue_id.in_(issue_ids)))).rowcount
+    deleted += ItemAudit.query.filter(ItemAudit.item_id.in_(item_ids)).delete(synchronize_session=False)
+    deleted += ItemComment.query.filter(ItemComment.item_id.in_(item_ids)).delete(synchronize_session=False)
+    deleted += ExceptionLogs.query.filter(ExceptionLogs.item_id.in_(item_ids)).delete(synchronize_session=False)
+    deleted += Item.query.filter(Item.id.in_(item_ids)).delete(synchronize_session=False)
+    return deleted
+
+
+def _fix_latest_revisions(item_ids):
+    """
+    Deletes the items that no longer have any revisions, and points the others at their latest remaining revision
+    (and its date and active flag) with a single UPDATE ... FROM. The caller commits.
+    :return: The number of rows deleted.
+    """
+    has_revisions = select([ItemRevision.id]).where(ItemRevision.item_id == Item.id).exists()
+    empty_item_ids = [item_id for item_id, in db.session.query(Item.id).filter(Item.id.in_(item_ids), ~has_revisions)]
+    deleted = _delete_items(empty_item_ids) if empty_item_ids else 0
+
+    latest = db.session.query(ItemRevision.item_id.label('item_id'), ItemRevision.id.label('id'),
+                              ItemRevision.date_created.label('date_created'), ItemRevision.active.label('active')) \
+        .filter(ItemRevision.item_id.in_(item_ids)) \
+        .distinct(ItemRevision.item_id) \
+        .order_by(ItemRevision.item_id, ItemRevision.date_created.desc(), ItemRevision.id.desc()) \
+        .subquery()
+
+    table = Item.__table__
+    db.session.execute(table.update()
+                       .where(table.c.id == latest.c.item_id)
+                       .where(or_(table.c.latest_revision_id == None,  # noqa
+                                  table.c.latest_revision_id != latest.c.id))
+                       .values(latest_revision_id=latest.c.id, last_seen=latest.c.date_created,
+                               latest_active=latest.c.active))
+
+    # Only historical revisions are stored as deltas:
+    materialize_revisions(ItemRevision.query.join(Item, Item.latest_revision_id == ItemRevision.id)
+                          .filter(Item.id.in_(item_ids), ItemRevision.config_delta != None).all())  # noqa
+    return deleted
+
+
+def _delete_ranked_revisions(step, partition_by, keep, chunk_size, *filters):
+    """
+    Ranks the revisions (newest first) within each partition, and deletes the ones ranked after `keep`, except for
+    the latest revisions of the items.
+    """
+    progress = RetentionProgress(step)
+    for start, end in _item_id_ranges():
+        rank = func.row_number().over(partition_by=partition_by, order_by=ItemRevision.id.desc()).label('rank')
+        ranked = db.session.query(ItemRevision.id.label('id'), Item.latest_revision_id.label('latest_revision_id'),
+                                  rank) \
+            .select_from(ItemRevision) \
+            .join(Item, Item.id == ItemRevision.item_id) \
+            .filter(ItemRevision.item_id >= start, ItemRevision.item_id < end, *filters) \
+            .subquery()
+
+        query = db.session.query(ranked.c.id).filter(ranked.c.rank > keep, ranked.c.id != ranked.c.latest_revision_id)
+        while True:
+            revision_ids = [revision_id for revision_id, in query.limit(chunk_size)]
+            if not revision_ids:
+                break
+
+            progress.add(_delete_revisions(revision_ids))
+            db.session.commit()
+
+    return progress.deleted
+
+
+def delete_excess_revisions(keep, chunk_size=None):
+    """
+    Deletes all but the newest `keep` revisions of each item.
+    :return: The number of rows deleted.
+    """
+    return _delete_ranked_revisions("keep {} revisions".format(keep), [ItemRevision.item_id], keep,
+                                    _get_chunk_size(chunk_size))
+
+
+def thin_old_revisions(days, chunk_size=None):
+    """
+    Deletes all but the last revision of each day of each item, for the revisions older than `days` days.
+    :return: The number of rows deleted.
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    return _delete_ranked_revisions("daily after {} days".format(days),
+                                    [ItemRevision.item_id, func.date_trunc('day', ItemRevision.date_created)], 1,
+                                    _get_chunk_size(chunk_size), ItemRevision.date_created < cutoff)
+
+
+def delete_inactive_items(days, chunk_size=None):
+    """
+    Deletes the items whose latest revision is inactive, and more than `days` days old.
+    :return: The number of rows deleted.
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    query = db.session.query(Item.id) \
+        .join(ItemRevision, ItemRevision.id == Item.latest_revision_id) \
+        .filter(ItemRevision.active == False, ItemRevision.date_created < cutoff)  # noqa
+
+    progress = RetentionProgress("inactive items after {} days".format(days))
+    chunk_size = min(_get_chunk_size(chunk_size), ITEM_CHUNK_SIZE)
+    while True:
+        item_ids = [item_id for item_id, in query.limit(chunk_size)]
+        if not item_ids:
+            break
+
+        progress.add(_delete_items(item_ids))
+        db.session.commit()
+
+    if progress.deleted:
+        mark_stale()
+    return progress.deleted
+
+
+def delete_revisions_by_date(start_date, end_date, chunk_size=None):
+    """
+    Deletes the revisions created from the start date up to the end date. Items whose latest revision is deleted
+    point at their latest remaining revision instead, and the items that have no revisions left are deleted.
+    :return: The number of rows deleted.
+    """
+    query = db.session.query(ItemRevision.id, ItemRevision.item_id) \
+        .filter(ItemRevision.date_created >= start_date, ItemRevision.date_created < end_date) \
+        .order_by(ItemRevision.id)
+
+    progress = RetentionProgress("from {} to {}".format(start_date, end_date))
+    chunk_size = _get_chunk_size(chunk_size)
+    while True:
+        rows = query.limit(chunk_size).all()
+        if not rows:
+            break
+
+        deleted = _delete_revisions([revision_id for revision_id, _ in rows])
+        deleted += _fix_latest_revisions(list(set(item_id for _, item_id in rows)))
+        db.session.commit()
+        progress.add(deleted)
+
+    if progress.deleted:
+        mark_stale()
+    return progress.deleted
+
+
+def retention_policies_configured():
+    return any(app.config.get(option) for option in ('RETENTION_KEEP_REVISIONS', 'RETENTION_DAILY_AFTER_DAYS',
+                                                     'RETENTION_INACTIVE_ITEM_DAYS'))
+
+
+def apply_retention_policies(chunk_size=None):
+    """
+    Applies the configured retention policies.
+    :return: The number of rows deleted.
+    """
+    deleted = 0
+    if app.config.get('RETENTION_INACTIVE_ITEM_DAYS'):
+        deleted += delete_inactive_items(app.config['RETENTION_INACTIVE_ITEM_DAYS'], chunk_size=chunk_size)
+
+    if app.config.get('RETENTION_KEEP_REVISIONS'):
+        deleted += delete_excess_revisions(app.config['RETENTION_KEEP_REVISIONS'], chunk_size=chunk_size)
+
+    if app.config.get('RETENTION_DAILY_AFTER_DAYS'):
+        deleted += thin_old_revisions(app.config['RETENTION_DAILY_AFTER_DAYS'], chunk_size=chunk_size)
+
+    return deleted
@@ -14,7 +14,8 @@ from security_monkey.reporter import Reporter
 from security_monkey import app, sentry
 from security_monkey.datastore import store_exception, Account
 from security_monkey.task_scheduler.util import CELERY, setup, get_celery_config_file, get_sm_celery_config_value
-from security_monkey.task_scheduler.tasks import task_account_tech, clear_expired_exceptions
+from security_monkey.retention import retention_policies_configured
+from security_monkey.task_scheduler.tasks import task_account_tech, clear_expired_exceptions, apply_retention
 
 
 def purge_it():
@@ -111,6 +112,11 @@ def setup_the_tasks(sender, **kwargs):
         clear_expired_exceptions.apply_async()
         sender.add_periodic_task(86400, clear_expired_exceptions.s())
 
+        # Apply the retention policies every 24 hours (if there are any):
+        if retention_policies_configured():
+            app.logger.info("Scheduling task to apply the retention policies.")
+            sender.add_periodic_task(86400, apply_retention.s())
+
     except Exception as e:
         if sentry:
             sentry.captureException()
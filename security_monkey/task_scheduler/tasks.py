@@ -24,8 +24,10 @@ from security_monkey.alerter import Alerter
 from security_monkey.datastore import store_exception, clear_old_exceptions, Technology, Account, Item, ItemRevision
 from security_monkey.monitors import get_monitors, get_monitors_and_dependencies
 from security_monkey.reporter import Reporter
-from security_monkey.task_scheduler.util import CELERY, setup
+from security_monkey.retention import apply_retention_policies
+from security_monkey.task_scheduler.util import CELERY, setup, get_celery_config_file, get_sm_celery_config_value
 import boto3
+from celery import chord
 from sqlalchemy.exc import OperationalError, InvalidRequestError, StatementError
 
 
@@ -87,6 +89,76 @@ def task_audit(self, account_name, technology_name):
         self.retry(exc=e)
 
 
+@CELERY.task(bind=True, max_retries=3, ignore_result=False)
+def task_batch(self, account_name, technology_name, batch):
+    """
+    Watches, audits, and alerts on a single batch of a batched watcher. This is dispatched by `batch_logic` when
+    parallel batches are enabled.
+    :return: The ARNs of the items in the batch. These are used to find the deleted items once all batches complete.
+    """
+    setup()
+    app.logger.info("[ ] Executing Celery batch task for account: {}, technology: {}".format(account_name,
+                                                                                            technology_name))
+    try:
+        monitors = get_monitors(account_name, [technology_name])
+        if not monitors:
+            return []
+
+        monitor = monitors[0]
+        current_watcher = monitor.watcher
+        current_watcher.prep_for_batch_slurp()
+        current_watcher.load_batch(batch)
+
+        _run_batch(monitor, current_watcher, account_name, False)
+
+        Alerter([monitor], account=account_name).report()
+        db.session.close()
+
+        return [item["Arn"] for item in current_watcher.total_list if item.get("Arn")]
+
+    except Exception as e:
+        if sentry:
+            sentry.captureException()
+        app.logger.error("[X] Task Batch Exception ({}/{}): {}".format(account_name, technology_name, e))
+        app.logger.error(traceback.format_exc())
+        store_exception("scheduler-exception-on-batch", None, e)
+        raise self.retry(exc=e)
+
+
+@CELERY.task(bind=True, max_retries=3)
+def task_find_deleted_batch(self, batch_arns, account_name, technology_name):
+    """
+    Runs once all of the `task_batch` tasks for a watcher have completed to record the items that no longer exist.
+    :param batch_arns: List of the ARN lists returned by each batch task.
+    """
+    setup()
+    try:
+        monitors = get_monitors(account_name, [technology_name])
+        if not monitors:
+            return
+
+        monitor = monitors[0]
+        current_watcher = monitor.watcher
+        current_watcher.prep_for_batch_slurp()
+
+        app.logger.debug("[-->] Deleting all items for {technology}/{account} that no longer exist.".format(
+            technology=current_watcher.i_am_plural, account=account_name
+        ))
+        existing_arns = [arn for arns in batch_arns for arn in arns]
+        current_watcher.find_deleted_batch({}, existing_arns=existing_arns)
+
+        Alerter([monitor], account=account_name).report()
+        db.session.close()
+
+    except Exception as e:
+        if sentry:
+            sentry.captureException()
+        app.logger.error("[X] Task Find Deleted Batch Exception ({}/{}): {}".format(account_name, technology_name, e))
+        app.logger.error(traceback.format_exc())
+        store_exception("scheduler-exception-on-batch", None, e)
+        raise self.retry(exc=e)
+
+
 @CELERY.task()
 def clear_expired_exceptions():
     app.logger.info("[ ] Clearing out exceptions that have an expired TTL...")
@@ -94,6 +166,13 @@ def clear_expired_exceptions():
     app.logger.info("[-] Completed clearing out exceptions that have an expired TTL.")
 
 
+@CELERY.task()
+def apply_retention():
+    app.logger.info("[ ] Applying the item revision retention policies...")
+    deleted = apply_retention_policies()
+    app.logger.info("[-] Completed applying the retention policies. Deleted {} rows.".format(deleted))
+
+
 def fix_orphaned_deletions(account_name, technology_name):
     """
     Possible issue with orphaned items. This will check if there are any, and will assume that the item
@@ -132,7 +211,7 @@ def fix_orphaned_deletions(account_name, technology_name):
 
         # Update the latest revision id:
         db.session.refresh(revision)
-        oi.latest_revision_id = revision.id
+        oi.set_latest_revision(revision, repair=True)
         db.session.add(oi)
 
         db.session.commit()
@@ -277,7 +356,8 @@ def batch_logic(monitor, current_watcher, account_name, debug):
     """
     Performs the batch watcher finding and auditing.
 
-    TODO: Investigate how this could, in the future, be set to parallelize the batches.
+    If `security_monkey_parallel_batches` is enabled in the Celery configuration, each batch is dispatched as its own
+    Celery task, and the deleted items are found once all of the batches have completed.
     :param monitor:
     :param current_watcher:
     :param account_name:
@@ -305,28 +385,20 @@ def batch_logic(monitor, current_watcher, account_name, debug):
                                                                    e=",".join(exc_strings)))
         return
 
-    while not current_watcher.done_slurping:
-        app.logger.debug("[-->] Fetching a batch of {batch} items for {technology}/{account}.".format(
-            batch=current_watcher.batched_size, technology=current_watcher.i_am_plural, account=account_name
+    parallel = get_sm_celery_config_value(get_celery_config_file(), "security_monkey_parallel_batches", bool)
+    batches = current_watcher.get_batches() if parallel else []
+    if batches:
+        app.logger.debug("[-->] Dispatching {count} batches of {batch} items for {technology}/{account}.".format(
+            count=len(batches), batch=current_watcher.batched_size, technology=current_watcher.i_am_plural,
+            account=account_name
         ))
-        (items, exception_map) = current_watcher.slurp()
-
-        _post_metric(
-            'queue_items_added',
-            len(items),
-            account_name=account_name,
-            tech=current_watcher.i_am_singular
-        )
-
-        audit_items = current_watcher.find_changes(current=items, exception_map=exception_map)
-        _audit_specific_changes(monitor, audit_items, False, debug)
+        chord(
+            task_batch.s(account_name, current_watcher.index, batch) for batch in batches
+        )(task_find_deleted_batch.s(account_name, current_watcher.index))
+        return
 
-        _post_metric(
-            'queue_items_completed',
-            len(items),
-            account_name=account_name,
-            tech=current_watcher.i_am_singular
-        )
+    while not current_watcher.done_slurping:
+        _run_batch(monitor, current_watcher, account_name, debug)
 
     # Delete the items that no longer exist:
     app.logger.debug("[-->] Deleting all items for {technology}/{account} that no longer exist.".format(
@@ -335,6 +407,38 @@ def batch_logic(monitor, current_watcher, account_name, debug):
     current_watcher.find_deleted_batch(account_name)
 
 
+def _run_batch(monitor, current_watcher, account_name, debug):
+    """
+    Slurps, finds the changes, and audits the next batch of items of a batched watcher.
+    :param monitor:
+    :param current_watcher:
+    :param account_name:
+    :param debug:
+    :return:
+    """
+    app.logger.debug("[-->] Fetching a batch of {batch} items for {technology}/{account}.".format(
+        batch=current_watcher.batched_size, technology=current_watcher.i_am_plural, account=account_name
+    ))
+    (items, exception_map) = current_watcher.slurp()
+
+    _post_metric(
+        'queue_items_added',
+        len(items),
+        account_name=account_name,
+        tech=current_watcher.i_am_singular
+    )
+
+    audit_items = current_watcher.find_changes(current=items, exception_map=exception_map)
+    _audit_specific_changes(monitor, audit_items, False, debug)
+
+    _post_metric(
+        'queue_items_completed',
+        len(items),
+        account_name=account_name,
+        tech=current_watcher.i_am_singular
+    )
+
+
 def _audit_changes(account, auditors, send_report, debug=True):
     """ Runs auditors on all items """
     try:
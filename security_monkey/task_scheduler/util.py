@@ -11,6 +11,7 @@
 from celery import Celery
 from security_monkey import app
 from security_monkey.common.utils import find_modules, load_plugins
+from security_monkey.datastore import exception_buffer
 
 import os
 import importlib
@@ -45,7 +46,8 @@ def make_celery(app):
         abstract = True
 
         def __call__(self, *args, **kwargs):
-            with app.app_context():
+            # The exceptions stored during the task are written in bulk:
+            with app.app_context(), exception_buffer.buffering():
                 return TaskBase.__call__(self, *args, **kwargs)
 
     celery.Task = ContextTask
@@ -22,6 +22,7 @@
 
 import unittest
 from security_monkey import app, db
+from security_monkey.common import ec2_describe_cache, rate_limiter, regions, sts_connect
 
 
 class SecurityMonkeyTestCase(unittest.TestCase):
@@ -30,6 +31,11 @@ class SecurityMonkeyTestCase(unittest.TestCase):
         self.test_app = self.app.test_client()
         db.drop_all()
         db.create_all()
+        # The process-wide caches must not leak between tests:
+        sts_connect.clear_cache()
+        regions.clear_cache()
+        rate_limiter.reset()
+        ec2_describe_cache.reset()
         self.pre_test_setup()
 
     def pre_test_setup(self):
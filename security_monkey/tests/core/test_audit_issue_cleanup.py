@@ -23,7 +23,7 @@
 from security_monkey.tests import SecurityMonkeyTestCase
 from security_monkey.auditor import Auditor
 from security_monkey.datastore import Account, AccountType, Technology
-from security_monkey.datastore import Item, ItemAudit, AuditorSettings
+from security_monkey.datastore import Item, ItemAudit, AuditorSettings, update_item_scores
 from security_monkey.auditor import auditor_registry
 from security_monkey import db, app, ARN_PREFIX
 
@@ -151,3 +151,35 @@ class AuditIssueCleanupTestCase(SecurityMonkeyTestCase):
         item = items[0]
         assert len(item.issues) == 1
         assert item.issues[0].issue == 'Test Issue 1'
+
+    @patch.dict(auditor_registry, test_auditor_registry, clear=True)
+    def test_clean_issues_updates_item_scores(self):
+        from security_monkey.common.audit_issue_cleanup import clean_account_issues, clean_stale_issues
+
+        item = Item.query.one()
+        for issue, auditor_class in [('Test Issue', 'MockAuditor1'), ('Not applicable', 'MockAuditor2'),
+                                     ('Issue with missing auditor', 'MissingAuditor')]:
+            item.issues.append(ItemAudit(score=2, issue=issue, item_id=item.id,
+                                         auditor_setting=AuditorSettings(disabled=False,
+                                                                         technology=self.technology,
+                                                                         account=self.account,
+                                                                         auditor_class=auditor_class)))
+        db.session.commit()
+        update_item_scores([item.id])
+        db.session.commit()
+
+        item = Item.query.one()
+        assert item.score == 6
+        assert item.issue_count == 3
+
+        clean_stale_issues()
+        item = Item.query.one()
+        assert item.score == 4
+        assert item.unjustified_score == 4
+        assert item.issue_count == 2
+
+        clean_account_issues(self.account)
+        item = Item.query.one()
+        assert item.score == 2
+        assert item.unjustified_score == 2
+        assert item.issue_count == 1
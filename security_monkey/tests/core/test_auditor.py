@@ -41,6 +41,21 @@ class AuditorTestObj(Auditor):
         self.add_issue(score=10, issue="Test issue", item=item)
 
 
+class PolicyAuditorTestObj(Auditor):
+    index = 'test_policy_index'
+    i_am_singular = "test policy auditor"
+
+    def __init__(self, accounts=None, debug=False):
+        super(PolicyAuditorTestObj, self).__init__(accounts=accounts, debug=debug)
+        self.loaded = []
+
+    def check_first(self, item):
+        self.loaded.append(self.load_policies(item, ['Policy']))
+
+    def check_second(self, item):
+        self.loaded.append(self.load_policies(item, ['Policy']))
+
+
 class AuditorTestCase(SecurityMonkeyTestCase):
     def pre_test_setup(self):
         self.account_type = AccountType.query.filter(AccountType.name == 'AWS').first()
@@ -80,6 +95,34 @@ class AuditorTestCase(SecurityMonkeyTestCase):
         except AttributeError as e:
             self.fail("Auditor.save_issues() raised AttributeError unexpectedly: {}".format(e.message))
 
+    def test_load_object_store(self):
+        from security_monkey.datastore import Datastore
+
+        self.test_account.third_party = False
+        db.session.commit()
+
+        datastore = Datastore()
+        configs = [
+            ("vpc", "vpc-1", {"id": "vpc-1", "cidr_block": "10.0.0.0/16", "tags": {"vpcnat": "54.0.0.1, 54.0.0.2"}}),
+            ("natgateway", "nat-1", {"nat_gateway_addresses": [{"public_ip": "54.0.1.1", "private_ip": "10.0.1.1"}]}),
+            ("iamrole", "SomeRole", {"RoleId": "AROASOMEROLE"}),
+            ("s3", "some-bucket", {"Name": "some-bucket"}),
+        ]
+        for technology, name, config in configs:
+            datastore.store(technology, "us-west-2", self.test_account.name, name, True, config)
+
+        Auditor.OBJECT_STORE.clear()
+        try:
+            Auditor._load_object_store()
+            assert Auditor.OBJECT_STORE['vpc'] == {"vpc-1": {"012345678910"}}
+            assert Auditor.OBJECT_STORE['userid'] == {"AROASOMEROLE": {"012345678910"}}
+            assert Auditor.OBJECT_STORE['s3'] == {"some-bucket": {"012345678910"}}
+            assert set(Auditor.OBJECT_STORE['cidr']) == {"10.0.0.0/16", "54.0.0.1/32", "54.0.0.2/32", "54.0.1.1/32",
+                                                         "10.0.1.1/32"}
+            assert Auditor.OBJECT_STORE['ACCOUNTS']['FRIENDLY'] == {"012345678910"}
+        finally:
+            Auditor.OBJECT_STORE.clear()
+
     def test_link_to_support_item_issue(self):
         sub_item_id = 2
         issue_text = 'This is a test issue'
@@ -238,3 +281,21 @@ class AuditorTestCase(SecurityMonkeyTestCase):
         auditor.save_issues()
         self.assertEqual(issue.fixed, False)
         self.assertEqual(issue.justified, True)
+
+    def test_policies_are_parsed_once_per_config(self):
+        policy = {"Statement": [{"Effect": "Allow", "Principal": "*", "Action": "s3:GetObject", "Resource": "*"}]}
+        auditor = PolicyAuditorTestObj(accounts=[self.test_account.name])
+        auditor.items = [ChangeItem(index=auditor.index, region="us-west-2", account=self.test_account.name,
+                                    name=name, new_config={"Name": "bucket", "Policy": policy})
+                         for name in ("first", "second")]
+        auditor.audit_objects()
+
+        # Both check methods, for both items (with the same config), got the same parsed policies:
+        assert len(auditor.loaded) == 4
+        assert all(policies is auditor.loaded[0] for policies in auditor.loaded)
+        statement = auditor.loaded[0][0].statements[0]
+        assert statement.whos_allowed() is statement.whos_allowed()
+        assert auditor.policy_cache is None
+
+        # Outside of an audit, they are parsed each time:
+        assert auditor.load_policies(auditor.items[0], ['Policy']) is not auditor.loaded[0]
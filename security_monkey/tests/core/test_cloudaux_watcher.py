@@ -0,0 +1,154 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.tests.core.test_cloudaux_watcher
+    :platform: Unix
+
+.. version:: $$VERSION$$
+
+"""
+from mock import patch
+
+from security_monkey import app, db, ARN_PREFIX
+from security_monkey.cloudaux_batched_watcher import CloudAuxBatchedWatcher
+from security_monkey.cloudaux_watcher import CloudAuxWatcher
+from security_monkey.datastore import Account, AccountType, Item, Technology
+from security_monkey.tests import SecurityMonkeyTestCase
+
+
+class FanOutTestWatcher(CloudAuxWatcher):
+    index = 'fanouttest'
+    i_am_singular = 'Fan Out Test'
+    i_am_plural = 'Fan Out Tests'
+    service_name = 'ec2'
+
+    def list_method(self, **kwargs):
+        return [{'Name': '{}-thing{}'.format(kwargs['region'], x)} for x in range(0, 10)]
+
+    def get_method(self, item, **kwargs):
+        if item['Name'] == 'us-west-2-thing3':
+            raise Exception('Boom')
+
+        return {
+            'Arn': ARN_PREFIX + ':ec2:{region}:012345678910:thing/{name}'.format(region=kwargs['region'],
+                                                                                 name=item['Name']),
+            'Name': item['Name']
+        }
+
+
+class FingerprintTestWatcher(FanOutTestWatcher):
+    list_fingerprint_fields = ['Name', 'Version']
+    fetched = []
+
+    def list_method(self, **kwargs):
+        return [{'Name': 'thing{}'.format(x), 'Version': 2 if x == 1 else 1} for x in range(0, 3)]
+
+    def get_method(self, item, **kwargs):
+        self.fetched.append(item['Name'])
+        return dict(item, Arn=ARN_PREFIX + ':ec2:{region}:012345678910:thing/{name}'.format(region=kwargs['region'],
+                                                                                          name=item['Name']))
+
+
+class BatchedTestWatcher(CloudAuxBatchedWatcher):
+    index = 'fanouttest'
+    i_am_singular = 'Fan Out Test'
+    i_am_plural = 'Fan Out Tests'
+    service_name = 'ec2'
+
+    def list_method(self, **kwargs):
+        return [{'Name': '{}-thing{}'.format(kwargs['region'], x), 'Region': kwargs['region']} for x in range(0, 3)]
+
+
+class CloudAuxWatcherTestCase(SecurityMonkeyTestCase):
+    def pre_test_setup(self):
+        account_type_result = AccountType(name='AWS')
+        db.session.add(account_type_result)
+        db.session.commit()
+
+        self.account = Account(identifier="012345678910", name="testing",
+                               active=True, third_party=False,
+                               account_type_id=account_type_result.id)
+        db.session.add(self.account)
+        db.session.add(Technology(name="fanouttest"))
+        db.session.commit()
+
+    def _slurp(self, concurrency, enabled_regions=None):
+        watcher = FanOutTestWatcher(accounts=["testing"])
+        with patch.dict(app.config, {'SLURP_CONCURRENCY': {'fanouttest': concurrency}}):
+            with patch.object(FanOutTestWatcher, '_get_regions', return_value=['us-east-1', 'us-west-2']):
+                with patch('security_monkey.common.regions.get_enabled_regions', return_value=enabled_regions):
+                    return watcher.slurp()
+
+    def test_concurrent_slurp_matches_serial(self):
+        serial_items, serial_exceptions = self._slurp(1)
+        concurrent_items, concurrent_exceptions = self._slurp(8)
+
+        assert len(serial_items) == 19
+        assert [item.location() for item in serial_items] == [item.location() for item in concurrent_items]
+        assert [item.config for item in serial_items] == [item.config for item in concurrent_items]
+
+        assert list(serial_exceptions.keys()) == list(concurrent_exceptions.keys())
+        assert ('fanouttest', 'testing', 'us-west-2', 'us-west-2-thing3') in concurrent_exceptions
+
+    def test_disabled_regions_are_skipped(self):
+        items, exceptions = self._slurp(1, enabled_regions={'us-east-1'})
+
+        assert len(items) == 10
+        assert all(item.region == 'us-east-1' for item in items)
+        assert not exceptions
+
+    def test_unchanged_list_fingerprints_are_not_fetched(self):
+        def run():
+            watcher = FingerprintTestWatcher(accounts=["testing"])
+            with patch.object(FingerprintTestWatcher, '_get_regions', return_value=['us-west-2']):
+                with patch('security_monkey.common.regions.get_enabled_regions', return_value=None):
+                    items, exception_map = watcher.slurp()
+            watcher.find_changes(current=items, exception_map=exception_map)
+            watcher.save()
+            return watcher
+
+        FingerprintTestWatcher.fetched = []
+        run()
+        assert FingerprintTestWatcher.fetched == ['thing0', 'thing1', 'thing2']
+        assert Item.query.filter(Item.list_fingerprint != None).count() == 3  # noqa
+
+        # Nothing changed, so nothing is fetched -- and nothing is seen as deleted:
+        FingerprintTestWatcher.fetched = []
+        watcher = run()
+        assert FingerprintTestWatcher.fetched == []
+        assert not watcher.is_changed()
+
+        # Only the item whose fingerprint changed is fetched:
+        with patch.object(FingerprintTestWatcher, 'list_method',
+                          return_value=[{'Name': 'thing{}'.format(x), 'Version': 3 if x == 1 else 1}
+                                        for x in range(0, 3)]):
+            watcher = run()
+        assert FingerprintTestWatcher.fetched == ['thing1']
+        assert len(watcher.changed_items) == 1
+
+        # Disabling the fingerprints fetches everything:
+        FingerprintTestWatcher.fetched = []
+        with patch.dict(app.config, {'LIST_FINGERPRINT_MAX_AGE': 0}):
+            run()
+        assert FingerprintTestWatcher.fetched == ['thing0', 'thing1', 'thing2']
+
+    def test_batched_list_skips_disabled_regions(self):
+        watcher = BatchedTestWatcher(accounts=["testing"])
+        with patch.object(BatchedTestWatcher, '_get_regions', return_value=['us-east-1', 'us-west-2']):
+            with patch('security_monkey.common.regions.get_enabled_regions', return_value={'us-east-1'}):
+                items, exceptions = watcher.slurp_list()
+
+        assert [item['Name'] for item in items] == ['us-east-1-thing0', 'us-east-1-thing1', 'us-east-1-thing2']
+        assert watcher.total_list == items
+        assert not exceptions
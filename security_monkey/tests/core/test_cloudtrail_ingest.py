@@ -0,0 +1,136 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.tests.core.test_cloudtrail_ingest
+    :platform: Unix
+.. version:: $$VERSION$$
+"""
+import json
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from security_monkey import db, ARN_PREFIX
+from security_monkey.cloudaux_watcher import CloudAuxWatcher
+from security_monkey.cloudtrail_ingest import group_events, ingest_directory
+from security_monkey.datastore import Account, AccountType, CloudTrailEntry, Item, Technology
+from security_monkey.tests import SecurityMonkeyTestCase
+
+EXISTING_THINGS = {'thing1', 'thing2'}
+
+
+class CloudTrailTestWatcher(CloudAuxWatcher):
+    index = 'cloudtrailtest'
+    i_am_singular = 'CloudTrail Test'
+    i_am_plural = 'CloudTrail Tests'
+    service_name = 'ec2'
+    cloudtrail_event_sources = ['test.amazonaws.com']
+
+    def list_item_from_cloudtrail(self, event):
+        return {'Name': event['requestParameters']['thingName']}
+
+    def get_method(self, item, **kwargs):
+        if item['Name'] not in EXISTING_THINGS:
+            raise Exception('NoSuchThing')
+
+        return {
+            'Arn': ARN_PREFIX + ':ec2:{region}:012345678910:thing/{name}'.format(region=kwargs['region'],
+                                                                                 name=item['Name']),
+            'Name': item['Name']
+        }
+
+
+def make_event(event_id, event_name, thing_name, read_only=False):
+    return {
+        'eventID': event_id,
+        'eventSource': 'test.amazonaws.com',
+        'eventName': event_name,
+        'eventTime': '2020-01-01T00:00:00Z',
+        'awsRegion': 'us-west-2',
+        'recipientAccountId': '012345678910',
+        'readOnly': read_only,
+        'requestParameters': {'thingName': thing_name},
+        'userIdentity': {'arn': 'arn:aws:iam::012345678910:user/someone'}
+    }
+
+
+class CloudTrailIngestTestCase(SecurityMonkeyTestCase):
+    def pre_test_setup(self):
+        account_type_result = AccountType(name='AWS')
+        db.session.add(account_type_result)
+        db.session.commit()
+
+        self.account = Account(identifier="012345678910", name="testing",
+                               active=True, third_party=False,
+                               account_type_id=account_type_result.id)
+        db.session.add(self.account)
+        db.session.add(Technology(name="cloudtrailtest"))
+        db.session.commit()
+
+        self.directory = tempfile.mkdtemp()
+        registry = {CloudTrailTestWatcher.index: CloudTrailTestWatcher}
+        self.patches = [patch('security_monkey.cloudtrail_ingest.watcher_registry', registry),
+                        patch('security_monkey.monitors.watcher_registry', registry),
+                        patch('security_monkey.cloudtrail_ingest.Alerter')]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.directory)
+        super(CloudTrailIngestTestCase, self).tearDown()
+
+    def _ingest(self, events):
+        with open(os.path.join(self.directory, 'events.jsonl'), 'w') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+
+        return ingest_directory(self.directory)
+
+    def test_only_mutating_events_are_grouped(self):
+        groups = group_events([
+            make_event('1', 'UpdateThing', 'thing1'),
+            make_event('2', 'GetThing', 'thing1', read_only=True),
+            dict(make_event('3', 'UpdateThing', 'thing1'), errorCode='AccessDenied'),
+            dict(make_event('4', 'UpdateThing', 'thing1'), eventSource='other.amazonaws.com'),
+        ])
+
+        assert list(groups.keys()) == [(CloudTrailTestWatcher, '012345678910', 'us-west-2')]
+        assert [event['eventID'] for event in groups[(CloudTrailTestWatcher, '012345678910', 'us-west-2')]] == ['1']
+
+    def test_changed_items_are_persisted_and_correlated(self):
+        assert self._ingest([make_event('1', 'CreateThing', 'thing1'), make_event('2', 'TagThing', 'thing1'),
+                             make_event('3', 'CreateThing', 'thing2')]) == 1
+        assert os.path.exists(os.path.join(self.directory, 'processed', 'events.jsonl'))
+
+        items = Item.query.order_by(Item.name).all()
+        assert [item.name for item in items] == ['thing1', 'thing2']
+        assert [entry.event_id for entry in items[0].cloudtrail_entries] == ['1', '2']
+        assert items[0].cloudtrail_entries[0].revision_id == items[0].latest_revision_id
+        assert items[0].cloudtrail_entries[0].user_identity_arn == 'arn:aws:iam::012345678910:user/someone'
+
+        # Deleting the item records an inactive revision:
+        EXISTING_THINGS.discard('thing2')
+        try:
+            assert self._ingest([make_event('4', 'DeleteThing', 'thing2')]) == 1
+        finally:
+            EXISTING_THINGS.add('thing2')
+
+        thing2 = Item.query.filter(Item.name == 'thing2').one()
+        assert not thing2.revisions.first().active
+        assert CloudTrailEntry.query.filter(CloudTrailEntry.event_id == '4').one().revision_id == \
+            thing2.latest_revision_id
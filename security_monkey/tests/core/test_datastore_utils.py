@@ -246,6 +246,35 @@ class DatabaseUtilsTestCase(SecurityMonkeyTestCase):
         assert (True, 'ephemeral', item, None) == detect_change(sti, self.account, self.technology, complete_hash,
                                                           durable_hash)
 
+    def test_prefetch_items(self):
+        from security_monkey.datastore_utils import detect_change, hash_item, load_previous_state, persist_item, \
+            prefetch_items
+
+        self.setup_db()
+
+        sti = SomeTestItem().from_slurp(ACTIVE_CONF, account_name=self.account.name)
+        complete_hash, durable_hash = hash_item(sti.config, [])
+        assert prefetch_items([sti], self.account, self.technology) == {}
+
+        persist_item(sti, None, self.technology, self.account, complete_hash, durable_hash, True)
+
+        mod_conf = dict(ACTIVE_CONF)
+        mod_conf["name"] = "SomeOtherRole"
+        other_sti = SomeTestItem().from_slurp(mod_conf, account_name=self.account.name)
+
+        db_items = prefetch_items([sti, other_sti], self.account, self.technology)
+        assert list(db_items.keys()) == [("SomeRole", "universal")]
+
+        db_item = db_items[("SomeRole", "universal")]
+        assert (False, None, db_item, None) == detect_change(sti, self.account, self.technology, complete_hash,
+                                                             durable_hash, db_items=db_items)
+        assert (True, 'durable', None, 'created') == detect_change(other_sti, self.account, self.technology,
+                                                                   complete_hash, durable_hash, db_items=db_items)
+
+        load_previous_state([db_item])
+        assert db_item.config == ACTIVE_CONF
+        assert db_item.audit_issues == []
+
     def test_persist_item(self):
         from security_monkey.datastore_utils import persist_item, hash_item, result_from_item
 
@@ -264,6 +293,8 @@ class DatabaseUtilsTestCase(SecurityMonkeyTestCase):
         assert db_item.revisions.count() == 1
         assert db_item.latest_revision_durable_hash == durable_hash == complete_hash
         assert db_item.latest_revision_complete_hash == complete_hash == durable_hash
+        assert db_item.first_seen == db_item.last_seen == db_item.revisions.first().date_created
+        assert db_item.latest_active
 
         # No changes:
         persist_item(sti, db_item, self.technology, self.account, complete_hash, durable_hash, True)
@@ -286,6 +317,91 @@ class DatabaseUtilsTestCase(SecurityMonkeyTestCase):
         assert db_item.latest_revision_durable_hash == new_durable_hash == durable_hash
         assert db_item.latest_revision_complete_hash == new_complete_hash != complete_hash
 
+    def test_upgrade_legacy_hashes(self):
+        from security_monkey.datastore_utils import detect_change, hash_item, persist_item, result_from_item, \
+            upgrade_legacy_hashes
+        from security_monkey.common.hashing import HASH_VERSION, LEGACY_HASH_VERSION
+
+        self.setup_db()
+
+        sti = SomeTestItem().from_slurp(ACTIVE_CONF, account_name=self.account.name)
+        complete_hash, durable_hash = hash_item(sti.config, [])
+
+        # Store the item as it would have been with the legacy hashes:
+        persist_item(sti, None, self.technology, self.account, complete_hash, durable_hash, True)
+        db_item = result_from_item(sti, self.account, self.technology)
+        db_item.latest_revision_complete_hash, db_item.latest_revision_durable_hash = \
+            hash_item(sti.config, [], hash_version=LEGACY_HASH_VERSION)
+        db_item.hash_version = None
+        db.session.add(db_item)
+        db.session.commit()
+
+        # Not a change:
+        upgrade_legacy_hashes(sti, db_item, [], complete_hash, durable_hash)
+        assert db_item.hash_version == HASH_VERSION
+        assert (False, None, db_item, None) == detect_change(sti, self.account, self.technology, complete_hash,
+                                                             durable_hash)
+
+        # A real change is still seen:
+        db_item.latest_revision_complete_hash, db_item.latest_revision_durable_hash = \
+            hash_item(sti.config, [], hash_version=LEGACY_HASH_VERSION)
+        db_item.hash_version = None
+        mod_conf = dict(ACTIVE_CONF, policy={})
+        mod_sti = SomeTestItem().from_slurp(mod_conf, account_name=self.account.name)
+        mod_complete_hash, mod_durable_hash = hash_item(mod_sti.config, [])
+
+        upgrade_legacy_hashes(mod_sti, db_item, [], mod_complete_hash, mod_durable_hash)
+        assert detect_change(mod_sti, self.account, self.technology, mod_complete_hash, mod_durable_hash)[0]
+
+    def test_persist_items(self):
+        from security_monkey.datastore_utils import persist_items, hash_item, result_from_item
+
+        self.setup_db()
+
+        changes = []
+        for x in range(0, 3):
+            mod_conf = dict(ACTIVE_CONF)
+            mod_conf["name"] = "SomeRole{}".format(x)
+            mod_conf["Arn"] = ARN_PREFIX + ":iam::012345678910:role/SomeRole{}".format(x)
+            sti = SomeTestItem().from_slurp(mod_conf, account_name=self.account.name)
+            complete_hash, durable_hash = hash_item(sti.config, [])
+            changes.append((sti, None, complete_hash, durable_hash, True))
+
+        persist_items(changes, self.technology, self.account)
+
+        for sti, _, complete_hash, _, _ in changes:
+            db_item = result_from_item(sti, self.account, self.technology)
+            assert db_item.revisions.count() == 1
+            assert db_item.latest_revision_id == db_item.revisions.first().id
+            assert db_item.latest_revision_complete_hash == complete_hash
+            assert db_item.revisions.first().config == sti.config
+
+    def test_persist_items_with_duplicates(self):
+        from security_monkey.datastore_utils import persist_item, persist_items, hash_item, result_from_item
+
+        self.setup_db()
+
+        sti = SomeTestItem().from_slurp(ACTIVE_CONF, account_name=self.account.name)
+        complete_hash, durable_hash = hash_item(sti.config, [])
+        persist_item(sti, None, self.technology, self.account, complete_hash, durable_hash, True)
+        db_item = result_from_item(sti, self.account, self.technology)
+
+        # The same item twice in a batch only gets the last change:
+        changes = []
+        for x in range(0, 2):
+            mod_sti = SomeTestItem().from_slurp(dict(ACTIVE_CONF, policy={"Version": x}),
+                                                account_name=self.account.name)
+            mod_complete_hash, mod_durable_hash = hash_item(mod_sti.config, [])
+            changes.append((mod_sti, db_item, mod_complete_hash, mod_durable_hash, True))
+
+        persist_items(changes, self.technology, self.account)
+
+        db_item = result_from_item(sti, self.account, self.technology)
+        assert db_item.revisions.count() == 2
+        assert db_item.latest_revision_id == db_item.revisions.first().id
+        assert db_item.revisions.first().config == changes[-1][0].config
+        assert db_item.latest_revision_complete_hash == changes[-1][2]
+
     def test_inactivate_old_revisions(self):
         from security_monkey.datastore_utils import inactivate_old_revisions, hash_item, persist_item, result_from_item
         from security_monkey.datastore import ItemRevision, Item
@@ -332,6 +448,8 @@ class DatabaseUtilsTestCase(SecurityMonkeyTestCase):
             ).one()
 
             assert not item_revision.active
+            assert Item.query.get(item_revision.item_id).last_seen == item_revision.date_created
+            assert Item.query.get(item_revision.item_id).latest_active is False
 
         # Check that the SomeRole0 is still OK:
         item_revision = ItemRevision.query.join((Item, ItemRevision.id == Item.latest_revision_id)).filter(
@@ -341,6 +459,164 @@ class DatabaseUtilsTestCase(SecurityMonkeyTestCase):
 
         assert item_revision.active
 
+    def test_iter_latest_revisions(self):
+        from security_monkey.datastore_utils import hash_item, inactivate_item, persist_item, result_from_item
+
+        self.setup_db()
+
+        for x in range(0, 2):
+            mod_conf = dict(ACTIVE_CONF)
+            mod_conf["name"] = "SomeRole{}".format(x)
+            mod_conf["Arn"] = ARN_PREFIX + ":iam::012345678910:role/SomeRole{}".format(x)
+            sti = SomeTestItem().from_slurp(mod_conf, account_name=self.account.name)
+            complete_hash, durable_hash = hash_item(sti.config, [])
+            persist_item(sti, None, self.technology, self.account, complete_hash, durable_hash, True)
+
+        inactivate_item(SomeWatcher(), result_from_item(sti, self.account, self.technology), self.account,
+                        self.technology)
+
+        datastore = Datastore()
+        results = list(datastore.iter_latest_revisions(tech="iamrole", accounts=["testing"], yield_per=1))
+        assert [(item.name, config["name"], account) for item, config, account in results] == \
+            [("SomeRole0", "SomeRole0", "testing")]
+
+        results = datastore.iter_latest_revisions(tech="iamrole", accounts=["testing"], include_inactive=True,
+                                                  include_config=False)
+        assert sorted((item.name, config) for item, config, _ in results) == [("SomeRole0", None), ("SomeRole1", None)]
+
+        assert not list(datastore.iter_latest_revisions(tech="iamrole", accounts=[]))
+        prev = datastore.get_all_ctype_filtered(tech="iamrole", account="testing")
+        assert [(item.name, revision.config["name"]) for item, revision in prev.items()] == \
+            [("SomeRole0", "SomeRole0")]
+
+    def test_store_many(self):
+        self.setup_db()
+        datastore = Datastore()
+
+        first = SomeTestItem.from_slurp(ACTIVE_CONF, account_name=self.account.name)
+        first.audit_issues = [ItemAudit(score=1, issue="Old Issue", notes="gone")]
+        first.save(datastore)
+        db_item = Item.query.filter(Item.name == "SomeRole").one()
+        first_revision_id = db_item.latest_revision_id
+
+        changed_conf = dict(ACTIVE_CONF, policy={})
+        changed = SomeTestItem.from_slurp(changed_conf, account_name=self.account.name)
+        changed.audit_issues = [ItemAudit(score=1, issue="New Issue", notes="here"),
+                                ItemAudit(score=1, issue="New Issue", notes="here")]
+
+        # A new item that takes the ARN:
+        new_conf = dict(ACTIVE_CONF, name="OtherRole")
+        created = SomeTestItem.from_slurp(new_conf, account_name=self.account.name)
+
+        db_items = datastore.store_many([(changed, False), (created, False)])
+        assert [item.name for item in db_items] == ["SomeRole", "OtherRole"]
+
+        db_item = Item.query.filter(Item.name == "SomeRole").one()
+        assert db_item.latest_revision_id != first_revision_id
+        assert db_item.revisions.count() == 2
+        assert db_item.arn is None
+        assert [(issue.issue, issue.notes) for issue in db_item.issues] == [("New Issue", "here")]
+
+        other = Item.query.filter(Item.name == "OtherRole").one()
+        assert other.arn == ACTIVE_CONF["Arn"]
+        assert other.latest_revision_id == other.revisions.first().id
+
+        # Ephemeral changes update the latest revision:
+        ephemeral = SomeTestItem.from_slurp(dict(new_conf, policy={}), account_name=self.account.name)
+        datastore.store_many([(ephemeral, True)])
+        other = Item.query.filter(Item.name == "OtherRole").one()
+        assert other.revisions.count() == 1
+        assert other.revisions.first().config["policy"] == {}
+        assert other.revisions.first().date_last_ephemeral_change
+
+        # Nothing is stored if the account doesn't exist:
+        missing = SomeTestItem.from_slurp(dict(new_conf, name="MissingRole"), account_name="missing")
+        with self.assertRaises(Exception):
+            datastore.store_many([(SomeTestItem.from_slurp(new_conf, account_name=self.account.name), False),
+                                  (missing, False)])
+        assert Item.query.filter(Item.name == "OtherRole").one().revisions.count() == 1
+
+    def test_store_many_shared_arn(self):
+        self.setup_db()
+        datastore = Datastore()
+
+        # Only the last of the items that share an ARN gets it:
+        changes = [(SomeTestItem.from_slurp(dict(ACTIVE_CONF, name=name), account_name=self.account.name), False)
+                   for name in ["FirstRole", "SecondRole", "ThirdRole"]]
+        datastore.store_many(changes)
+
+        arns = dict((item.name, item.arn) for item in Item.query.all())
+        assert arns == {"FirstRole": None, "SecondRole": None, "ThirdRole": ACTIVE_CONF["Arn"]}
+
+    def test_compact_revision_configs(self):
+        from security_monkey.datastore import ItemRevision, ItemRevisionConfig, compact_revision_configs
+
+        self.setup_db()
+        datastore = Datastore()
+
+        configs = []
+        for x in range(0, 5):
+            config = dict(ACTIVE_CONF, Version=x)
+            configs.append(config)
+            datastore.store("iamrole", "universal", "testing", "SomeRole", True, config)
+
+        # An identical item shares the deduplicated config:
+        datastore.store("iamrole", "universal", "testing", "OtherRole", True, configs[-1])
+
+        assert compact_revision_configs(batch_size=1, keyframe_interval=2) == 6
+        assert not compact_revision_configs(batch_size=1, keyframe_interval=2)
+
+        item = Item.query.filter(Item.name == "SomeRole").one()
+        revisions = item.revisions.order_by(ItemRevision.id).all()
+        assert [revision.delta_depth for revision in revisions] == [0, 1, 0, 1, None]
+        assert [revision.config_delta is not None for revision in revisions] == [False, True, False, True, False]
+        assert all(revision._config is None for revision in revisions)
+
+        db.session.expire_all()
+        assert [revision.config for revision in item.revisions.order_by(ItemRevision.id)] == configs
+        assert ItemRevisionConfig.query.count() == 3
+
+        # The configs of the latest revisions are still loaded in SQL:
+        results = datastore.iter_latest_revisions(tech="iamrole")
+        assert sorted((item.name, config["Version"]) for item, config, _ in results) == \
+            [("OtherRole", 4), ("SomeRole", 4)]
+
+        # New revisions reference the deduplicated configs:
+        self.app.config["REVISION_CONFIG_STORAGE"] = "deduplicated"
+        try:
+            datastore.store("iamrole", "universal", "testing", "SomeRole", True, configs[0])
+        finally:
+            self.app.config.pop("REVISION_CONFIG_STORAGE")
+
+        item = Item.query.filter(Item.name == "SomeRole").one()
+        revision = ItemRevision.query.get(item.latest_revision_id)
+        assert revision._config is None
+        assert revision.config_id == revisions[0].config_id
+        assert item.latest_config == configs[0]
+
+    def test_search_revision_configs(self):
+        from security_monkey.datastore import ItemRevision, compact_revision_configs, delta_revisions_exist, \
+            filter_revision_configs
+
+        self.setup_db()
+        datastore = Datastore()
+        for x in range(0, 3):
+            datastore.store("iamrole", "universal", "testing", "SomeRole", True,
+                            dict(ACTIVE_CONF, Tag="release-{}".format(x)))
+
+        def search(text):
+            query = filter_revision_configs(ItemRevision.query, text)
+            return sorted(revision.config["Tag"] for revision in query)
+
+        assert not delta_revisions_exist()
+        assert search("RELEASE-") == ["release-0", "release-1", "release-2"]
+
+        # The keyframe and the latest revision are still found, but not the delta:
+        compact_revision_configs(keyframe_interval=2)
+        db.session.expire_all()
+        assert delta_revisions_exist()
+        assert search("release-") == ["release-0", "release-2"]
+
     def test_delete_duplicate_item(self):
         self.setup_db()
         datastore = Datastore()
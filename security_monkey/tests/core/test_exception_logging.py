@@ -3,7 +3,7 @@ from collections import defaultdict
 from six import text_type
 
 from security_monkey.datastore import Account, Technology, Item
-from security_monkey.datastore import store_exception, ExceptionLogs
+from security_monkey.datastore import store_exception, ExceptionLogs, exception_buffer
 from security_monkey.datastore import clear_old_exceptions, AccountType
 from security_monkey import db, ARN_PREFIX
 from security_monkey.tests import SecurityMonkeyTestCase
@@ -181,6 +181,29 @@ class ExceptionLoggingTestCase(SecurityMonkeyTestCase):
         assert len(exc_log.message) == 512
         assert exc_log.message[:512] == some_string[:512]
 
+    def test_buffered_exceptions_are_coalesced(self):
+        location = ("iamrole", "testing", "us-west-2", "testrole")
+
+        error = ValueError("Region is down")
+
+        with exception_buffer.buffering():
+            for i in range(0, 5):
+                store_exception("tests", location, error)
+
+            store_exception("tests", location[:2], error)
+
+            # Nothing is written until the buffer is flushed:
+            assert not ExceptionLogs.query.count()
+
+        exc_logs = ExceptionLogs.query.order_by(ExceptionLogs.id).all()
+        assert [(exc_log.item_id, exc_log.occurrences) for exc_log in exc_logs] == [(self.item.id, 5), (None, 1)]
+        assert exc_logs[0].last_seen >= exc_logs[0].occurred
+
+        # Later occurrences are added to the same row:
+        store_exception("tests", location, error)
+        exc_log = ExceptionLogs.query.filter(ExceptionLogs.item_id == self.item.id).one()
+        assert exc_log.occurrences == 6
+
     def test_exception_clearing(self):
         location = ("iamrole", "testing", "us-west-2", "testrole")
 
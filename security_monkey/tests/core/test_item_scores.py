@@ -0,0 +1,97 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.tests.core.test_item_scores
+    :platform: Unix
+.. version:: $$VERSION$$
+"""
+from security_monkey import db
+from security_monkey.datastore import Account, AccountType, AuditorSettings, Datastore, Item, ItemAudit, Technology, \
+    rebuild_item_scores, update_item_scores
+from security_monkey.tests import SecurityMonkeyTestCase
+
+
+class ItemScoresTestCase(SecurityMonkeyTestCase):
+    def pre_test_setup(self):
+        account_type_result = AccountType(name='AWS')
+        db.session.add(account_type_result)
+        db.session.commit()
+
+        self.account = Account(identifier="012345678910", name="testing", account_type_id=account_type_result.id)
+        self.technology = Technology(name="iamrole")
+        db.session.add(self.account)
+        db.session.add(self.technology)
+        db.session.commit()
+
+        datastore = Datastore()
+        self.item = datastore.store("iamrole", "universal", "testing", "SomeRole", True, {"Name": "SomeRole"})
+        self.other_item = datastore.store("iamrole", "universal", "testing", "OtherRole", True, {"Name": "OtherRole"})
+
+        self.setting = AuditorSettings(tech_id=self.technology.id, account_id=self.account.id, disabled=False,
+                                       issue_text="Some Issue", auditor_class="IAMRoleAuditor")
+        db.session.add(self.setting)
+        db.session.commit()
+
+        self.issues = [
+            ItemAudit(score=10, issue="Some Issue", item_id=self.item.id, justified=False,
+                      auditor_setting_id=self.setting.id),
+            ItemAudit(score=5, issue="Some Issue", notes="2", item_id=self.item.id, justified=False,
+                      auditor_setting_id=self.setting.id),
+            ItemAudit(score=3, issue="Some Issue", notes="3", item_id=self.item.id, justified=False, fixed=True,
+                      auditor_setting_id=self.setting.id),
+            # Issues without auditor settings don't count:
+            ItemAudit(score=7, issue="Other Issue", item_id=self.item.id, justified=False),
+        ]
+        for issue in self.issues:
+            db.session.add(issue)
+        db.session.commit()
+
+    def _scores(self, item_id):
+        item = Item.query.get(item_id)
+        return item.score, item.unjustified_score, item.issue_count
+
+    def test_update_item_scores(self):
+        assert self._scores(self.item.id) == (0, 0, 0)
+
+        assert update_item_scores([self.item.id, self.other_item.id]) == 1
+        db.session.commit()
+        assert self._scores(self.item.id) == (15, 15, 2)
+        assert self._scores(self.other_item.id) == (0, 0, 0)
+
+        # Nothing changed:
+        assert not update_item_scores([self.item.id])
+
+        self.issues[0].justified = True
+        db.session.commit()
+        update_item_scores([self.item.id])
+        db.session.commit()
+        assert self._scores(self.item.id) == (15, 5, 2)
+
+        self.setting.disabled = True
+        db.session.commit()
+        update_item_scores([self.item.id])
+        db.session.commit()
+        assert self._scores(self.item.id) == (0, 0, 0)
+
+        # The score filters are plain column comparisons:
+        assert not Item.query.filter(Item.score >= 1).count()
+
+    def test_rebuild_item_scores(self):
+        Item.query.filter(Item.id == self.other_item.id).update({'score': 100, 'issue_count': 4})
+        db.session.commit()
+
+        assert rebuild_item_scores(batch_size=1) == 2
+        assert self._scores(self.item.id) == (15, 15, 2)
+        assert self._scores(self.other_item.id) == (0, 0, 0)
+        assert Item.query.filter(Item.score >= 10).one().id == self.item.id
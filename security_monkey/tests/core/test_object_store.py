@@ -0,0 +1,201 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.tests.core.test_object_store
+    :platform: Unix
+.. version:: $$VERSION$$
+"""
+from collections import defaultdict
+import os
+import shutil
+import stat
+import tempfile
+
+from mock import patch
+import redis
+
+from security_monkey import db, object_store
+from security_monkey.datastore import Account, AccountType, Datastore, NetworkWhitelistEntry, Technology
+from security_monkey.object_store import AccountDirectory, CIDRIndex, FileSnapshotStore, LocalSnapshotStore, \
+    SECTIONS, get_store, load_object_store, mark_stale
+from security_monkey.tests import SecurityMonkeyTestCase
+
+
+class UnreachableStore(LocalSnapshotStore):
+    """Stands in for the Redis store, which can be made unreachable."""
+
+    def __init__(self):
+        super(UnreachableStore, self).__init__()
+        self.down = False
+        self.marked = []
+
+    def _check(self):
+        if self.down:
+            raise redis.exceptions.ConnectionError("Redis is down")
+
+    def get_state(self):
+        self._check()
+        return super(UnreachableStore, self).get_state()
+
+    def mark_stale(self, names):
+        self._check()
+        self.marked.extend(names)
+        super(UnreachableStore, self).mark_stale(names)
+
+
+class ObjectStoreTestCase(SecurityMonkeyTestCase):
+    def pre_test_setup(self):
+        account_type_result = AccountType(name='AWS')
+        db.session.add(account_type_result)
+        db.session.commit()
+
+        db.session.add(Account(identifier="012345678910", name="testing", account_type_id=account_type_result.id,
+                               third_party=False))
+        db.session.add(Technology(name="s3"))
+        db.session.commit()
+
+        self.datastore = Datastore()
+        self.path = tempfile.mkdtemp()
+        self.app.config["OBJECT_STORE_SNAPSHOT"] = "file"
+        self.app.config["OBJECT_STORE_SNAPSHOT_PATH"] = self.path
+        self.app.config["OBJECT_STORE_REFRESH_INTERVAL"] = 0
+        object_store.reset()
+
+    def tearDown(self):
+        for option in ("OBJECT_STORE_SNAPSHOT", "OBJECT_STORE_SNAPSHOT_PATH", "OBJECT_STORE_REFRESH_INTERVAL"):
+            self.app.config.pop(option)
+        object_store.reset()
+        shutil.rmtree(self.path)
+        super(ObjectStoreTestCase, self).tearDown()
+
+    def test_snapshot_is_shared(self):
+        self.datastore.store("s3", "us-west-2", "testing", "some-bucket", True, {"Name": "some-bucket"})
+        db.session.add(NetworkWhitelistEntry(name="office", cidr="54.0.0.0/24"))
+        db.session.commit()
+
+        store = defaultdict(dict)
+        load_object_store(store)
+        assert store["s3"] == {"some-bucket": {"012345678910"}}
+        assert store["cidr"] == {"54.0.0.0/24": {"000000000000"}}
+        assert store["ACCOUNTS"]["FRIENDLY"] == {"012345678910"}
+        assert store["ACCOUNTS"]["DESCRIPTIONS"][0]["identifier"] == "012345678910"
+
+        generation, sections, stale = get_store().get_state()
+        assert generation == 1
+        assert set(sections) == set(SECTIONS)
+        assert not stale
+
+        # Another worker loads the same snapshot, without rebuilding it:
+        object_store.reset()
+        other = defaultdict(dict)
+        load_object_store(other)
+        assert other == store
+        assert get_store().get_state()[0] == 1
+
+    def test_stale_sections_are_rebuilt(self):
+        store = defaultdict(dict)
+        load_object_store(store)
+        assert not store["s3"]
+
+        # Changes aren't picked up until their section is marked as stale:
+        self.datastore.store("s3", "us-west-2", "testing", "some-bucket", True, {"Name": "some-bucket"})
+        load_object_store(store)
+        assert not store["s3"]
+
+        mark_stale("s3", "not-a-section")
+        load_object_store(store)
+        assert store["s3"] == {"some-bucket": {"012345678910"}}
+
+        # Only the stale section was rebuilt:
+        generation, sections, stale = get_store().get_state()
+        assert generation == 2
+        assert sections["s3"][0] == 2
+        assert sections["accounts"][0] == 1
+        assert not stale
+
+    def test_snapshot_path_must_be_private(self):
+        assert isinstance(get_store(), FileSnapshotStore)
+
+        # The directory is created, and only its owner can use it:
+        path = os.path.join(self.path, "snapshot")
+        self.app.config["OBJECT_STORE_SNAPSHOT_PATH"] = path
+        object_store.reset()
+        assert isinstance(get_store(), FileSnapshotStore)
+        assert stat.S_IMODE(os.stat(path).st_mode) & 0o077 == 0
+
+        # A directory that others can write to isn't trusted:
+        os.chmod(path, 0o777)
+        object_store.reset()
+        assert isinstance(get_store(), LocalSnapshotStore)
+
+        # Neither is a default one:
+        self.app.config["OBJECT_STORE_SNAPSHOT_PATH"] = None
+        object_store.reset()
+        assert isinstance(get_store(), LocalSnapshotStore)
+
+    def test_redis_outage_falls_back_until_retried(self):
+        shared = UnreachableStore()
+        with patch.object(object_store, "get_store", return_value=shared):
+            shared.down = True
+            store = defaultdict(dict)
+            load_object_store(store)
+            assert store["ACCOUNTS"]["FRIENDLY"] == {"012345678910"}
+
+            # The marks are kept while the per-process store is used, even once Redis is back:
+            mark_stale("networkwhitelist")
+            shared.down = False
+            mark_stale("accounts")
+            load_object_store(store)
+            assert not shared.marked
+            assert store["ACCOUNTS"]["FRIENDLY"] == {"012345678910"}
+
+            # Redis is tried again after the retry interval, and the marks are sent to it first:
+            object_store._fallback["retry_at"] = 0
+            load_object_store(store)
+            assert sorted(shared.marked) == ["accounts", "networkwhitelist"]
+            assert store["ACCOUNTS"]["FRIENDLY"] == {"012345678910"}
+
+            mark_stale("s3")
+            assert shared.marked[-1] == "s3"
+
+    def test_cidr_index(self):
+        index = CIDRIndex({
+            "10.0.0.0/8": {"111111111111"},
+            "10.1.0.0/16": {"222222222222"},
+            "10.1.2.3/32": {"333333333333"},
+            "0.0.0.0/0": {"000000000000"},
+            "2001:db8::/32": {"444444444444"},
+        })
+
+        assert index.lookup("10.1.2.3") == {"000000000000", "111111111111", "222222222222", "333333333333"}
+        assert index.lookup("10.1.2.0/24") == {"000000000000", "111111111111", "222222222222"}
+        assert index.lookup("10.2.0.0/16") == {"000000000000", "111111111111"}
+        assert index.lookup("0.0.0.0/0") == {"000000000000"}
+        assert index.lookup("2001:db8:1::/48") == {"444444444444"}
+        assert not index.lookup("2001:db9::/32")
+
+    def test_account_directory(self):
+        store = defaultdict(dict)
+        load_object_store(store)
+        directory = AccountDirectory(store["ACCOUNTS"])
+
+        assert directory.identifier("testing") == "012345678910"
+        assert directory.identifier("other") is None
+        assert directory.get("012345678910")["name"] == "testing"
+        assert directory.find("name", "TESTING")["identifier"] == "012345678910"
+        assert not directory.find("s3_name", "some-bucket")
+        assert [account["name"] for account in directory.labelled("friendly")] == ["testing"]
+        assert not directory.labelled("thirdparty")
+        assert directory.is_friendly("012345678910")
+        assert not directory.is_thirdparty("012345678910")
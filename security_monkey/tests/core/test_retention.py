@@ -0,0 +1,102 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.tests.core.test_retention
+    :platform: Unix
+.. version:: $$VERSION$$
+"""
+import datetime
+
+from security_monkey import db
+from security_monkey.datastore import Account, AccountType, Datastore, Item, ItemAudit, ItemRevision, Technology
+from security_monkey.retention import delete_excess_revisions, delete_inactive_items, delete_revisions_by_date, \
+    thin_old_revisions
+from security_monkey.tests import SecurityMonkeyTestCase
+
+
+class RetentionTestCase(SecurityMonkeyTestCase):
+    def pre_test_setup(self):
+        account_type_result = AccountType(name='AWS')
+        db.session.add(account_type_result)
+        db.session.commit()
+
+        db.session.add(Account(identifier="012345678910", name="testing", account_type_id=account_type_result.id))
+        db.session.add(Technology(name="iamrole"))
+        db.session.commit()
+
+        self.datastore = Datastore()
+
+    def _store(self, name, revisions, active=True, days_ago=None):
+        """Stores the revisions of an item, the first created `days_ago` days ago, and the others an hour apart."""
+        for x in range(0, revisions):
+            self.datastore.store("iamrole", "universal", "testing", name, active, {"Name": name, "Version": x})
+
+        item = Item.query.filter(Item.name == name).one()
+        if days_ago is not None:
+            created = datetime.datetime.utcnow() - datetime.timedelta(days=days_ago)
+            for x, revision in enumerate(item.revisions.order_by(ItemRevision.id)):
+                revision.date_created = created + datetime.timedelta(hours=x)
+            db.session.commit()
+
+        return item
+
+    def _versions(self, name):
+        item = Item.query.filter(Item.name == name).one()
+        return [revision.config["Version"] for revision in item.revisions.order_by(ItemRevision.id)]
+
+    def test_delete_excess_revisions(self):
+        self._store("SomeRole", 5)
+        self._store("OtherRole", 1)
+
+        assert delete_excess_revisions(2, chunk_size=1) == 3
+        assert self._versions("SomeRole") == [3, 4]
+        assert self._versions("OtherRole") == [0]
+
+        item = Item.query.filter(Item.name == "SomeRole").one()
+        assert ItemRevision.query.get(item.latest_revision_id).config["Version"] == 4
+
+    def test_thin_old_revisions(self):
+        # 30 revisions an hour apart span 2 days:
+        self._store("SomeRole", 30, days_ago=40)
+        self._store("OtherRole", 3, days_ago=1)
+
+        thin_old_revisions(30)
+        assert len(self._versions("SomeRole")) <= 3
+        assert self._versions("SomeRole")[-1] == 29
+        assert self._versions("OtherRole") == [0, 1, 2]
+
+    def test_delete_inactive_items(self):
+        item = self._store("SomeRole", 2, active=False, days_ago=400)
+        item.issues.append(ItemAudit(score=1, issue="Some Issue", item_id=item.id))
+        db.session.commit()
+        self._store("OtherRole", 2, days_ago=400)
+        self._store("NewRole", 2, active=False, days_ago=1)
+
+        assert delete_inactive_items(365)
+        assert sorted(item.name for item in Item.query.all()) == ["NewRole", "OtherRole"]
+        assert not ItemAudit.query.count()
+        assert ItemRevision.query.count() == 4
+
+    def test_delete_revisions_by_date(self):
+        self._store("SomeRole", 4, days_ago=10)
+        self._store("OtherRole", 2, days_ago=2)
+
+        start = datetime.datetime.utcnow() - datetime.timedelta(days=10) + datetime.timedelta(minutes=30)
+        delete_revisions_by_date(start, datetime.datetime.utcnow(), chunk_size=1)
+
+        # The latest revision of the item is the last one that's left, and the items without any are deleted:
+        assert [item.name for item in Item.query.all()] == ["SomeRole"]
+        item = Item.query.filter(Item.name == "SomeRole").one()
+        assert self._versions("SomeRole") == [0]
+        assert ItemRevision.query.get(item.latest_revision_id).config["Version"] == 0
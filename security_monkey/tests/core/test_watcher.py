@@ -24,10 +24,11 @@ import datetime
 from datetime import timedelta
 import json
 
-from deepdiff import DeepHash
 
 from security_monkey.watcher import Watcher, ChangeItem
-from security_monkey.datastore import Account, AccountType, Datastore, Item, ItemAudit, Technology, ItemRevision
+from security_monkey.datastore import Account, AccountType, Datastore, Item, ItemAudit, Technology, ItemRevision, \
+    hash_item
+from security_monkey.common.hashing import HASH_VERSION, LEGACY_HASH_VERSION
 from security_monkey import db, ARN_PREFIX
 
 from security_monkey.tests import SecurityMonkeyTestCase
@@ -368,6 +369,67 @@ class WatcherTestCase(SecurityMonkeyTestCase):
         revisions = items[0].revisions.all()
         self.assertEqual(len(revisions), 1)
 
+    def test_find_changes_by_hash(self):
+        self._setup_account()
+
+        datastore = Datastore()
+        for name, config in [('unchanged', CONFIG_1), ('changed', CONFIG_1), ('deleted', CONFIG_1)]:
+            ChangeItem(index='test_index', account='test_account', name=name, active=True,
+                       new_config=config).save(datastore)
+
+        current = [
+            ChangeItem(index='test_index', account='test_account', name='unchanged', active=True,
+                       new_config=dict(CONFIG_1)),
+            ChangeItem(index='test_index', account='test_account', name='changed', active=True,
+                       new_config=CONFIG_2),
+            ChangeItem(index='test_index', account='test_account', name='created', active=True,
+                       new_config=CONFIG_1),
+        ]
+
+        watcher = Watcher(accounts=['test_account'])
+        watcher.index = 'test_index'
+
+        loaded = []
+        read_previous_items_by_id = watcher.read_previous_items_by_id
+
+        def record_loaded(item_ids):
+            items = read_previous_items_by_id(item_ids)
+            loaded.extend(item.name for item in items)
+            return items
+
+        watcher.read_previous_items_by_id = record_loaded
+        watcher.find_changes(current=current)
+
+        # Only the deleted and changed items' configurations are loaded:
+        assert sorted(loaded) == ['changed', 'deleted']
+        assert [item.name for item in watcher.created_items] == ['created']
+        assert [item.name for item in watcher.deleted_items] == ['deleted']
+        assert [item.name for item in watcher.changed_items] == ['changed']
+        assert watcher.changed_items[0].old_config == CONFIG_1
+
+    def test_find_changes_by_hash_upgrades_legacy_hashes(self):
+        self._setup_account()
+
+        datastore = Datastore()
+        ChangeItem(index='test_index', account='test_account', name='unchanged', active=True,
+                   new_config=CONFIG_1).save(datastore)
+
+        item = Item.query.filter(Item.name == 'unchanged').one()
+        item.latest_revision_complete_hash, item.latest_revision_durable_hash = hash_item(
+            CONFIG_1, [], hash_version=LEGACY_HASH_VERSION)
+        item.hash_version = None
+        db.session.commit()
+
+        watcher = Watcher(accounts=['test_account'])
+        watcher.index = 'test_index'
+        watcher.find_changes(current=[ChangeItem(index='test_index', account='test_account', name='unchanged',
+                                                 active=True, new_config=dict(CONFIG_1))])
+
+        assert not watcher.changed_items
+        item = Item.query.filter(Item.name == 'unchanged').one()
+        assert item.hash_version == HASH_VERSION == 2
+        assert (item.latest_revision_complete_hash, item.latest_revision_durable_hash) == hash_item(CONFIG_1, [])
+
     def _setup_account(self):
         account_type_result = AccountType(name='AWS')
         db.session.add(account_type_result)
@@ -501,7 +563,7 @@ class WatcherTestCase(SecurityMonkeyTestCase):
         """
         from security_monkey.watchers.iam.iam_role import IAMRole
         from security_monkey.watcher import ensure_item_has_latest_revision_id
-        from security_monkey.datastore import Datastore, durable_hash
+        from security_monkey.datastore import Datastore, durable_hash, hash_item
 
         # Stop the watcher registry from stepping on everyone's toes:
         import security_monkey.watcher
@@ -550,7 +612,7 @@ class WatcherTestCase(SecurityMonkeyTestCase):
         result = ensure_item_has_latest_revision_id(no_revision_item)
         assert result
         assert result.latest_revision_id == ir_one.id
-        assert DeepHash(ACTIVE_CONF)[ACTIVE_CONF] == no_revision_item.latest_revision_complete_hash
+        assert hash_item(ACTIVE_CONF, [])[0] == no_revision_item.latest_revision_complete_hash
         assert durable_hash(ACTIVE_CONF, watcher.ephemeral_paths) == no_revision_item.latest_revision_durable_hash
 
         # Undo the mock:
@@ -261,6 +261,43 @@ class CelerySchedulerTestCase(SecurityMonkeyTestCase):
         security_monkey.task_scheduler.tasks.get_monitors = old_get_monitors
         security_monkey.watchers.iam.iam_role.list_roles = old_list_roles
 
+    @patch("security_monkey.task_scheduler.tasks.chord")
+    @patch("security_monkey.task_scheduler.tasks.get_sm_celery_config_value", lambda x, y, z: True)
+    def test_parallel_batch_dispatch(self, mock_chord):
+        from security_monkey.task_scheduler.tasks import batch_logic
+        from security_monkey.watchers.iam.iam_role import IAMRole
+        import datetime
+
+        test_account = Account.query.filter(Account.name == "TEST_ACCOUNT1").one()
+        watcher = IAMRole(accounts=[test_account.name])
+        watcher.batched_size = 3
+        batched_monitor = Monitor(IAMRole, test_account)
+        batched_monitor.watcher = watcher
+
+        create_date = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        total_list = [{"RoleName": "roleNumber{}".format(x), "CreateDate": create_date, "Region": "us-east-1",
+                       "Arn": ARN_PREFIX + ":iam::012345678910:role/roleNumber{}".format(x)} for x in range(0, 11)]
+
+        def mock_slurp_list():
+            watcher.prep_for_batch_slurp()
+            watcher.total_list.extend(total_list)
+            return total_list, {}
+
+        watcher.slurp_list = mock_slurp_list
+
+        batch_logic(batched_monitor, watcher, test_account.name, False)
+
+        # 11 items with a batch size of 3 is 4 batch tasks:
+        header = list(mock_chord.call_args[0][0])
+        assert len(header) == 4
+        assert mock_chord.return_value.called
+        assert not watcher.created_items
+
+        # The batches should load back exactly as they were listed:
+        watcher.load_batch(header[3].args[2])
+        assert watcher.total_list == total_list[9:]
+        assert not watcher.done_slurping
+
     def test_audit_specific_changes(self):
         from security_monkey.task_scheduler.tasks import _audit_specific_changes
         from security_monkey.monitors import Monitor
@@ -0,0 +1,60 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.tests.utilities.test_ec2_describe_cache
+    :platform: Unix
+.. version:: $$VERSION$$
+"""
+import datetime
+
+from dateutil.tz import tzutc
+from mock import patch, MagicMock
+
+from security_monkey import app
+from security_monkey.common import ec2_describe_cache
+from security_monkey.tests import SecurityMonkeyTestCase
+
+LAUNCH_TIME = datetime.datetime(2020, 1, 1, tzinfo=tzutc())
+
+
+class EC2DescribeCacheTestCase(SecurityMonkeyTestCase):
+    def pre_test_setup(self):
+        self.ec2 = MagicMock()
+        self.ec2.get_paginator.return_value.paginate.return_value = [
+            {'Reservations': [{'Instances': [{'InstanceId': 'i-1', 'LaunchTime': LAUNCH_TIME}]}]},
+            {'Reservations': [{'Instances': [{'InstanceId': 'i-2', 'LaunchTime': LAUNCH_TIME}]}]},
+        ]
+
+    def test_describe_is_shared(self):
+        with patch.dict(app.config, {'EC2_DESCRIBE_CACHE_REDIS_URL': ''}):
+            first = ec2_describe_cache.describe_instances(self.ec2, '012345678910', 'us-west-2')
+            second = ec2_describe_cache.describe_instances(self.ec2, '012345678910', 'us-west-2')
+
+        # All of the pages are combined:
+        assert [r['Instances'][0]['InstanceId'] for r in first['Reservations']] == ['i-1', 'i-2']
+        assert first == second
+        assert second['Reservations'][0]['Instances'][0]['LaunchTime'] == LAUNCH_TIME
+        assert self.ec2.get_paginator.call_count == 1
+
+        # Other regions are fetched separately:
+        with patch.dict(app.config, {'EC2_DESCRIBE_CACHE_REDIS_URL': ''}):
+            ec2_describe_cache.describe_instances(self.ec2, '012345678910', 'us-east-1')
+        assert self.ec2.get_paginator.call_count == 2
+
+    def test_cache_can_be_disabled(self):
+        with patch.dict(app.config, {'EC2_DESCRIBE_CACHE_TTL': 0}):
+            ec2_describe_cache.describe_instances(self.ec2, '012345678910', 'us-west-2')
+            ec2_describe_cache.describe_instances(self.ec2, '012345678910', 'us-west-2')
+
+        assert self.ec2.get_paginator.call_count == 2
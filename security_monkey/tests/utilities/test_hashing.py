@@ -0,0 +1,88 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.tests.utilities.test_hashing
+    :platform: Unix
+.. version:: $$VERSION$$
+"""
+import datetime
+
+from security_monkey.common.hashing import compile_ephemeral_paths, hash_config, HASH_VERSION, LEGACY_HASH_VERSION
+from security_monkey.tests import SecurityMonkeyTestCase
+
+CONFIG = {
+    "UserName": "someuser",
+    "AccessKeys": [
+        {"AccessKeyId": "AKIA1", "Status": "Active", "LastUsedDate": "2020-01-01"},
+        {"AccessKeyId": "AKIA2", "Status": "Inactive", "LastUsedDate": "2020-01-02"},
+    ],
+    "PasswordLastUsed": datetime.datetime(2020, 1, 1),
+    "_version": 2
+}
+
+EPHEMERAL_PATHS = ["PasswordLastUsed", "AccessKeys$*$LastUsedDate", "_version"]
+
+
+def without_ephemerals(config):
+    config = dict(config)
+    config.pop("PasswordLastUsed")
+    config.pop("_version")
+    config["AccessKeys"] = [{k: v for k, v in key.items() if k != "LastUsedDate"} for key in config["AccessKeys"]]
+    return config
+
+
+class HashingTestCase(SecurityMonkeyTestCase):
+    def test_durable_hash_skips_ephemeral_paths(self):
+        complete, durable = hash_config(CONFIG, EPHEMERAL_PATHS)
+
+        # The complete hash doesn't depend on the ephemeral paths:
+        assert complete == hash_config(CONFIG, [])[0]
+        assert complete != durable
+
+        # The durable hash is the same as the hash of the config without the ephemeral paths:
+        assert durable == hash_config(without_ephemerals(CONFIG), [])[0]
+
+        # Key order doesn't matter:
+        reordered = dict(reversed(list(CONFIG.items())))
+        assert hash_config(reordered, EPHEMERAL_PATHS) == (complete, durable)
+
+    def test_ephemeral_changes_only_change_the_complete_hash(self):
+        complete, durable = hash_config(CONFIG, EPHEMERAL_PATHS)
+
+        changed = dict(CONFIG, PasswordLastUsed=datetime.datetime(2020, 2, 1))
+        changed_complete, changed_durable = hash_config(changed, EPHEMERAL_PATHS)
+        assert changed_complete != complete
+        assert changed_durable == durable
+
+        changed = dict(CONFIG, AccessKeys=[dict(CONFIG["AccessKeys"][0], Status="Inactive")])
+        assert hash_config(changed, EPHEMERAL_PATHS)[1] != durable
+
+    def test_legacy_version(self):
+        complete, durable = hash_config(CONFIG, EPHEMERAL_PATHS, hash_version=LEGACY_HASH_VERSION)
+        assert (complete, durable) != hash_config(CONFIG, EPHEMERAL_PATHS, hash_version=HASH_VERSION)
+        assert hash_config(CONFIG, EPHEMERAL_PATHS, hash_version=None) == (complete, durable)
+
+    def test_durable_view(self):
+        config = dict(CONFIG, Tags={"Name": "someuser"})
+        matcher = compile_ephemeral_paths(EPHEMERAL_PATHS)
+        assert compile_ephemeral_paths(list(EPHEMERAL_PATHS)) is matcher
+
+        view = matcher.durable_view(config)
+        assert view == without_ephemerals(config)
+
+        # The config isn't modified, and the parts without ephemeral paths aren't copied:
+        assert config["AccessKeys"][0]["LastUsedDate"] == "2020-01-01"
+        assert view["Tags"] is config["Tags"]
+
+        assert compile_ephemeral_paths([]).durable_view(config) is config
@@ -0,0 +1,62 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.tests.utilities.test_json_delta
+    :platform: Unix
+.. version:: $$VERSION$$
+"""
+from copy import deepcopy
+
+from security_monkey.common.json_delta import apply_delta, make_delta
+from security_monkey.tests import SecurityMonkeyTestCase
+
+OLD = {
+    "GroupName": "default",
+    "Rules": [{"Port": 22, "Cidr": "10.0.0.0/8"}, {"Port": 443, "Cidr": "0.0.0.0/0"}],
+    "Tags": {"a/b": "1", "c~d": "2"},
+    "Enabled": 1,
+    "Removed": "yes"
+}
+
+NEW = {
+    "GroupName": "default",
+    "Rules": [{"Port": 22, "Cidr": "10.0.0.0/16"}, {"Port": 443, "Cidr": "0.0.0.0/0"}],
+    "Tags": {"a/b": "3", "c~d": "2", "e": {"f": []}},
+    "Enabled": True,
+    "Added": [1, 2]
+}
+
+
+class JSONDeltaTestCase(SecurityMonkeyTestCase):
+    def test_delta_round_trip(self):
+        delta = make_delta(OLD, NEW)
+
+        # Only what changed is in the delta:
+        assert {operation["path"] for operation in delta} == {
+            "/Rules/0/Cidr", "/Tags/a~1b", "/Tags/e", "/Enabled", "/Removed", "/Added"}
+
+        old = deepcopy(OLD)
+        assert apply_delta(old, delta) == NEW
+        assert make_delta(NEW, NEW) == []
+
+        # Lists that change length are replaced:
+        assert make_delta([1, 2], [1, 2, 3]) == [{"op": "replace", "path": "", "value": [1, 2, 3]}]
+        assert apply_delta([1, 2], make_delta([1, 2], [1, 2, 3])) == [1, 2, 3]
+
+    def test_applied_values_are_copied(self):
+        delta = make_delta({}, {"a": {"b": 1}})
+        patched = apply_delta({}, delta)
+        patched["a"]["b"] = 2
+
+        assert delta[0]["value"] == {"b": 1}
@@ -0,0 +1,85 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.tests.utilities.test_rate_limiter
+    :platform: Unix
+.. version:: $$VERSION$$
+"""
+from botocore.exceptions import ClientError
+from mock import patch
+
+from security_monkey import app, db
+from security_monkey.common import rate_limiter
+from security_monkey.datastore import AccountType, Account
+from security_monkey.tests import SecurityMonkeyTestCase
+from security_monkey.watcher import Watcher
+
+KEY = ('012345678910', 'iam', 'us-east-1')
+
+
+class RateLimiterTestCase(SecurityMonkeyTestCase):
+    def pre_test_setup(self):
+        self.store = rate_limiter.LocalBucketStore()
+        self.rates = patch.dict(app.config, {'AWS_RATE_LIMIT_INITIAL_RATE': 4, 'AWS_RATE_LIMIT_MIN_RATE': 1,
+                                             'AWS_RATE_LIMIT_MAX_RATE': 8})
+        self.rates.start()
+
+    def tearDown(self):
+        self.rates.stop()
+        rate_limiter.reset()
+        super(RateLimiterTestCase, self).tearDown()
+
+    def test_bucket_paces_calls(self):
+        # The bucket starts with a second's worth of calls:
+        for _ in range(0, 4):
+            assert self.store.reserve(KEY, 100) == 0
+
+        assert self.store.reserve(KEY, 100) == 0.25
+        assert self.store.reserve(KEY, 100) == 0.5
+
+        # Refills at the rate:
+        assert self.store.reserve(KEY, 101) == 0
+
+    def test_rate_is_aimd(self):
+        assert self.store.adjust(KEY, 100, True) == 2
+        # Only decreased once a second:
+        assert self.store.adjust(KEY, 100.5, True) == 2
+        assert self.store.adjust(KEY, 101, True) == 1
+        assert self.store.adjust(KEY, 102, True) == 1
+
+        assert self.store.adjust(KEY, 103, False) == 2
+        assert self.store.adjust(KEY, 103, False) == 2.5
+
+    def test_wrap_retries_throttled_calls(self):
+        account_type = AccountType(name='AWS')
+        db.session.add(account_type)
+        db.session.commit()
+        db.session.add(Account(name="testing", account_type_id=account_type.id, identifier="012345678910",
+                               active=True, third_party=False))
+        db.session.commit()
+
+        responses = [ClientError({'Error': {'Code': 'Throttling'}}, 'ListRoles'), ['role']]
+
+        def aws_call():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        rate_limiter._store = self.store
+        watcher = Watcher(accounts=['testing'])
+        assert watcher.wrap_aws_rate_limited_call(aws_call) == ['role']
+
+        # Halved, then increased by the success:
+        assert self.store.buckets[('testing', 'abstract', None)]['rate'] == 2.5
@@ -0,0 +1,73 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.tests.utilities.test_regions
+    :platform: Unix
+.. version:: $$VERSION$$
+"""
+from mock import patch, MagicMock
+
+from security_monkey import db
+from security_monkey.common import regions
+from security_monkey.datastore import AccountType, Account
+from security_monkey.tests import SecurityMonkeyTestCase
+
+
+DESCRIBE_REGIONS = {
+    'Regions': [
+        {'RegionName': 'us-east-1', 'OptInStatus': 'opt-in-not-required'},
+        {'RegionName': 'us-west-2', 'OptInStatus': 'opt-in-not-required'},
+        {'RegionName': 'ap-east-1', 'OptInStatus': 'not-opted-in'},
+        {'RegionName': 'me-south-1', 'OptInStatus': 'opted-in'},
+    ]
+}
+
+
+class RegionCatalogTestCase(SecurityMonkeyTestCase):
+    def pre_test_setup(self):
+        account_type = AccountType(name='AWS')
+        db.session.add(account_type)
+        db.session.commit()
+
+        self.account = Account(name="testing", account_type_id=account_type.id, identifier="012345678910",
+                               active=True, third_party=False)
+        db.session.add(self.account)
+        db.session.commit()
+
+        regions.clear_cache()
+
+    def tearDown(self):
+        regions.clear_cache()
+        super(RegionCatalogTestCase, self).tearDown()
+
+    @patch('security_monkey.common.regions.get_assumed_role_for_account')
+    @patch('security_monkey.common.regions.get_client')
+    def test_disabled_regions_are_skipped(self, get_client, _):
+        ec2 = MagicMock()
+        ec2.describe_regions.return_value = DESCRIBE_REGIONS
+        get_client.return_value = ec2
+
+        with patch('security_monkey.common.regions.get_available_regions',
+                   return_value=['ap-east-1', 'cn-north-1', 'me-south-1', 'us-east-1', 'us-west-2']):
+            assert regions.get_regions_for_account(self.account, 'ec2') == ['me-south-1', 'us-east-1', 'us-west-2']
+            assert regions.get_regions_for_account(self.account, 'ec2') == ['me-south-1', 'us-east-1', 'us-west-2']
+
+        # The enabled regions are cached:
+        assert ec2.describe_regions.call_count == 1
+
+    @patch('security_monkey.common.regions.get_assumed_role_for_account', side_effect=Exception('AccessDenied'))
+    def test_all_regions_are_checked_if_undescribable(self, _):
+        assert regions.get_enabled_regions(self.account) is None
+        assert regions.is_region_enabled(self.account, 'ap-east-1')
+        assert not regions.is_region_enabled(self.account, 'cn-north-1')
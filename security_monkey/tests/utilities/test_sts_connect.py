@@ -0,0 +1,69 @@
+#     Copyright 2020 Netflix, Inc.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""
+.. module: security_monkey.tests.utilities.test_sts_connect
+    :platform: Unix
+.. version:: $$VERSION$$
+"""
+import datetime
+
+from dateutil.tz import tzutc
+from moto import mock_sts
+
+from security_monkey import db
+from security_monkey.common import sts_connect
+from security_monkey.datastore import AccountType, Account
+from security_monkey.tests import SecurityMonkeyTestCase
+
+
+class STSConnectTestCase(SecurityMonkeyTestCase):
+    def pre_test_setup(self):
+        account_type = AccountType(name='AWS')
+        db.session.add(account_type)
+        db.session.commit()
+
+        self.account = Account(name="testing", account_type_id=account_type.id, identifier="012345678910",
+                               active=True, third_party=False)
+        db.session.add(self.account)
+        db.session.commit()
+
+        sts_connect.clear_cache()
+
+    def tearDown(self):
+        sts_connect.clear_cache()
+        super(STSConnectTestCase, self).tearDown()
+
+    @mock_sts
+    def test_credentials_are_cached(self):
+        role = sts_connect.get_assumed_role_for_account(self.account)
+        assert sts_connect.get_assumed_role_for_account(self.account) is role
+        assert len(sts_connect.CREDENTIALS_CACHE) == 1
+
+        # The same credentials are shared by the CloudAux connections:
+        sts_connect.cloudaux_cached_conn('ec2', account_number="012345678910", assume_role="SecurityMonkey",
+                                         region="us-west-2")
+        assert len(sts_connect.CREDENTIALS_CACHE) == 1
+
+    @mock_sts
+    def test_expiring_credentials_are_refreshed(self):
+        role = sts_connect.get_assumed_role_for_account(self.account)
+        client = sts_connect.get_client(role, 'ec2', region='us-west-2')
+        assert sts_connect.get_client(role, 'ec2', region='us-west-2') is client
+
+        role['Credentials']['Expiration'] = datetime.datetime.now(tzutc()) + datetime.timedelta(minutes=5)
+        new_role = sts_connect.get_assumed_role_for_account(self.account)
+
+        assert new_role is not role
+        assert sts_connect.CREDENTIALS_CACHE[("012345678910", "SecurityMonkey", None)] is new_role
+        assert not [key for key in sts_connect.CLIENT_CACHE if key[0] == role['Credentials']['AccessKeyId']]
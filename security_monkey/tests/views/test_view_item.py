@@ -67,6 +67,6 @@ class ItemApiTestCase(SecurityMonkeyApiTestCase):
         items = Item.query.all()
         for item in items:
             latest_revision = item.revisions.first()
-            item.latest_revision_id = latest_revision.id
+            item.set_latest_revision(latest_revision, repair=True)
             db.session.add(item)
             db.session.commit()
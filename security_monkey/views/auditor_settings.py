@@ -1,10 +1,10 @@
 from security_monkey.views import AuthenticatedService
-from security_monkey.datastore import Account, AuditorSettings, Technology, ItemAudit
+from security_monkey.datastore import Account, AuditorSettings, Technology, ItemAudit, update_item_scores
 from security_monkey.views import AUDITORSETTING_FIELDS
 from security_monkey import db, rbac
 
 from flask_restful import marshal, reqparse
-from sqlalchemy import func
+from sqlalchemy import func, select
 
 
 class AuditorSettingsGet(AuthenticatedService):
@@ -214,5 +214,7 @@ class AuditorSettingsPut(AuthenticatedService):
         results = AuditorSettings.query.get(as_id)
         results.disabled = disabled
         db.session.add(results)
+        db.session.flush()
+        update_item_scores(select([ItemAudit.item_id]).where(ItemAudit.auditor_setting_id == as_id))
         db.session.commit()
         return 200
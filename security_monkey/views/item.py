@@ -23,11 +23,10 @@ from security_monkey.datastore import Account
 from security_monkey.datastore import AccountType
 from security_monkey.datastore import Technology
 from security_monkey.datastore import ItemRevision
+from security_monkey.datastore import filter_revision_configs
 from security_monkey import rbac, AWS_DEFAULT_REGION
 
 from flask_restful import marshal, reqparse
-from sqlalchemy.sql.expression import cast
-from sqlalchemy import String
 from sqlalchemy.orm import joinedload
 
 
@@ -218,7 +217,7 @@ class ItemList(AuthenticatedService):
 
         # Read more about filtering:
         # https://docs.sqlalchemy.org/en/latest/orm/query.html
-        query = Item.query.join((ItemRevision, Item.latest_revision_id == ItemRevision.id))
+        query = Item.query.filter(Item.latest_revision_id != None)  # noqa
         
         # Fix for issue https://github.com/Netflix/security_monkey/issues/1150
         # PR https://github.com/Netflix/security_monkey/pull/1153
@@ -251,12 +250,12 @@ class ItemList(AuthenticatedService):
             query = query.filter(Item.id.in_(ids))
         if 'active' in args:
             active = args['active'].lower() == "true"
-            query = query.filter(ItemRevision.active == active)
+            query = query.filter(Item.latest_active == active)
             query = query.filter(Account.active == True)
             join_account = True
         if 'searchconfig' in args:
-            searchconfig = args['searchconfig']
-            query = query.filter(cast(ItemRevision.config, String).ilike('%{}%'.format(searchconfig)))
+            query = query.join((ItemRevision, Item.latest_revision_id == ItemRevision.id))
+            query = filter_revision_configs(query, args['searchconfig'])
         if 'min_score' in args:
             min_score = args['min_score']
             query = query.filter(Item.score >= min_score)
@@ -267,12 +266,12 @@ class ItemList(AuthenticatedService):
             query = query.join((Account, Account.id == Item.account_id))
  
 
-        # Eager load the joins except for the revisions because of the dynamic lazy relationship
-        query = query.options(joinedload('issues'))
-        query = query.options(joinedload('account'))
+        # Eager load the joins. The issues and revisions aren't needed, since the issue totals and the first and
+        # last seen dates are stored on the items:
+        query = query.options(joinedload('account').joinedload('account_type'))
         query = query.options(joinedload('technology'))
 
-        query = query.order_by(ItemRevision.date_created.desc())
+        query = query.order_by(Item.last_seen.desc().nullslast())
 
         items = query.paginate(page, count)
 
@@ -295,16 +294,10 @@ class ItemList(AuthenticatedService):
                                           'num_issues': item.issue_count,
                                           'issue_score': item.score,
                                           'unjustified_issue_score': item.unjustified_score,
-                                          'active': active,
+                                          'active': item.latest_active,
                                           #'last_rev': item.revisions[0].config,
                                       }.items()))
             else:
-                first_seen_query = ItemRevision.query.filter(
-                    ItemRevision.item_id == item.id
-                ).order_by(ItemRevision.date_created.asc())
-                first_seen = str(first_seen_query.first().date_created)
-                last_seen = str(item.revisions.first().date_created)
-                active = item.revisions.first().active
                 item_marshaled = dict(list(item_marshaled.items()) +
                                       list({
                                           'account': item.account.name,
@@ -313,9 +306,9 @@ class ItemList(AuthenticatedService):
                                           'num_issues': item.issue_count,
                                           'issue_score': item.score,
                                           'unjustified_issue_score': item.unjustified_score,
-                                          'active': active,
-                                          'first_seen': first_seen,
-                                          'last_seen': last_seen
+                                          'active': item.latest_active,
+                                          'first_seen': str(item.first_seen),
+                                          'last_seen': str(item.last_seen)
                                           # 'last_rev': item.revisions[0].config,
                                       }.items()))
 
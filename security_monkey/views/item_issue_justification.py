@@ -14,7 +14,7 @@
 
 from security_monkey.views import AuthenticatedService
 from security_monkey.views import AUDIT_FIELDS
-from security_monkey.datastore import ItemAudit
+from security_monkey.datastore import ItemAudit, update_item_scores
 from security_monkey import db, rbac
 
 from flask_restful import marshal
@@ -89,6 +89,8 @@ class JustifyPostDelete(AuthenticatedService):
         item.justification = args['justification']
 
         db.session.add(item)
+        db.session.flush()
+        update_item_scores([item.item_id])
         db.session.commit()
         db.session.refresh(item)
 
@@ -146,6 +148,8 @@ class JustifyPostDelete(AuthenticatedService):
         item.justification = None
 
         db.session.add(item)
+        db.session.flush()
+        update_item_scores([item.item_id])
         db.session.commit()
 
         return {"status": "deleted"}, 202
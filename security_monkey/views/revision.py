@@ -22,13 +22,12 @@ from security_monkey.datastore import Account
 from security_monkey.datastore import AccountType
 from security_monkey.datastore import Technology
 from security_monkey.datastore import ItemRevision
+from security_monkey.datastore import delta_revisions_exist, filter_revision_configs
 from security_monkey import rbac, AWS_DEFAULT_REGION
 from security_monkey.common.utils import sub_dict
 from collections import OrderedDict
 
 from flask_restful import marshal, reqparse
-from sqlalchemy.sql.expression import cast
-from sqlalchemy import String
 
 
 class RevisionGet(AuthenticatedService):
@@ -216,9 +215,15 @@ class RevisionList(AuthenticatedService):
         if 'active' in args:
             active = args['active'].lower() == "true"
             query = query.filter(ItemRevision.active == active)
+        warning = None
         if 'searchconfig' in args:
-            searchconfig = args['searchconfig']
-            query = query.filter(cast(ItemRevision.config, String).ilike('%{}%'.format(searchconfig)))
+            query = filter_revision_configs(query, args['searchconfig'])
+
+            # The revisions stored as deltas can't be searched, so only the latest revisions are:
+            if delta_revisions_exist():
+                query = query.filter(Item.latest_revision_id == ItemRevision.id)
+                warning = "Older revisions are stored as deltas, and can't be searched. Only the latest " \
+                          "revisions of the items were searched."
         query = query.order_by(ItemRevision.date_created.desc())
         revisions = query.paginate(page, count)
 
@@ -227,6 +232,8 @@ class RevisionList(AuthenticatedService):
             'total': revisions.total,
             'auth': self.auth_dict
         }
+        if warning:
+            marshaled_dict['warning'] = warning
 
         items_marshaled = []
         for revision in revisions.items:
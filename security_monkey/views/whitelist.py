@@ -17,6 +17,7 @@ from six import text_type
 from security_monkey.views import AuthenticatedService
 from security_monkey.views import WHITELIST_FIELDS
 from security_monkey.datastore import NetworkWhitelistEntry
+from security_monkey.object_store import mark_stale
 from security_monkey import db, rbac
 
 from flask_restful import marshal, reqparse
@@ -152,6 +153,7 @@ class WhitelistListPost(AuthenticatedService):
 
         db.session.add(whitelist_entry)
         db.session.commit()
+        mark_stale('networkwhitelist')
         db.session.refresh(whitelist_entry)
 
         whitelistentry_marshaled = marshal(whitelist_entry.__dict__, WHITELIST_FIELDS)
@@ -281,6 +283,7 @@ class WhitelistGetPutDelete(AuthenticatedService):
 
         db.session.add(result)
         db.session.commit()
+        mark_stale('networkwhitelist')
         db.session.refresh(result)
 
         whitelistentry_marshaled = marshal(result.__dict__, WHITELIST_FIELDS)
@@ -319,5 +322,6 @@ class WhitelistGetPutDelete(AuthenticatedService):
         """
         NetworkWhitelistEntry.query.filter(NetworkWhitelistEntry.id == item_id).delete()
         db.session.commit()
+        mark_stale('networkwhitelist')
 
         return {'status': 'deleted'}, 202
@@ -9,22 +9,21 @@
 
 """
 from botocore.exceptions import ClientError
-from deepdiff import DeepHash
 
 from security_monkey.common.PolicyDiff import PolicyDiff
+from security_monkey.common import rate_limiter
 from security_monkey.common.utils import sub_dict
 from security_monkey import app, datastore
 from security_monkey.datastore import Technology, WatcherConfig, store_exception, Account, IgnoreListEntry, db, \
-    ItemRevision, Datastore, durable_hash
+    Item, ItemRevision, Datastore, hash_item
+from security_monkey.common.hashing import HASH_VERSION, LEGACY_HASH_VERSION, compile_ephemeral_paths
 from security_monkey.common.jinja import get_jinja_env
+from security_monkey.object_store import mark_stale
 from security_monkey.alerters.custom_alerter import report_watcher_changes
 
 from boto.exception import BotoServerError
-import time
 
-from copy import deepcopy
-import dpath.util
-from dpath.exceptions import PathNotFound
+from copy import copy
 
 import logging
 
@@ -53,7 +52,6 @@ class Watcher(object, metaclass=WatcherType):
     index = 'abstract'
     i_am_singular = 'Abstract'
     i_am_plural = 'Abstracts'
-    rate_limit_delay = 0
     ignore_list = []
     interval = 60    #in minutes
     active = True
@@ -75,8 +73,6 @@ class Watcher(object, metaclass=WatcherType):
         self.deleted_items = []
         self.changed_items = []
         self.ephemeral_items = []
-        # TODO: grab these from DB, keyed on account
-        self.rate_limit_delay = 0
         self.honor_ephemerals = False
         self.ephemeral_paths = []
 
@@ -146,47 +142,40 @@ class Watcher(object, metaclass=WatcherType):
         return False
 
     def wrap_aws_rate_limited_call(self, awsfunc, *args, **nargs):
-        attempts = 0
+        """
+        Makes the call, retrying it while AWS throttles it. Calls are paced by the token bucket for the
+        account, service, and region of the connection, which is shared with all of the other workers.
 
-        def increase_delay():
-            if self.rate_limit_delay == 0:
-                self.rate_limit_delay = 1
-                app.logger.warn(('Being rate-limited by AWS. Increasing delay on tech {} ' +
-                                'in account {} from 0 to 1 second. Attempt {}')
-                                .format(self.index, self.accounts, attempts))
-            elif self.rate_limit_delay < 4:
-                self.rate_limit_delay = self.rate_limit_delay * 2
-                app.logger.warn(('Still being rate-limited by AWS. Increasing delay on tech {} ' +
-                                'in account {} to {} seconds. Attempt {}')
-                                .format(self.index, self.accounts, self.rate_limit_delay, attempts))
-            else:
-                app.logger.warn(('Still being rate-limited by AWS. Keeping delay on tech {} ' +
-                                'in account {} at {} seconds. Attempt {}')
-                                .format(self.index, self.accounts, self.rate_limit_delay, attempts))
+        boto3 clients made by sts_connect already wait on their bucket (and adjust it) for every request,
+        including botocore's own retries, so this only retries those once botocore gives up.
+        """
+        conn = getattr(awsfunc, '__self__', None)
+        key = getattr(conn, 'rate_limit_key', None) or (','.join(self.accounts), self.index, None)
+        limited_by_events = getattr(conn, 'rate_limited_by_events', False)
+        attempts = 0
 
         while True:
             attempts = attempts + 1
-            try:
-                if self.rate_limit_delay > 0:
-                    time.sleep(self.rate_limit_delay)
+            if not limited_by_events:
+                rate_limiter.acquire(key)
 
+            try:
                 retval = awsfunc(*args, **nargs)
-
-                if self.rate_limit_delay > 0:
-                    app.logger.warn("Successfully Executed Rate-Limited Function. "
-                                    "Tech: {} Account: {}. Removing sleep period."
-                                    .format(self.index, self.accounts))
-                    self.rate_limit_delay = 0
-
-                return retval
             except BotoServerError as e:  # Boto
-                if not e.error_code == 'Throttling':
+                if not rate_limiter.is_throttling_error_code(e.error_code):
                     raise e
-                increase_delay()
             except ClientError as e:  # Botocore
-                if not e.response["Error"]["Code"] == "Throttling":
+                if not rate_limiter.is_throttling_error_code(e.response["Error"]["Code"]):
                     raise e
-                increase_delay()
+            else:
+                if not limited_by_events:
+                    rate_limiter.record_success(key)
+                return retval
+
+            app.logger.warn("Being rate-limited by AWS. Tech: {} Account: {}. Attempt {}".format(
+                self.index, self.accounts, attempts))
+            if not limited_by_events:
+                rate_limiter.record_throttle(key)
 
     def created(self):
         """
@@ -310,6 +299,17 @@ class Watcher(object, metaclass=WatcherType):
             self.created_items.append(new_change_item)
             app.logger.debug("%s: %s/%s/%s created" % (self.i_am_singular, item.account, item.region, item.name))
 
+    @property
+    def ephemeral_matcher(self):
+        """The compiled ephemeral paths of this watcher (see `security_monkey.common.hashing.EphemeralPaths`)."""
+        return compile_ephemeral_paths(self.ephemeral_paths)
+
+    def durable_change_item(self, item):
+        """Returns a shallow copy of the ChangeItem with the durable view of its config."""
+        durable_item = copy(item)
+        durable_item.new_config = self.ephemeral_matcher.durable_view(item.new_config)
+        return durable_item
+
     def find_modified(self, previous=[], current=[], exception_map={}):
         """
         Find any objects that have been changed since the last run of the watcher.
@@ -332,19 +332,9 @@ class Watcher(object, metaclass=WatcherType):
                 eph_change_item = ChangeItem.from_items(old_item=prev_item, new_item=curr_item, source_watcher=self)
 
             if self.ephemerals_skipped():
-                # deepcopy configs before filtering
-                dur_prev_item = deepcopy(prev_item)
-                dur_curr_item = deepcopy(curr_item)
-                # filter-out ephemeral paths in both old and new config dicts
-                if self.ephemeral_paths:
-                    for path in self.ephemeral_paths:
-                        for cfg in [dur_prev_item.config, dur_curr_item.config]:
-                            try:
-                                dpath.util.delete(cfg, path, separator='$')
-                            except PathNotFound:
-                                pass
-
-                # now, compare only non-ephemeral paths
+                # compare only the non-ephemeral paths, without copying the configs
+                dur_prev_item = self.durable_change_item(prev_item)
+                dur_curr_item = self.durable_change_item(curr_item)
                 if not sub_dict(dur_prev_item.config) == sub_dict(dur_curr_item.config):
                     dur_change_item = ChangeItem.from_items(old_item=dur_prev_item, new_item=dur_curr_item,
                                                             source_watcher=self)
@@ -377,26 +367,78 @@ class Watcher(object, metaclass=WatcherType):
             return self.find_changes_batch(current, exception_map)
 
         else:
-            prev = self.read_previous_items()
-            self.find_deleted(previous=prev, current=current, exception_map=exception_map)
-            self.find_new(previous=prev, current=current)
-            self.find_modified(previous=prev, current=current, exception_map=exception_map)
+            self.find_changes_by_hash(current, exception_map)
+
+    def find_changes_by_hash(self, current, exception_map):
+        """
+        Finds the deleted, new, and modified items by comparing the complete hashes of the current configurations
+        with the stored ones. Only the previous configurations of the deleted items, and of the items whose hashes
+        differ, are loaded.
+        """
+        prev_hashes = self.read_previous_hashes()
+        curr_map = {item.location(): item for item in current}
+
+        new_items = []
+        modified_items = []
+        modified_ids = []
+        hash_upgrades = []
+        for location, item in curr_map.items():
+            if location not in prev_hashes:
+                new_items.append(item)
+                continue
+
+            item_id, complete_hash, hash_version = prev_hashes[location]
+            if hash_item(item.config, [], hash_version=hash_version)[0] != complete_hash:
+                modified_items.append(item)
+                modified_ids.append(item_id)
+
+            # Unchanged items that were hashed with an older version are stored with the current version's hashes:
+            elif (hash_version or LEGACY_HASH_VERSION) != HASH_VERSION:
+                new_complete_hash, new_durable_hash = hash_item(item.config, self.ephemeral_paths)
+                hash_upgrades.append({'id': item_id, 'latest_revision_complete_hash': new_complete_hash,
+                                      'latest_revision_durable_hash': new_durable_hash,
+                                      'hash_version': HASH_VERSION})
+
+        if hash_upgrades:
+            db.session.bulk_update_mappings(Item, hash_upgrades)
+            db.session.commit()
+
+        deleted_ids = [item_id for location, (item_id, _, _) in prev_hashes.items() if location not in curr_map]
+
+        self.find_deleted(previous=self.read_previous_items_by_id(deleted_ids), current=[],
+                          exception_map=exception_map)
+        self.find_new(previous=[], current=new_items)
+        self.find_modified(previous=self.read_previous_items_by_id(modified_ids), current=modified_items,
+                           exception_map=exception_map)
 
     def find_changes_batch(self, items, exception_map):
         # Given the list of items, find new items that don't yet exist:
         durable_items = []
 
-        from security_monkey.datastore_utils import hash_item, detect_change, persist_item
+        from security_monkey.datastore_utils import hash_item, detect_change, persist_items, prefetch_items, \
+            load_previous_state, upgrade_legacy_hashes
+
+        # Load all of the items in the batch at once:
+        db_items = prefetch_items(items, self.current_account[0], self.technology)
+
+        changes = []
         for item in items:
             complete_hash, durable_hash = hash_item(item.config, self.ephemeral_paths)
+            upgrade_legacy_hashes(item, db_items.get((item.name, item.region)), self.ephemeral_paths,
+                                  complete_hash, durable_hash)
 
             # Detect if a change occurred:
             is_change, change_type, db_item, created_changed = detect_change(
-                item, self.current_account[0], self.technology, complete_hash, durable_hash)
+                item, self.current_account[0], self.technology, complete_hash, durable_hash, db_items=db_items)
 
-            if not is_change:
-                continue
+            if is_change:
+                changes.append((item, complete_hash, durable_hash, change_type, db_item, created_changed))
+
+        # Only the changed items need their previous issues and configuration:
+        load_previous_state([db_item for _, _, _, _, db_item, created_changed in changes
+                             if created_changed == 'changed'])
 
+        for item, complete_hash, durable_hash, change_type, db_item, created_changed in changes:
             is_durable = (change_type == "durable")
 
             if is_durable:
@@ -406,27 +448,38 @@ class Watcher(object, metaclass=WatcherType):
                 self.created_items.append(ChangeItem.from_items(old_item=None, new_item=item, source_watcher=self))
 
             if created_changed == 'changed':
-                db_item.audit_issues = db_item.issues
-                db_item.config = db_item.revisions.first().config
-
                 # At this point, a durable change was detected. If the complete hash is the same,
                 # then the durable hash is out of date, and this is not a real item change. This could happen if the
-                # ephemeral definitions change (this will be fixed in persist_item).
+                # ephemeral definitions change (this will be fixed in persist_items).
                 # Only add the items to the changed item list that are real item changes:
                 if db_item.latest_revision_complete_hash != complete_hash:
                     self.changed_items.append(ChangeItem.from_items(old_item=db_item, new_item=item,
                                                                     source_watcher=self))
 
-            persist_item(item, db_item, self.technology, self.current_account[0], complete_hash,
-                         durable_hash, is_durable)
+        # Persist the whole batch at once:
+        persist_items([(item, db_item, complete_hash, durable_hash, change_type == "durable")
+                       for item, complete_hash, durable_hash, change_type, db_item, _ in changes],
+                      self.technology, self.current_account[0])
 
         return durable_items
 
-    def find_deleted_batch(self, exception_map):
+    def find_deleted_batch(self, exception_map, existing_arns=None):
+        """
+        Inactivates the items that are no longer present.
+        :param existing_arns: ARNs of all the items that still exist. Defaults to the ARNs in the total list.
+                              This is passed in when the batches were processed by independent Celery tasks.
+        """
         from .datastore_utils import inactivate_old_revisions
-        existing_arns = [item["Arn"] for item in self.total_list if item.get("Arn")]
+        if existing_arns is None:
+            existing_arns = [item["Arn"] for item in self.total_list if item.get("Arn")]
         deleted_items = inactivate_old_revisions(self, existing_arns, self.current_account[0], self.technology)
+        self.add_inactivated_items(deleted_items)
 
+    def add_inactivated_items(self, deleted_items):
+        """
+        Adds the DB items that have just had an inactive revision recorded to the deleted items, so that they
+        are alerted on.
+        """
         for item in deleted_items:
             # An inactive revision has already been commited to the DB.
             # So here, we need to pull the last two revisions to build out our
@@ -447,17 +500,48 @@ class Watcher(object, metaclass=WatcherType):
         :return: List of all items for the given technology and the given account.
         """
         prev_list = []
-        for account in self.accounts:
-            prev = self.datastore.get_all_ctype_filtered(tech=self.index, account=account, include_inactive=False)
-            # Returns a map of {Item: ItemRevision}
-            for item in prev:
-                item_revision = prev[item]
-                new_item = ChangeItem(index=self.index,
-                                      region=item.region,
-                                      account=item.account.name,
-                                      name=item.name,
-                                      new_config=item_revision.config)
-                prev_list.append(new_item)
+        for item, config, account in self.datastore.iter_latest_revisions(tech=self.index, accounts=self.accounts):
+            new_item = ChangeItem(index=self.index,
+                                  region=item.region,
+                                  account=account,
+                                  name=item.name,
+                                  new_config=config)
+            prev_list.append(new_item)
+
+        return prev_list
+
+    def read_previous_hashes(self):
+        """
+        Pulls the complete hash of the last-recorded configuration of each item from the database.
+        :return: dict of item location to a tuple of the item ID, the complete hash, and its hash version.
+        """
+        query = db.session.query(Item.id, Account.name, Item.region, Item.name, Item.latest_revision_complete_hash,
+                                 Item.hash_version) \
+            .join((Technology, Item.tech_id == Technology.id)) \
+            .join((Account, Item.account_id == Account.id)) \
+            .join((ItemRevision, Item.latest_revision_id == ItemRevision.id)) \
+            .filter(Technology.name == self.index, Account.name.in_(self.accounts),
+                    ItemRevision.active == True)  # noqa
+
+        return {(self.index, account, region, name): (item_id, complete_hash, hash_version)
+                for item_id, account, region, name, complete_hash, hash_version in query}
+
+    def read_previous_items_by_id(self, item_ids, chunk_size=1000):
+        """
+        Pulls the last-recorded configuration of the given items from the database.
+        :return: List of ChangeItems.
+        """
+        item_ids = list(item_ids)
+        prev_list = []
+        for i in range(0, len(item_ids), chunk_size):
+            query = db.session.query(Account.name, Item.region, Item.name, ItemRevision.config) \
+                .join((Account, Item.account_id == Account.id)) \
+                .join((ItemRevision, Item.latest_revision_id == ItemRevision.id)) \
+                .filter(Item.id.in_(item_ids[i:i + chunk_size]))
+
+            for account, region, name, config in query:
+                prev_list.append(ChangeItem(index=self.index, region=region, account=account, name=name,
+                                            new_config=config))
 
         return prev_list
 
@@ -498,25 +582,29 @@ class Watcher(object, metaclass=WatcherType):
         """
         app.logger.info("{} deleted {} in {}".format(len(self.deleted_items), self.i_am_plural, self.accounts))
         app.logger.info("{} created {} in {}".format(len(self.created_items), self.i_am_plural, self.accounts))
-        for item in self.created_items + self.deleted_items:
-            item.save(self.datastore)
+        changes = [(item, False) for item in self.created_items + self.deleted_items]
 
         if self.ephemerals_skipped():
-            changed_locations = [item.location() for item in self.changed_items]
+            changed_locations = set(item.location() for item in self.changed_items)
 
             new_item_revisions = [item for item in self.ephemeral_items if item.location() in changed_locations]
             app.logger.info("{} changed {} in {}".format(len(new_item_revisions), self.i_am_plural, self.accounts))
-            for item in new_item_revisions:
-                item.save(self.datastore)
+            changes.extend((item, False) for item in new_item_revisions)
 
             edit_item_revisions = [item for item in self.ephemeral_items if item.location() not in changed_locations]
             app.logger.info("{} ephemerally changed {} in {}".format(len(edit_item_revisions), self.i_am_plural, self.accounts))
-            for item in edit_item_revisions:
-                item.save(self.datastore, ephemeral=True)
+            changes.extend((item, True) for item in edit_item_revisions)
         else:
             app.logger.info("{} changed {} in {}".format(len(self.changed_items), self.i_am_plural, self.accounts))
-            for item in self.changed_items:
-                item.save(self.datastore)
+            changes.extend((item, False) for item in self.changed_items)
+
+        # All of the changes are stored in a single transaction:
+        db_items = self.datastore.store_many(changes, source_watcher=self)
+        for (item, _), db_item in zip(changes, db_items):
+            item.db_item = db_item
+
+        if changes:
+            mark_stale(self.index)
         report_watcher_changes(self)
 
     def plural_name(self):
@@ -684,7 +772,7 @@ def ensure_item_has_latest_revision_id(item):
 
         else:
             # Update the latest revision ID:
-            item.latest_revision_id = current_revision.id
+            item.set_latest_revision(current_revision, repair=True)
 
             # Also need to generate the hashes:
             # 1. Get the watcher class of the item:
@@ -698,8 +786,9 @@ def ensure_item_has_latest_revision_id(item):
             else:
                 ephemeral_paths = []
 
-            item.latest_revision_complete_hash = DeepHash(current_revision.config)[current_revision.config]
-            item.latest_revision_durable_hash = durable_hash(current_revision.config, ephemeral_paths)
+            item.latest_revision_complete_hash, item.latest_revision_durable_hash = hash_item(
+                current_revision.config, ephemeral_paths)
+            item.hash_version = HASH_VERSION
 
             db.session.add(item)
             db.session.commit()
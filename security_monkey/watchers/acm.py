@@ -21,7 +21,9 @@
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey.constants import TROUBLE_REGIONS
+from security_monkey.common.regions import get_regions_for_account
 from security_monkey.exceptions import BotoConnectionIssue
+from security_monkey.datastore import Account
 from security_monkey import app
 
 from dateutil.tz import tzutc
@@ -56,8 +58,8 @@ class ACM(Watcher):
         from security_monkey.common.sts_connect import connect
         for account in self.accounts:
             try:
-                ec2 = connect(account, 'ec2')
-                regions = ec2.get_all_regions()
+                account_db = Account.query.filter(Account.name == account).first()
+                regions = get_regions_for_account(account_db, 'acm')
             except Exception as e:  # EC2ResponseError
                 # Some Accounts don't subscribe to EC2 and will throw an exception here.
                 exc = BotoConnectionIssue(str(e), 'keypair', account, None)
@@ -66,7 +68,7 @@ class ACM(Watcher):
                 continue
 
             for region in regions:
-                app.logger.debug("Checking {}/{}/{}".format(ACM.index, account, region.name))
+                app.logger.debug("Checking {}/{}/{}".format(ACM.index, account, region))
                 try:
                     acm = connect(account, 'boto3.acm.client', region=region, debug=1000)
                     response = self.wrap_aws_rate_limited_call(
@@ -74,9 +76,9 @@ class ACM(Watcher):
                     )
                     cert_list = response.get('CertificateSummaryList')
                 except Exception as e:
-                    if region.name not in TROUBLE_REGIONS:
-                        exc = BotoConnectionIssue(str(e), 'acm', account, region.name)
-                        self.slurp_exception((self.index, account, region.name), exc, exception_map,
+                    if region not in TROUBLE_REGIONS:
+                        exc = BotoConnectionIssue(str(e), 'acm', account, region)
+                        self.slurp_exception((self.index, account, region), exc, exception_map,
                                              source="{}-watcher".format(self.index))
                     continue
                 app.logger.debug("Found {} {}".format(len(cert_list), ACM.i_am_plural))
@@ -101,12 +103,12 @@ class ACM(Watcher):
                             config['RenewalSummary']['UpdatedAt'] = config['RenewalSummary']['UpdatedAt'].astimezone(
                                 tzutc()).isoformat()
 
-                        item = ACMCertificate(region=region.name, account=account, name=cert.get('DomainName'),
+                        item = ACMCertificate(region=region, account=account, name=cert.get('DomainName'),
                                               arn=cert.get('CertificateArn'), config=dict(config), source_watcher=self)
                         item_list.append(item)
                     except Exception as e:
-                        exc = BotoConnectionIssue(str(e), 'acm', account, region.name)
-                        self.slurp_exception((self.index, account, region.name), exc, exception_map,
+                        exc = BotoConnectionIssue(str(e), 'acm', account, region)
+                        self.slurp_exception((self.index, account, region), exc, exception_map,
                                              source="{}-watcher".format(self.index))
 
         return item_list, exception_map
@@ -24,10 +24,11 @@
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey.constants import TROUBLE_REGIONS
+from security_monkey.common.regions import get_regions_for_account
 from security_monkey.datastore import store_exception
 from security_monkey.exceptions import BotoConnectionIssue
+from security_monkey.datastore import Account
 from security_monkey import app
-from boto.cloudtrail import regions
 
 
 class CloudTrail(Watcher):
@@ -50,9 +51,10 @@ class CloudTrail(Watcher):
         exception_map = {}
         from security_monkey.common.sts_connect import connect
         for account in self.accounts:
-            for region in regions():
+            account_db = Account.query.filter(Account.name == account).first()
+            for region in get_regions_for_account(account_db, 'cloudtrail'):
                 app.logger.debug(
-                    "Checking {}/{}/{}".format(self.index, account, region.name))
+                    "Checking {}/{}/{}".format(self.index, account, region))
 
                 try:
                     cloud_trail = connect(
@@ -64,11 +66,11 @@ class CloudTrail(Watcher):
                     trails = response.get('trailList', [])
                 except Exception as e:
                     app.logger.debug("Exception found: {}".format(e))
-                    if region.name not in TROUBLE_REGIONS:
+                    if region not in TROUBLE_REGIONS:
                         exc = BotoConnectionIssue(
-                            str(e), self.index, account, region.name)
+                            str(e), self.index, account, region)
                         self.slurp_exception(
-                            (self.index, account, region.name), exc, exception_map)
+                            (self.index, account, region), exc, exception_map)
                     continue
                 app.logger.debug("Found {} {}.".format(
                     len(trails), self.i_am_plural))
@@ -87,7 +89,7 @@ class CloudTrail(Watcher):
                     except Exception as e:
                         app.logger.debug("Issues getting the status of cloudtrail")
                         # Store it to the database:
-                        location = (self.index, account, region.name, name)
+                        location = (self.index, account, region, name)
                         store_exception("cloudtrail", location, e)
 
                     if self.check_ignore_list(name):
@@ -23,9 +23,10 @@
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey.constants import TROUBLE_REGIONS
+from security_monkey.common.regions import get_regions_for_account
 from security_monkey.exceptions import BotoConnectionIssue
+from security_monkey.datastore import Account
 from security_monkey import app, AWS_DEFAULT_REGION
-from boto.rds import regions
 
 AVAILABLE_REGIONS = [AWS_DEFAULT_REGION]
 
@@ -50,10 +51,11 @@ class Config(Watcher):
         exception_map = {}
         from security_monkey.common.sts_connect import connect
         for account in self.accounts:
-            for region in regions():
+            account_db = Account.query.filter(Account.name == account).first()
+            for region in get_regions_for_account(account_db, 'config'):
                 app.logger.debug(
-                    "Checking {}/{}/{}".format(self.index, account, region.name))
-                if region.name not in AVAILABLE_REGIONS:
+                    "Checking {}/{}/{}".format(self.index, account, region))
+                if region not in AVAILABLE_REGIONS:
                     continue
 
                 try:
@@ -67,11 +69,11 @@ class Config(Watcher):
                     config_rules = response.get('ConfigRules', [])
                 except Exception as e:
                     app.logger.debug("Exception found: {}".format(e))
-                    if region.name not in TROUBLE_REGIONS:
+                    if region not in TROUBLE_REGIONS:
                         exc = BotoConnectionIssue(
-                            str(e), self.index, account, region.name)
+                            str(e), self.index, account, region)
                         self.slurp_exception(
-                            (self.index, account, region.name), exc, exception_map)
+                            (self.index, account, region), exc, exception_map)
                     continue
                 app.logger.debug("Found {} {}.".format(
                     len(config_rules), self.i_am_plural))
@@ -94,7 +96,7 @@ class Config(Watcher):
                     }
 
                     item = ConfigItem(
-                        region=region.name, account=account, name=name,
+                        region=region, account=account, name=name,
                         arn=config_rule.get('ConfigRuleArn'), config=item_config,
                         source_watcher=self)
                     item_list.append(item)
@@ -23,9 +23,10 @@
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey.constants import TROUBLE_REGIONS
+from security_monkey.common.regions import get_regions_for_account
 from security_monkey.exceptions import BotoConnectionIssue
+from security_monkey.datastore import Account
 from security_monkey import app
-from boto.directconnect import regions
 
 
 class Connection(Watcher):
@@ -48,9 +49,10 @@ class Connection(Watcher):
         item_list = []
         exception_map = {}
         for account in self.accounts:
-            for region in regions():
+            account_db = Account.query.filter(Account.name == account).first()
+            for region in get_regions_for_account(account_db, 'directconnect'):
                 app.logger.debug(
-                    "Checking {}/{}/{}".format(self.index, account, region.name))
+                    "Checking {}/{}/{}".format(self.index, account, region))
                 try:
                     dc = connect(
                         account, 'boto3.directconnect.client', region=region)
@@ -59,11 +61,11 @@ class Connection(Watcher):
                     )
                     connections = response.get('connections')
                 except Exception as e:
-                    if region.name not in TROUBLE_REGIONS:
+                    if region not in TROUBLE_REGIONS:
                         exc = BotoConnectionIssue(
-                            str(e), self.index, account, region.name)
+                            str(e), self.index, account, region)
                         self.slurp_exception(
-                            (self.index, account, region.name), exc, exception_map)
+                            (self.index, account, region), exc, exception_map)
                     continue
                 app.logger.debug("Found {} {}.".format(
                     len(connections), self.i_am_plural))
@@ -87,7 +89,7 @@ class Connection(Watcher):
                     }
 
                     item = ConnectionItem(
-                        region=region.name, account=account, name=name, config=dict(config), source_watcher=self)
+                        region=region, account=account, name=name, config=dict(config), source_watcher=self)
                     item_list.append(item)
 
         return item_list, exception_map
@@ -20,6 +20,7 @@
 
 """
 from security_monkey.decorators import record_exception, iter_account_region
+from security_monkey.common import ec2_describe_cache
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey import app
@@ -39,9 +40,8 @@ class EC2Instance(Watcher):
         ec2 = connect(kwargs['account_name'], 'boto3.ec2.client', region=kwargs['region'],
                       assumed_role=kwargs['assumed_role'])
 
-        response = self.wrap_aws_rate_limited_call(
-            ec2.describe_instances
-        )
+        # This is shared with the Security Group watcher for this account and region:
+        response = ec2_describe_cache.describe_instances(ec2, kwargs['account_number'], kwargs['region'])
         reservations = response.get('Reservations')
         return reservations
 
@@ -23,7 +23,10 @@
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey.constants import TROUBLE_REGIONS
+from security_monkey.common.regions import get_regions_for_account
+from security_monkey.common import ec2_describe_cache
 from security_monkey.exceptions import BotoConnectionIssue
+from security_monkey.datastore import Account
 from security_monkey import app
 
 
@@ -57,8 +60,8 @@ class ElasticIP(Watcher):
         from security_monkey.common.sts_connect import connect
         for account in self.accounts:
             try:
-                ec2 = connect(account, 'ec2')
-                regions = ec2.get_all_regions()
+                account_db = Account.query.filter(Account.name == account).first()
+                regions = get_regions_for_account(account_db, 'ec2')
             except Exception as e:  # EC2ResponseError
                 # Some Accounts don't subscribe to EC2 and will throw an exception here.
                 exc = BotoConnectionIssue(str(e), self.index, account, None)
@@ -66,7 +69,7 @@ class ElasticIP(Watcher):
                 continue
 
             for region in regions:
-                app.logger.debug("Checking {}/{}/{}".format(self.index, account, region.name))
+                app.logger.debug("Checking {}/{}/{}".format(self.index, account, region))
 
                 try:
                     rec2 = connect(account, 'boto3.ec2.client', region=region)
@@ -74,13 +77,11 @@ class ElasticIP(Watcher):
                         rec2.describe_addresses
                     )
                     # Retrieve account tags to later match assigned EIP to instance
-                    tags = self.wrap_aws_rate_limited_call(
-                        rec2.describe_tags
-                    )
+                    tags = ec2_describe_cache.describe_tags(rec2, account_db.identifier, region)
                 except Exception as e:
-                    if region.name not in TROUBLE_REGIONS:
-                        exc = BotoConnectionIssue(str(e), self.index, account, region.name)
-                        self.slurp_exception((self.index, account, region.name), exc, exception_map,
+                    if region not in TROUBLE_REGIONS:
+                        exc = BotoConnectionIssue(str(e), self.index, account, region)
+                        self.slurp_exception((self.index, account, region), exc, exception_map,
                                              source="{}-watcher".format(self.index))
                     continue
 
@@ -112,7 +113,7 @@ class ElasticIP(Watcher):
 
                     ip_label = "{0}".format(ip.get('PublicIp'))
 
-                    item = ElasticIPItem(region=region.name, account=account, name=ip_label, config=item_config,
+                    item = ElasticIPItem(region=region, account=account, name=ip_label, config=item_config,
                                          source_watcher=self)
                     item_list.append(item)
 
@@ -10,6 +10,7 @@ class ELB(CloudAuxWatcher):
     i_am_plural = 'ELBs'
     ephemeral_paths = ['_version']
     service_name = 'elb'
+    cloudtrail_event_sources = ['elasticloadbalancing.amazonaws.com']
     detail = app.config.get('SECURITYGROUP_INSTANCE_DETAIL', 'FULL')
 
     def __init__(self, accounts=None, debug=None):
@@ -24,6 +25,12 @@ class ELB(CloudAuxWatcher):
     def list_method(self, **kwargs):
         return describe_load_balancers(**kwargs)
 
+    def list_item_from_cloudtrail(self, event):
+        # ALBs (ELBv2) are referred to by ARN instead:
+        load_balancer_name = (event.get('requestParameters') or {}).get('loadBalancerName')
+        if load_balancer_name:
+            return {'LoadBalancerName': load_balancer_name}
+
     def get_method(self, item, **kwargs):
         result = get_load_balancer(item, **kwargs)
         if self.detail == 'NONE' or self.detail == None:
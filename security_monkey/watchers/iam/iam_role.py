@@ -9,6 +9,7 @@ class IAMRole(CloudAuxBatchedWatcher):
     i_am_singular = 'IAM Role'
     i_am_plural = 'IAM Roles'
     override_region = 'universal'
+    cloudtrail_event_sources = ['iam.amazonaws.com']
 
     def __init__(self, **kwargs):
         super(IAMRole, self).__init__(**kwargs)
@@ -31,6 +32,11 @@ class IAMRole(CloudAuxBatchedWatcher):
 
         return items
 
+    def list_item_from_cloudtrail(self, event):
+        role_name = (event.get('requestParameters') or {}).get('roleName')
+        if role_name:
+            return {'RoleName': role_name, 'Region': AWS_DEFAULT_REGION}
+
     def get_method(self, item, **kwargs):
         # This is not needed for IAM Role:
         item.pop("Region")
@@ -8,6 +8,7 @@ class IAMUser(CloudAuxWatcher):
     index = 'iamuser'
     i_am_singular = 'IAM User'
     i_am_plural = 'IAM Users'
+    cloudtrail_event_sources = ['iam.amazonaws.com']
 
     def __init__(self, *args, **kwargs):
         super(IAMUser, self).__init__(*args, **kwargs)
@@ -29,5 +30,10 @@ class IAMUser(CloudAuxWatcher):
     def list_method(self, **kwargs):
         return list_users(**kwargs)
 
+    def list_item_from_cloudtrail(self, event):
+        user_name = (event.get('requestParameters') or {}).get('userName')
+        if user_name:
+            return {'UserName': user_name}
+
     def get_method(self, item, **kwargs):
         return get_user(item, **kwargs)
@@ -23,6 +23,7 @@
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey.constants import TROUBLE_REGIONS
+from security_monkey.common.regions import get_regions_for_account
 from security_monkey.exceptions import BotoConnectionIssue
 from security_monkey.datastore import Account
 from security_monkey import app, ARN_PREFIX
@@ -52,8 +53,7 @@ class Keypair(Watcher):
             try:
                 account_db = Account.query.filter(Account.name == account).first()
                 account_number = account_db.identifier
-                ec2 = connect(account, 'ec2')
-                regions = ec2.get_all_regions()
+                regions = get_regions_for_account(account_db, 'ec2')
             except Exception as e:  # EC2ResponseError
                 # Some Accounts don't subscribe to EC2 and will throw an exception here.
                 exc = BotoConnectionIssue(str(e), 'keypair', account, None)
@@ -61,7 +61,7 @@ class Keypair(Watcher):
                 continue
 
             for region in regions:
-                app.logger.debug("Checking {}/{}/{}".format(Keypair.index, account, region.name))
+                app.logger.debug("Checking {}/{}/{}".format(Keypair.index, account, region))
 
                 try:
                     rec2 = connect(account, 'boto3.ec2.client', region=region)
@@ -69,9 +69,9 @@ class Keypair(Watcher):
                         rec2.describe_key_pairs
                     )
                 except Exception as e:
-                    if region.name not in TROUBLE_REGIONS:
-                        exc = BotoConnectionIssue(str(e), 'keypair', account, region.name)
-                        self.slurp_exception((self.index, account, region.name), exc, exception_map,
+                    if region not in TROUBLE_REGIONS:
+                        exc = BotoConnectionIssue(str(e), 'keypair', account, region)
+                        self.slurp_exception((self.index, account, region), exc, exception_map,
                                              source="{}-watcher".format(self.index))
                     continue
 
@@ -81,11 +81,11 @@ class Keypair(Watcher):
                         continue
 
                     arn = ARN_PREFIX + ':ec2:{region}:{account_number}:key-pair/{name}'.format(
-                        region=region.name,
+                        region=region,
                         account_number=account_number,
                         name=kp["KeyName"])
 
-                    item_list.append(KeypairItem(region=region.name, account=account, name=kp["KeyName"], arn=arn,
+                    item_list.append(KeypairItem(region=region, account=account, name=kp["KeyName"], arn=arn,
                                                  config={
                                                      'fingerprint': kp["KeyFingerprint"],
                                                      'arn': arn,
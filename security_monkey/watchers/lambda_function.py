@@ -30,6 +30,9 @@ class LambdaFunction(CloudAuxWatcher):
     i_am_singular = 'Lambda Function'
     i_am_plural = 'Lambda Functions'
     service_name = 'lambda'
+    cloudtrail_event_sources = ['lambda.amazonaws.com']
+    # The RevisionId changes with the function's configuration, code, and resource policy:
+    list_fingerprint_fields = ['CodeSha256', 'LastModified', 'RevisionId']
 
     def get_name_from_list_output(self, item):
         return item['FunctionName']
@@ -37,6 +40,18 @@ class LambdaFunction(CloudAuxWatcher):
     def list_method(self, **kwargs):
         return list_functions(**kwargs)
 
+    def list_item_from_cloudtrail(self, event):
+        function_name = (event.get('requestParameters') or {}).get('functionName') or \
+            (event.get('responseElements') or {}).get('functionName')
+        if not function_name:
+            return None
+
+        # This can also be the (possibly qualified) ARN of the function:
+        if function_name.startswith('arn:'):
+            function_name = function_name.split(':')[6]
+
+        return {'FunctionName': function_name}
+
     def get_method(self, item, **kwargs):
         return get_lambda_function(item, **kwargs)
 
@@ -23,9 +23,10 @@
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey.constants import TROUBLE_REGIONS
+from security_monkey.common.regions import get_regions_for_account
 from security_monkey.exceptions import BotoConnectionIssue
+from security_monkey.datastore import Account
 from security_monkey import app
-from boto.rds import regions
 
 
 class RDSClusterSnapshot(Watcher):
@@ -49,9 +50,10 @@ class RDSClusterSnapshot(Watcher):
         item_list = []
         exception_map = {}
         for account in self.accounts:
-            for region in regions():
+            account_db = Account.query.filter(Account.name == account).first()
+            for region in get_regions_for_account(account_db, 'rds'):
                 app.logger.debug(
-                    "Checking {}/{}/{}".format(self.index, account, region.name))
+                    "Checking {}/{}/{}".format(self.index, account, region))
 
                 rds_cluster_snapshots = []
                 try:
@@ -79,11 +81,11 @@ class RDSClusterSnapshot(Watcher):
                             break
 
                 except Exception as e:
-                    if region.name not in TROUBLE_REGIONS:
+                    if region not in TROUBLE_REGIONS:
                         exc = BotoConnectionIssue(
-                            str(e), self.index, account, region.name)
+                            str(e), self.index, account, region)
                         self.slurp_exception(
-                            (self.index, account, region.name), exc, exception_map)
+                            (self.index, account, region), exc, exception_map)
                     continue
 
                 app.logger.debug("Found {} {}".format(
@@ -115,7 +117,7 @@ class RDSClusterSnapshot(Watcher):
                     }
 
                     item = RDSClusterSnapshotItem(
-                        region=region.name, account=account, name=name, config=dict(config), source_watcher=self)
+                        region=region, account=account, name=name, config=dict(config), source_watcher=self)
                     item_list.append(item)
 
         return item_list, exception_map
@@ -23,9 +23,10 @@
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey.constants import TROUBLE_REGIONS
+from security_monkey.common.regions import get_regions_for_account
 from security_monkey.exceptions import BotoConnectionIssue
+from security_monkey.datastore import Account
 from security_monkey import app
-from boto.rds import regions
 
 
 class RDSDBCluster(Watcher):
@@ -54,9 +55,10 @@ class RDSDBCluster(Watcher):
         exception_map = {}
         from security_monkey.common.sts_connect import connect
         for account in self.accounts:
-            for region in regions():
+            account_db = Account.query.filter(Account.name == account).first()
+            for region in get_regions_for_account(account_db, 'rds'):
                 app.logger.debug(
-                    "Checking {}/{}/{}".format(self.index, account, region.name))
+                    "Checking {}/{}/{}".format(self.index, account, region))
 
                 clusters = []
                 try:
@@ -82,11 +84,11 @@ class RDSDBCluster(Watcher):
                             break
 
                 except Exception as e:
-                    if region.name not in TROUBLE_REGIONS:
+                    if region not in TROUBLE_REGIONS:
                         exc = BotoConnectionIssue(
-                            str(e), self.index, account, region.name)
+                            str(e), self.index, account, region)
                         self.slurp_exception(
-                            (self.index, account, region.name), exc, exception_map)
+                            (self.index, account, region), exc, exception_map)
                     continue
 
                 app.logger.debug("Found {} {}".format(
@@ -129,7 +131,7 @@ class RDSDBCluster(Watcher):
                     }
 
                     item = RDSClusterItem(
-                        region=region.name, account=account, name=name, arn=cluster.get('DBClusterArn'),
+                        region=region, account=account, name=name, arn=cluster.get('DBClusterArn'),
                         config=item_config, source_watcher=self)
                     item_list.append(item)
 
@@ -23,12 +23,11 @@
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey.constants import TROUBLE_REGIONS
+from security_monkey.common.regions import get_regions_for_account
 from security_monkey.exceptions import BotoConnectionIssue
 from security_monkey.datastore import Account
 from security_monkey import app, ARN_PREFIX
 
-from boto.redshift import regions
-
 
 class Redshift(Watcher):
     index = 'redshift'
@@ -62,8 +61,8 @@ class Redshift(Watcher):
             account_db = Account.query.filter(Account.name == account).first()
             account_number = account_db.identifier
 
-            for region in regions():
-                app.logger.debug("Checking {}/{}/{}".format(self.index, account, region.name))
+            for region in get_regions_for_account(account_db, 'redshift'):
+                app.logger.debug("Checking {}/{}/{}".format(self.index, account, region))
                 try:
                     redshift = connect(account, 'redshift', region=region)
 
@@ -81,9 +80,9 @@ class Redshift(Watcher):
                             break
 
                 except Exception as e:
-                    if region.name not in TROUBLE_REGIONS:
-                        exc = BotoConnectionIssue(str(e), 'redshift', account, region.name)
-                        self.slurp_exception((self.index, account, region.name), exc, exception_map,
+                    if region not in TROUBLE_REGIONS:
+                        exc = BotoConnectionIssue(str(e), 'redshift', account, region)
+                        self.slurp_exception((self.index, account, region), exc, exception_map,
                                              source="{}-watcher".format(self.index))
                     continue
                 app.logger.debug("Found {} {}".format(len(all_clusters), Redshift.i_am_plural))
@@ -93,13 +92,13 @@ class Redshift(Watcher):
                         continue
 
                     arn = ARN_PREFIX + ':redshift:{region}:{account_number}:cluster:{name}'.format(
-                        region=region.name,
+                        region=region,
                         account_number=account_number,
                         name=cluster_id)
 
                     cluster['arn'] = arn
 
-                    item = RedshiftCluster(region=region.name, account=account, name=cluster_id, arn=arn,
+                    item = RedshiftCluster(region=region, account=account, name=cluster_id, arn=arn,
                                            config=dict(cluster), source_watcher=self)
                     item_list.append(item)
 
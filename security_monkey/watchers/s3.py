@@ -9,6 +9,7 @@ class S3(CloudAuxWatcher):
     index = 's3'
     i_am_singular = 'S3 Bucket'
     i_am_plural = 'S3 Buckets'
+    cloudtrail_event_sources = ['s3.amazonaws.com']
 
     def __init__(self, *args, **kwargs):
         super(S3, self).__init__(*args, **kwargs)
@@ -26,6 +27,13 @@ class S3(CloudAuxWatcher):
     def _get_regions(self):
         return [AWS_DEFAULT_REGION]
 
+    def list_item_from_cloudtrail(self, event):
+        # Object level (data) events don't change the bucket:
+        if not event['eventName'].startswith(('CreateBucket', 'DeleteBucket', 'PutBucket')):
+            return None
+
+        return (event.get('requestParameters') or {}).get('bucketName')
+
     def get_method(self, item_name, **kwargs):
         bucket = get_bucket(item_name, **kwargs)
 
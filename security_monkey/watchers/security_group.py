@@ -23,6 +23,8 @@
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey.constants import TROUBLE_REGIONS
+from security_monkey.common.regions import get_regions_for_account
+from security_monkey.common import ec2_describe_cache
 from security_monkey.exceptions import BotoConnectionIssue
 from security_monkey.datastore import Account
 from security_monkey import app, ARN_PREFIX
@@ -97,8 +99,7 @@ class SecurityGroup(Watcher):
             account_number = account_db.identifier
 
             try:
-                ec2 = connect(account, 'ec2')
-                regions = ec2.get_all_regions()
+                regions = get_regions_for_account(account_db, 'ec2')
             except Exception as e:  # EC2ResponseError
                 # Some Accounts don't subscribe to EC2 and will throw an exception here.
                 exc = BotoConnectionIssue(str(e), self.index, account, None)
@@ -106,7 +107,7 @@ class SecurityGroup(Watcher):
                 continue
 
             for region in regions:
-                app.logger.debug("Checking {}/{}/{}".format(self.index, account, region.name))
+                app.logger.debug("Checking {}/{}/{}".format(self.index, account, region))
 
                 try:
                     rec2 = connect(account, 'boto3.ec2.client', region=region)
@@ -117,18 +118,15 @@ class SecurityGroup(Watcher):
 
                     if self.get_detail_level() != 'NONE':
                         # We fetch tags here to later correlate instances
-                        tags = self.wrap_aws_rate_limited_call(
-                            rec2.describe_tags
-                        )
+                        # These are shared with the other EC2 watchers for this account and region:
+                        tags = ec2_describe_cache.describe_tags(rec2, account_number, region)
                         # Retrieve all instances
-                        instances = self.wrap_aws_rate_limited_call(
-                            rec2.describe_instances
-                        )
-                        app.logger.info("Number of instances found in region {}: {}".format(region.name, len(instances)))
+                        instances = ec2_describe_cache.describe_instances(rec2, account_number, region)
+                        app.logger.info("Number of instances found in region {}: {}".format(region, len(instances)))
                 except Exception as e:
-                    if region.name not in TROUBLE_REGIONS:
-                        exc = BotoConnectionIssue(str(e), self.index, account, region.name)
-                        self.slurp_exception((self.index, account, region.name), exc, exception_map,
+                    if region not in TROUBLE_REGIONS:
+                        exc = BotoConnectionIssue(str(e), self.index, account, region)
+                        self.slurp_exception((self.index, account, region), exc, exception_map,
                                              source="{}-watcher".format(self.index))
                     continue
 
@@ -162,7 +160,7 @@ class SecurityGroup(Watcher):
                         continue
 
                     arn = ARN_PREFIX + ':ec2:{region}:{account_number}:security-group/{security_group_id}'.format(
-                        region=region.name,
+                        region=region,
                         account_number=account_number,
                         security_group_id=sg['GroupId'])
 
@@ -172,7 +170,7 @@ class SecurityGroup(Watcher):
                         "description": sg.get('Description'),
                         "vpc_id": sg.get('VpcId'),
                         "owner_id": sg.get('OwnerId'),
-                        "region": region.name,
+                        "region": region,
                         "rules": [],
                         "assigned_to": None,
                         "arn": arn
@@ -209,7 +207,7 @@ class SecurityGroup(Watcher):
                     else:
                         sg_name = "{0} ({1})".format(sg['GroupName'], sg['GroupId'])
 
-                    item = SecurityGroupItem(region=region.name, account=account, name=sg_name, arn=arn,
+                    item = SecurityGroupItem(region=region, account=account, name=sg_name, arn=arn,
                                              config=item_config, source_watcher=self)
                     item_list.append(item)
 
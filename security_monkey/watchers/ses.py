@@ -23,11 +23,11 @@
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey.constants import TROUBLE_REGIONS
+from security_monkey.common.regions import get_regions_for_account
 from security_monkey.exceptions import BotoConnectionIssue
+from security_monkey.datastore import Account
 from security_monkey import app
 
-from boto.ses import regions
-
 
 class SES(Watcher):
     index = 'ses'
@@ -49,16 +49,17 @@ class SES(Watcher):
         item_list = []
         exception_map = {}
         for account in self.accounts:
-            for region in regions():
+            account_db = Account.query.filter(Account.name == account).first()
+            for region in get_regions_for_account(account_db, 'ses'):
 
-                if region.name == 'eu-central-1':
+                if region == 'eu-central-1':
                     # as of boto 2.34.0, boto cannot connect to ses in eu-central-1
                     # TODO: Remove this if-block when boto can handle ses in eu-central-1
                     continue
 
-                app.logger.debug("Checking {}/{}/{}".format(self.index, account, region.name))
+                app.logger.debug("Checking {}/{}/{}".format(self.index, account, region))
                 try:
-                    ses = connect(account, 'ses', region=region.name)
+                    ses = connect(account, 'ses', region=region)
                     response = self.wrap_aws_rate_limited_call(
                         ses.list_identities
                     )
@@ -87,9 +88,9 @@ class SES(Watcher):
                     verified_identities = response.VerifiedEmailAddresses
                     verified_identities += verified_domains
                 except Exception as e:
-                    if region.name not in TROUBLE_REGIONS:
-                        exc = BotoConnectionIssue(str(e), self.index, account, region.name)
-                        self.slurp_exception((self.index, account, region.name), exc, exception_map,
+                    if region not in TROUBLE_REGIONS:
+                        exc = BotoConnectionIssue(str(e), self.index, account, region)
+                        self.slurp_exception((self.index, account, region), exc, exception_map,
                                              source="{}-watcher".format(self.index))
                     continue
                 app.logger.debug("Found {} {}. {} are verified.".format(len(identities), self.i_am_plural,
@@ -103,7 +104,7 @@ class SES(Watcher):
                         'verified': identity in verified_identities
                     }
 
-                    item = SESItem(region=region.name, account=account, name=identity, config=dict(config),
+                    item = SESItem(region=region, account=account, name=identity, config=dict(config),
                                    source_watcher=self)
                     item_list.append(item)
 
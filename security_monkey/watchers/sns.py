@@ -23,14 +23,15 @@
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey.constants import TROUBLE_REGIONS
+from security_monkey.common.regions import get_regions_for_account
 from security_monkey.exceptions import InvalidARN
 from security_monkey.exceptions import InvalidAWSJSON
 from security_monkey.exceptions import BotoConnectionIssue
+from security_monkey.datastore import Account
 from security_monkey import app, ARN_PREFIX
 
 import json
 import re
-from boto.sns import regions
 
 
 class SNS(Watcher):
@@ -53,13 +54,14 @@ class SNS(Watcher):
         item_list = []
         exception_map = {}
         for account in self.accounts:
-            for region in regions():
+            account_db = Account.query.filter(Account.name == account).first()
+            for region in get_regions_for_account(account_db, 'sns'):
                 try:
                     (sns, topics) = self.get_all_topics_in_region(account, region)
                 except Exception as e:
-                    if region.name not in TROUBLE_REGIONS:
-                        exc = BotoConnectionIssue(str(e), 'sns', account, region.name)
-                        self.slurp_exception((self.index, account, region.name), exc, exception_map,
+                    if region not in TROUBLE_REGIONS:
+                        exc = BotoConnectionIssue(str(e), 'sns', account, region)
+                        self.slurp_exception((self.index, account, region), exc, exception_map,
                                              source="{}-watcher".format(self.index))
                     continue
 
@@ -72,7 +74,7 @@ class SNS(Watcher):
 
                     item = self.build_item(arn=arn,
                                            conn=sns,
-                                           region=region.name,
+                                           region=region,
                                            account=account,
                                            exception_map=exception_map)
                     if item:
@@ -82,7 +84,7 @@ class SNS(Watcher):
     def get_all_topics_in_region(self, account, region):
         from security_monkey.common.sts_connect import connect
         sns = connect(account, 'sns', region=region)
-        app.logger.debug("Checking {}/{}/{}".format(SNS.index, account, region.name))
+        app.logger.debug("Checking {}/{}/{}".format(SNS.index, account, region))
         topics = []
         marker = None
         while True:
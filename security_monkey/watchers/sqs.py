@@ -30,6 +30,7 @@ class SQS(CloudAuxBatchedWatcher):
     index = 'sqs'
     i_am_singular = 'SQS Policy'
     i_am_plural = 'SQS Policies'
+    cloudtrail_event_sources = ['sqs.amazonaws.com']
 
     def __init__(self, **kwargs):
         super(SQS, self).__init__(**kwargs)
@@ -81,6 +82,23 @@ class SQS(CloudAuxBatchedWatcher):
 
         return items
 
+    def list_item_from_cloudtrail(self, event):
+        # Message level (data) events don't change the queue:
+        if event['eventName'] not in ['CreateQueue', 'DeleteQueue', 'SetQueueAttributes', 'AddPermission',
+                                      'RemovePermission', 'TagQueue', 'UntagQueue']:
+            return None
+
+        url = (event.get('requestParameters') or {}).get('queueUrl') or \
+            (event.get('responseElements') or {}).get('queueUrl')
+        if url:
+            return {"Url": url, "Region": event['awsRegion']}
+
+    def load_batch(self, batch):
+        super(SQS, self).load_batch(batch)
+
+        # The lookup table from the list call is not available to a dispatched batch, so rebuild it:
+        self.corresponding_items = {item["Url"]: count for count, item in enumerate(self.total_list)}
+
     def get_method(self, item, **kwargs):
         try:
             queue = get_queue(item["Url"], **kwargs)
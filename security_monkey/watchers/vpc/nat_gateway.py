@@ -23,11 +23,11 @@
 from security_monkey.watcher import Watcher
 from security_monkey.watcher import ChangeItem
 from security_monkey.constants import TROUBLE_REGIONS
+from security_monkey.common.regions import get_regions_for_account
 from security_monkey.exceptions import BotoConnectionIssue
+from security_monkey.datastore import Account
 from security_monkey import app
 
-from boto.vpc import regions
-
 
 class NATGateway(Watcher):
     index = 'natgateway'
@@ -50,9 +50,10 @@ class NATGateway(Watcher):
         exception_map = {}
         from security_monkey.common.sts_connect import connect
         for account in self.accounts:
-            for region in regions():
+            account_db = Account.query.filter(Account.name == account).first()
+            for region in get_regions_for_account(account_db, 'ec2'):
                 app.logger.debug(
-                    "Checking {}/{}/{}".format(self.index, account, region.name))
+                    "Checking {}/{}/{}".format(self.index, account, region))
                 try:
                     conn = connect(account, 'boto3.ec2.client', region=region)
                     all_nat_gateways_resp = self.wrap_aws_rate_limited_call(
@@ -62,11 +63,11 @@ class NATGateway(Watcher):
                     all_nat_gateways = all_nat_gateways_resp.get(
                         'NatGateways', [])
                 except Exception as e:
-                    if region.name not in TROUBLE_REGIONS:
+                    if region not in TROUBLE_REGIONS:
                         exc = BotoConnectionIssue(
-                            str(e), self.index, account, region.name)
+                            str(e), self.index, account, region)
                         self.slurp_exception(
-                            (self.index, account, region.name), exc, exception_map)
+                            (self.index, account, region), exc, exception_map)
                     continue
                 app.logger.debug("Found {} {}".format(
                     len(all_nat_gateways), self.i_am_plural))
@@ -101,7 +102,7 @@ class NATGateway(Watcher):
                     }
 
                     item = NATGatewayItem(
-                        region=region.name, account=account, name=nat_gateway_name, config=config, source_watcher=self)
+                        region=region, account=account, name=nat_gateway_name, config=config, source_watcher=self)
                     item_list.append(item)
 
         return item_list, exception_map
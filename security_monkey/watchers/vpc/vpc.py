@@ -19,17 +19,17 @@
 .. moduleauthor:: Mike Grima <mgrima@netflix.com>
 
 """
-from boto3 import Session
-
 from security_monkey.cloudaux_watcher import CloudAuxWatcher
 from cloudaux.aws.ec2 import describe_vpcs
 from cloudaux.orchestration.aws.vpc import get_vpc
+from security_monkey.common.regions import get_available_regions
 
 
 class VPC(CloudAuxWatcher):
     index = 'vpc'
     i_am_singular = 'VPC'
     i_am_plural = 'VPCs'
+    cloudtrail_event_sources = ['ec2.amazonaws.com']
 
     def __init__(self, *args, **kwargs):
         super(VPC, self).__init__(*args, **kwargs)
@@ -41,12 +41,18 @@ class VPC(CloudAuxWatcher):
         return describe_vpcs(**kwargs)
 
     def _get_regions(self):
-        s = Session()
-        return s.get_available_regions("ec2")
+        return get_available_regions("ec2")
 
     def get_name_from_list_output(self, item):
         return item["VpcId"]
 
+    def list_item_from_cloudtrail(self, event):
+        # Anything that changes a VPC, or its subnets, route tables, gateways, etc. references its ID:
+        vpc_id = (event.get('requestParameters') or {}).get('vpcId') or \
+            ((event.get('responseElements') or {}).get('vpc') or {}).get('vpcId')
+        if vpc_id:
+            return {"VpcId": vpc_id}
+
     def get_method(self, item, **kwargs):
         vpc = get_vpc(item["VpcId"], **kwargs)
         # Need to provide the friendly name: